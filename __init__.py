@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 # Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
 
+from . import controllers
 from . import models
 from . import wizard
@@ -3,7 +3,7 @@
 
 {
     'name': 'BP Optical POS',
-    'version': '17.0.2.0.2',
+    'version': '17.0.2.5.0',
     'category': 'Point of Sale',
     'summary': 'Optical POS integration: optical tests, insurance payments, and analytics.',
     'author': 'Blackpaw Innovations',
@@ -17,16 +17,27 @@
         'security/bp_optical_pos_security.xml',
         'security/ir.model.access.csv',
         'data/insurance_journal.xml',
+        'data/ir_cron.xml',
         'views/pos_optical_menu_views.xml',
         'views/stock_location_views.xml',
         'views/pos_config_optical_views.xml',
         'views/pos_payment_method_views.xml',
+        'views/pos_order_views.xml',
         'views/account_move_insurance_views.xml',
+        'views/optical_insurance_payment_views.xml',
+        'views/optical_insurance_utilization_views.xml',
+        'views/optical_invoice_job_views.xml',
+        'views/optical_branch_kpi_views.xml',
+        'views/optical_staff_report_views.xml',
+        'views/optical_test_stage_log_views.xml',
+        'views/optical_recall_views.xml',
         'views/optical_branch_views.xml',
         'views/optical_optician_views.xml',
         'views/optical_test_views.xml',
         'views/res_config_settings_views.xml',
         'wizard/optical_branch_pl_wizard_views.xml',
+        'wizard/optical_patient_import_wizard_views.xml',
+        'wizard/optical_test_import_wizard_views.xml',
         'report/pending_insurance_report.xml',
         'report/optical_branch_pl_report.xml',
     ],
@@ -38,8 +49,10 @@
             'bp_optical_pos/static/src/js/insurance_form_popup.js',
             'bp_optical_pos/static/src/js/optical_test_popup.js',
             'bp_optical_pos/static/src/js/optical_test_button.js',
+            'bp_optical_pos/static/src/js/optical_partner_details.js',
             'bp_optical_pos/static/src/js/optical_models_ext.js',
             'bp_optical_pos/static/src/js/partner_editor_ext.js',
+            'bp_optical_pos/static/src/js/partner_search_ext.js',
             'bp_optical_pos/static/src/js/partner_optical_history.js',
             'bp_optical_pos/static/src/js/stage_change_popup.js',
             'bp_optical_pos/static/src/js/test_stage_button.js',
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Query-count and latency benchmark of the optical POS hot paths.
+
+Seeds synthetic data at several scales inside a transaction that is rolled
+back at the end, measures each hot path and checks it against a budget
+(maximum queries and median milliseconds). Paths that must not issue more
+queries as data grows are also checked for flat query counts across scales.
+The process exits with status 1 when a check fails, so it can gate a release.
+
+    python3 benchmarks/bench_hot_paths.py -c /etc/odoo.conf -d bench_db -o hot_paths.json
+    python3 benchmarks/bench_hot_paths.py -d bench_db --partners 1000,10000,50000 --move-lines 10000,100000
+
+Prerequisites in the database: an opened session of an optical POS
+configuration with an insurance and a non-insurance payment method, a
+product available in POS, a customer, an insurance company, an optical test
+to clone and a branch with an analytic account. Cases whose prerequisites are
+missing are reported as skipped.
+"""
+
+import datetime
+import json
+import sys
+
+from common import (
+    build_ui_order, clone_rows, environment, find_optical_session, load_registry,
+    make_parser, measure, write_results,
+)
+
+# Budgets per case: maximum queries and maximum median milliseconds. Override
+# them with --budgets pointing at a JSON file of the same shape.
+DEFAULT_BUDGETS = {
+    'partner_load': {'max_queries': 60, 'max_ms': None},
+    'partner_search': {'max_queries': 20, 'max_ms': 300},
+    'partner_duplicates': {'max_queries': 10, 'max_ms': 50},
+    'move_patient_insurance': {'max_queries': 4, 'max_ms': 100},
+    'process_order_insurance': {'max_queries': 400, 'max_ms': 2000},
+    'order_paid_insurance': {'max_queries': 150, 'max_ms': 1000},
+    'generate_invoice_insurance': {'max_queries': 300, 'max_ms': 1500},
+    'finalize_payments_batch': {'max_queries': 20, 'max_ms': 300},
+    'patient_tests_full': {'max_queries': 30, 'max_ms': 200},
+    'staff_report': {'max_queries': 5, 'max_ms': 1000},
+    'branch_pl_report': {'max_queries': None, 'max_ms': None},
+}
+
+# Cases whose query count must not depend on the amount of data
+FLAT_QUERY_CASES = ('partner_load', 'move_patient_insurance', 'finalize_payments_batch', 'branch_pl_report')
+
+
+def _scales(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+class HotPathBenchmark:
+
+    def __init__(self, env, args):
+        self.env = env
+        self.args = args
+        self.results = {}
+        self.skipped = {}
+        self.session = find_optical_session(env)
+        config = self.session.config_id
+        self.insurance_method = config.payment_method_ids.filtered('is_insurance_method')[:1]
+        self.cash_method = config.payment_method_ids.filtered(
+            lambda m: not m.is_insurance_method and m.type != 'pay_later')[:1]
+        self.product = env['product.product'].search([('available_in_pos', '=', True)], limit=1)
+        self.partner = env['res.partner'].search([('customer_rank', '>', 0)], limit=1) \
+            or env['res.partner'].search([('type', '=', 'contact'), ('is_company', '=', False)], limit=1)
+        self.insurer = env['optical.insurance.company'].search([], limit=1)
+        self.sequence = 9000
+
+    def record(self, case, scale, stats):
+        self.results.setdefault(case, {})[str(scale)] = stats
+        print("%-28s %10s %8d queries %10.2f ms" % (case, scale, stats['queries'], stats['median_ms']))
+
+    def skip(self, case, reason):
+        self.skipped[case] = reason
+        print("%-28s skipped: %s" % (case, reason))
+
+    # ------------------------------------------------------------------
+    # Partner loading at session open
+    # ------------------------------------------------------------------
+    def bench_partner_load(self):
+        if not self.session or not self.partner:
+            return self.skip('partner_load', "no opened optical session or customer")
+        scales = _scales(self.args.partners)
+        partner_ids = clone_rows(self.env.cr, 'res_partner', self.partner.id, max(scales), {
+            'name': "'Bench Patient ' || gs",
+            'complete_name': "'Bench Patient ' || gs",
+            'email': "'bench.patient.' || gs || '@example.com'",
+            'phone': "'+2547' || lpad(gs::text, 8, '0')",
+            'optical_phone_key': "'7' || lpad(gs::text, 8, '0')",
+            'optical_mobile_key': "NULL",
+            'optical_email_key': "'bench.patient.' || gs || '@example.com'",
+        })
+        params = self.session._loader_params_res_partner()
+        search_params = params['search_params']
+        for scale in scales:
+            domain = list(search_params.get('domain') or []) + [('id', 'in', partner_ids[:scale])]
+            loader = dict(search_params, domain=domain)
+            stats = measure(self.env, lambda: self.env['res.partner'].search_read(**loader), repeat=self.args.repeat)
+            # Size of what the till downloads at session opening
+            stats['payload_bytes'] = len(json.dumps(self.env['res.partner'].search_read(**loader), default=str))
+            self.record('partner_load', scale, stats)
+        # Server search among all the seeded partners (trigram indexes)
+        self.env.cr.execute("ANALYZE res_partner")
+        self.record('partner_search', max(scales), measure(
+            self.env, lambda: self.session.optical_search_partners('patient 4242'), repeat=self.args.repeat))
+        # Duplicate candidates of a new customer at the till
+        new_customer = {
+            'name': 'Bench Patiant 4242',
+            'phone': '0700 004 242',
+            'email': 'Bench.Patient.4242@Example.com',
+        }
+        self.record('partner_duplicates', max(scales), measure(
+            self.env, lambda: self.env['res.partner'].optical_find_duplicates(new_customer), repeat=self.args.repeat))
+
+    # ------------------------------------------------------------------
+    # Invoice lists (insurance toggle visibility)
+    # ------------------------------------------------------------------
+    def bench_move_insurance_flag(self):
+        template = self.env['account.move'].search([('move_type', '=', 'out_invoice')], limit=1)
+        if not template or not self.partner:
+            return self.skip('move_patient_insurance', "no customer invoice to clone")
+        scales = _scales(self.args.invoices)
+        # One customer per invoice, so the grouped lookup sees distinct partners
+        partner_ids = clone_rows(self.env.cr, 'res_partner', self.partner.id, max(scales), {
+            'name': "'Bench Invoice Customer ' || gs",
+            'complete_name': "'Bench Invoice Customer ' || gs",
+        })
+        move_ids = clone_rows(self.env.cr, 'account_move', template.id, max(scales), {
+            'name': "'BENCH/INV/' || gs",
+            'state': "'draft'",
+            'partner_id': "(%(partners)s::int[])[gs]",
+        }, {'partners': partner_ids})
+        Move = self.env['account.move']
+        for scale in scales:
+            moves = Move.browse(move_ids[:scale])
+            self.record('move_patient_insurance', scale, measure(
+                self.env, lambda: moves.mapped('patient_has_insurance'), repeat=self.args.repeat))
+
+    # ------------------------------------------------------------------
+    # Order sync with insurance payments
+    # ------------------------------------------------------------------
+    def _insurance_payload(self, to_invoice=True):
+        self.sequence += 1
+        payload = build_ui_order(self.session, self.partner, self.product, [
+            (self.cash_method, 40.0, None),
+            (self.insurance_method, 60.0, {
+                'insurance_company_id': self.insurer.id,
+                'policy_number': 'BENCH-%d' % self.sequence,
+                'member_number': 'M-%d' % self.sequence,
+                'employer': 'Bench Employer',
+                'notes': '',
+            }),
+        ], self.sequence)
+        payload['data']['to_invoice'] = to_invoice
+        payload['to_invoice'] = to_invoice
+        return payload
+
+    def _draft_order(self):
+        result = self.env['pos.order'].create_from_ui([self._insurance_payload()], draft=True)
+        return self.env['pos.order'].browse(result[0]['id'])
+
+    def bench_order_pipeline(self):
+        if not (self.session and self.insurance_method and self.cash_method and self.product
+                and self.partner and self.insurer):
+            return self.skip('process_order_insurance',
+                             "needs an optical session with insurance and cash methods, a product, a customer and an insurer")
+        Order = self.env['pos.order']
+        repeat = self.args.repeat
+        self.record('process_order_insurance', 1, measure(
+            self.env, lambda payload: Order.create_from_ui([payload]),
+            repeat=repeat, setup=self._insurance_payload))
+        self.record('order_paid_insurance', 1, measure(
+            self.env, lambda order: order.action_pos_order_paid(),
+            repeat=repeat, setup=self._draft_order))
+
+        def paid_order():
+            order = self._draft_order()
+            order.with_context(generate_pdf=False).action_pos_order_paid()
+            return order
+
+        self.record('generate_invoice_insurance', 1, measure(
+            self.env, lambda order: order.with_context(generate_pdf=False)._generate_pos_order_invoice(),
+            repeat=repeat, setup=paid_order))
+
+    # ------------------------------------------------------------------
+    # Payment summaries of a whole session's invoiced orders
+    # ------------------------------------------------------------------
+    def bench_finalize_payments(self):
+        scales = _scales(self.args.finalize_orders)
+        Order = self.env['pos.order']
+        orders = Order.search([('account_move', '!=', False), ('pos_reference', '!=', False)], limit=max(scales))
+        if len(orders) < min(scales):
+            return self.skip('finalize_payments_batch', "needs at least %d invoiced POS orders" % min(scales))
+        for scale in scales:
+            if scale > len(orders):
+                break
+            order_uids = orders[:scale].mapped('pos_reference')
+            self.record('finalize_payments_batch', scale, measure(
+                self.env, lambda: Order.optical_finalize_payments_batch(order_uids), repeat=self.args.repeat))
+
+    # ------------------------------------------------------------------
+    # Patient history in the POS
+    # ------------------------------------------------------------------
+    def bench_patient_tests(self):
+        template = self.env['optical.test'].search([], limit=1)
+        if not template or not self.partner:
+            return self.skip('patient_tests_full', "no optical test to clone")
+        clone_rows(self.env.cr, 'optical_test', template.id, 50, {
+            'name': "t.name || '/B' || gs",
+            'patient_id': '%(patient)s',
+            'test_date': "now() - (gs || ' days')::interval",
+        }, {'patient': self.partner.id})
+        Order = self.env['pos.order']
+        for limit in (10, 50):
+            self.record('patient_tests_full', limit, measure(
+                self.env, lambda: Order.optical_get_patient_tests_full(self.partner.id, limit),
+                repeat=self.args.repeat))
+
+    # ------------------------------------------------------------------
+    # Staff throughput over a year of tests
+    # ------------------------------------------------------------------
+    def bench_staff_report(self):
+        template = self.env['optical.test'].search([], limit=1)
+        if not template:
+            return self.skip('staff_report', "no optical test to clone")
+        clone_rows(self.env.cr, 'optical_test', template.id, self.args.year_tests, {
+            'name': "t.name || '/Y' || gs",
+            'test_date': "now() - ((gs %% 365) || ' days')::interval",
+        })
+        self.env.cr.execute("ANALYZE optical_test")
+        Report = self.env['optical.staff.report']
+        domain = [('test_date', '>=', datetime.datetime.now() - datetime.timedelta(days=365))]
+        aggregates = ['test_count:sum', 'converted_count:sum', 'hours_to_sale:avg', 'turnaround_hours:avg']
+        self.record('staff_report', self.args.year_tests, measure(
+            self.env, lambda: Report._read_group(domain, ['optometrist_id', 'branch_id'], aggregates),
+            repeat=self.args.repeat))
+
+    # ------------------------------------------------------------------
+    # Branch P&L report
+    # ------------------------------------------------------------------
+    def bench_branch_pl(self):
+        branch = self.env['optical.branch'].search([('analytic_account_id', '!=', False)], limit=1)
+        template = self.env['account.move.line'].search([
+            ('parent_state', '=', 'posted'),
+            ('account_id.account_type', 'in', ('income', 'expense')),
+        ], limit=1)
+        if not branch or not template:
+            return self.skip('branch_pl_report', "needs a branch with an analytic account and a posted income/expense line")
+        today = datetime.date.today()
+        data = {'form': {
+            'date_from': today - datetime.timedelta(days=30),
+            'date_to': today,
+            'branch_ids': branch.ids,
+            'target_move': 'posted',
+        }}
+        Report = self.env['report.bp_optical_pos.report_optical_branch_pl']
+        seeded = 0
+        for scale in _scales(self.args.move_lines):
+            clone_rows(self.env.cr, 'account_move_line', template.id, scale - seeded, {
+                'date': "CURRENT_DATE - (gs %% 28)",
+                'analytic_distribution': "%(distribution)s::jsonb",
+            }, {'distribution': json.dumps({str(branch.analytic_account_id.id): 100})})
+            seeded = scale
+            self.env.cr.execute("ANALYZE account_move_line")
+            self.record('branch_pl_report', scale, measure(
+                self.env, lambda: Report._get_report_values([], data=data), repeat=self.args.repeat))
+
+    # ------------------------------------------------------------------
+    def check(self, budgets):
+        failures = []
+        for case, by_scale in self.results.items():
+            budget = budgets.get(case, {})
+            for scale, stats in by_scale.items():
+                if budget.get('max_queries') is not None and stats['queries'] > budget['max_queries']:
+                    failures.append("%s@%s: %d queries > %d" % (case, scale, stats['queries'], budget['max_queries']))
+                if budget.get('max_ms') is not None and stats['median_ms'] > budget['max_ms']:
+                    failures.append("%s@%s: %.1f ms > %.1f ms" % (case, scale, stats['median_ms'], budget['max_ms']))
+            if case in FLAT_QUERY_CASES and len(by_scale) > 1:
+                counts = [stats['queries'] for stats in by_scale.values()]
+                if max(counts) > min(counts) + 2:
+                    failures.append("%s: query count grows with data (%s)" % (case, counts))
+        return failures
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--partners', default='1000,10000,50000', help="Partner scales for session loading")
+    parser.add_argument('--invoices', default='80,800', help="Invoice scales for the insurance toggle")
+    parser.add_argument('--finalize-orders', default='10,100', help="Invoiced order scales for the batch payment summary")
+    parser.add_argument('--move-lines', default='10000,100000', help="Move line scales for the Branch P&L")
+    parser.add_argument('--year-tests', type=int, default=20000, help="Optical tests spread over a year for the staff report")
+    parser.add_argument('--budgets', help="JSON file overriding the default budgets")
+    args = parser.parse_args()
+
+    budgets = dict(DEFAULT_BUDGETS)
+    if args.budgets:
+        with open(args.budgets, encoding='utf-8') as handle:
+            budgets.update(json.load(handle))
+
+    registry = load_registry(args)
+    with environment(registry) as env:
+        bench = HotPathBenchmark(env, args)
+        bench.bench_partner_load()
+        bench.bench_move_insurance_flag()
+        bench.bench_order_pipeline()
+        bench.bench_finalize_payments()
+        bench.bench_patient_tests()
+        bench.bench_staff_report()
+        bench.bench_branch_pl()
+        failures = bench.check(budgets)
+
+    write_results(args.output, {
+        'database': args.database,
+        'run_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'budgets': budgets,
+        'cases': bench.results,
+        'skipped': bench.skipped,
+        'failures': failures,
+    })
+    for failure in failures:
+        print("FAIL %s" % failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
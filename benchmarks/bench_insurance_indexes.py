@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Compare the insurance invoice queries with and without the module's indexes.
+
+Seeds synthetic insurance invoices by cloning an existing posted customer
+invoice (so every NOT NULL column is valid), then times the Pending Insurance
+list, its search panel counters and the report queries. The second pass drops
+the module's indexes inside the same transaction, which is rolled back at the
+end, so the database keeps its indexes.
+
+    python3 benchmarks/bench_insurance_indexes.py -c /etc/odoo.conf -d bench_db --seed 200000 -o indexes.json
+"""
+
+import time
+
+from common import (
+    clone_rows, environment, explain, load_registry, make_parser, measure,
+    record_queries, write_results,
+)
+
+PENDING_DOMAIN = [
+    ('move_type', '=', 'out_invoice'),
+    ('state', '=', 'posted'),
+    ('payment_state', 'in', ('not_paid', 'partial')),
+    ('is_insurance_invoice', '=', True),
+]
+
+MODULE_INDEXES = [
+    'account_move_optical_open_insurance_idx',
+    'account_move_optical_insurance_company_branch_idx',
+    'account_move__associated_patient_index',
+    'account_move__branch_id_index',
+    'account_move__insurance_company_id_index',
+    'optical_insurance_payment__order_id_index',
+    'optical_insurance_payment__invoice_id_index',
+    'optical_insurance_payment_company_invoice_idx',
+]
+
+MOVE_OVERRIDES = {
+    'name': "%(prefix)s || gs",
+    'is_insurance_invoice': "gs %% 3 = 0",
+    'branch_id': "(%(branches)s::int[])[1 + gs %% %(branch_count)s]",
+    'insurance_company_id': "CASE WHEN gs %% 3 = 0 THEN (%(insurers)s::int[])[1 + gs %% %(insurer_count)s] END",
+    'payment_state': "(ARRAY['not_paid', 'partial', 'paid', 'paid'])[1 + gs %% 4]",
+    'invoice_date': "CURRENT_DATE - (gs %% 1095)",
+    'date': "CURRENT_DATE - (gs %% 1095)",
+}
+
+
+def seed_invoices(env, count):
+    """Clone ``count`` insurance-flavoured invoices from a posted invoice."""
+    cr = env.cr
+    template = env['account.move'].search([('move_type', '=', 'out_invoice'), ('state', '=', 'posted')], limit=1)
+    branches = env['optical.branch'].search([]).ids
+    insurers = env['optical.insurance.company'].search([]).ids
+    if not template or not branches or not insurers:
+        raise SystemExit("Seeding needs one posted customer invoice, a branch and an insurance company.")
+
+    prefix = 'BENCH/%d/' % int(time.time())
+    clone_rows(cr, 'account_move', template.id, count, MOVE_OVERRIDES, {
+        'prefix': prefix,
+        'branches': branches,
+        'branch_count': len(branches),
+        'insurers': insurers,
+        'insurer_count': len(insurers),
+    })
+    print("Seeded %d invoices (%s*)" % (count, prefix))
+
+    order = env['pos.order'].search([], limit=1)
+    if order:
+        cr.execute("""
+            INSERT INTO optical_insurance_payment
+                (order_id, invoice_id, insurance_company_id, amount, company_id,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT %s, m.id, m.insurance_company_id, m.amount_total, m.company_id,
+                   1, now(), 1, now()
+            FROM account_move m
+            WHERE m.name LIKE %s AND m.is_insurance_invoice
+        """, [order.id, prefix + '%'])
+        print("Seeded %d insurance payment records" % cr.rowcount)
+    cr.execute("ANALYZE account_move")
+    cr.execute("ANALYZE optical_insurance_payment")
+
+
+def build_cases(env):
+    Move = env['account.move']
+    pending = Move.search(PENDING_DOMAIN, limit=200)
+    insurer = pending[:1].insurance_company_id
+    return {
+        'pending_list': lambda: Move.search_read(
+            PENDING_DOMAIN, ['name', 'invoice_date', 'associated_patient_name', 'branch_id', 'amount_residual'], limit=80),
+        'pending_count': lambda: Move.search_count(PENDING_DOMAIN),
+        'search_panel_branch': lambda: Move.search_panel_select_multi_range(
+            'branch_id', search_domain=PENDING_DOMAIN, enable_counters=True),
+        'search_panel_insurer': lambda: Move.search_panel_select_multi_range(
+            'insurance_company_id', search_domain=PENDING_DOMAIN, enable_counters=True),
+        'report_totals': lambda: Move._read_group(
+            PENDING_DOMAIN, ['insurance_company_id', 'branch_id'], ['amount_residual:sum']),
+        'report_render': lambda: env['ir.actions.report']._render_qweb_html(
+            'bp_optical_pos.report_pending_insurance', pending.ids),
+        'claims_by_insurer': lambda: env['optical.insurance.payment'].search_read(
+            [('insurance_company_id', '=', insurer.id), ('invoice_id', '!=', False)], ['amount']),
+    }
+
+
+def run_cases(env, repeat):
+    results = {}
+    for name, func in build_cases(env).items():
+        stats = measure(env, func, repeat=repeat)
+        env.invalidate_all()
+        with record_queries(env.cr) as queries:
+            func()
+        plans = []
+        for code, params in queries:
+            if code.lstrip().upper().startswith('SELECT') and (
+                    'account_move' in code or 'optical_insurance_payment' in code):
+                plans.append({'query': code, 'plan': explain(env.cr, code, params)})
+        stats['plans'] = plans
+        results[name] = stats
+    return results
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--seed', type=int, default=0, help="Clone this many synthetic invoices first (committed)")
+    args = parser.parse_args()
+    registry = load_registry(args)
+
+    if args.seed:
+        with environment(registry, commit=True) as env:
+            seed_invoices(env, args.seed)
+
+    results = {}
+    with environment(registry) as env:
+        results['with_indexes'] = run_cases(env, args.repeat)
+        for index in MODULE_INDEXES:
+            env.cr.execute('DROP INDEX IF EXISTS "%s"' % index)
+        results['without_indexes'] = run_cases(env, args.repeat)
+
+    print("%-22s %14s %14s %8s" % ('case', 'indexed ms', 'unindexed ms', 'queries'))
+    for name, stats in results['with_indexes'].items():
+        other = results['without_indexes'][name]
+        print("%-22s %14.2f %14.2f %8d" % (name, stats['median_ms'], other['median_ms'], stats['queries']))
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Patient creation throughput of ``res.partner.create_from_ui`` on an optical POS.
+
+Creates ``--patients`` new customers as the user of an opened optical session
+in two modes:
+
+- ``user_session``: no session in the payload, so the opened session of the
+  user is looked up, as with a POS client that predates the session id;
+- ``session_sent``: the session id sent by the POS.
+
+The duplicate check is skipped (as after the cashier confirmed) to isolate
+the creation itself. Everything is rolled back.
+
+    python3 benchmarks/bench_patient_create.py -c /etc/odoo.conf -d bench_db --patients 500
+"""
+
+import statistics
+import time
+
+from common import environment, find_optical_session, load_registry, make_parser, percentile, write_results
+
+
+def payload(number, session_id=None):
+    partner = {
+        'name': 'Bench Patient %06d' % number,
+        'phone': '0700%06d' % number,
+        'email': 'bench.patient.%06d@example.com' % number,
+        'date_of_birth': '1990-01-01',
+        'optical_duplicates_checked': True,
+    }
+    if session_id:
+        partner['optical_pos_session_id'] = session_id
+    return partner
+
+
+def run(env, session, count, start, send_session):
+    Partner = env['res.partner']
+    timings = []
+    queries = []
+    for number in range(start, start + count):
+        count_before = env.cr.sql_log_count
+        begin = time.perf_counter()
+        Partner.create_from_ui(payload(number, session.id if send_session else None))
+        env.flush_all()
+        timings.append((time.perf_counter() - begin) * 1000.0)
+        queries.append(env.cr.sql_log_count - count_before)
+    total = sum(timings) / 1000.0
+    return {
+        'patients': count,
+        'patients_per_second': round(count / total, 1) if total else None,
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'median_queries': statistics.median(queries),
+    }
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--patients', type=int, default=500, help="Patients created per mode")
+    args = parser.parse_args()
+    registry = load_registry(args)
+
+    with environment(registry) as env:
+        session = find_optical_session(env)
+        if not session:
+            raise SystemExit("Needs an opened session of an optical POS configuration.")
+        env = env(user=session.user_id.id)
+        # Warm up the registry and the model caches
+        run(env, session, 5, 0, send_session=True)
+        results = {
+            'user_session': run(env, session, args.patients, 1000, send_session=False),
+            'session_sent': run(env, session, args.patients, 1000 + args.patients, send_session=True),
+        }
+
+    for mode, stats in results.items():
+        print("%-12s %8.1f patients/s %10.2f ms median %6s queries" % (
+            mode, stats['patients_per_second'], stats['median_ms'], stats['median_queries']))
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
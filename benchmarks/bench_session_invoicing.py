@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Compare order-by-order invoicing with the batched session-close invoicing.
+
+Pushes ``--orders`` paid orders (a share of them with an insurance payment)
+into an opened optical session twice, with the configuration switched to
+session-close invoicing so the sync does not invoice them. The first set is
+invoiced order by order through ``_generate_pos_order_invoice`` (what inline
+invoicing does), the second with ``_optical_generate_invoices_batch`` (what
+closing the session does). Everything is rolled back.
+
+    python3 benchmarks/bench_session_invoicing.py -c /etc/odoo.conf -d bench_db --orders 600
+"""
+
+import time
+
+from common import build_ui_order, environment, find_optical_session, load_registry, make_parser, write_results
+
+
+def push_orders(env, session, partner, product, cash, insurance, insurer, count, start, insurance_every):
+    Order = env['pos.order']
+    order_ids = []
+    for sequence in range(start, start + count):
+        payments = [(cash, 100.0, None)]
+        if insurance and insurer and sequence % insurance_every == 0:
+            payments = [(cash, 40.0, None), (insurance, 60.0, {
+                'insurance_company_id': insurer.id,
+                'policy_number': 'BENCH-%d' % sequence,
+                'member_number': 'M-%d' % sequence,
+                'employer': 'Bench Employer',
+                'notes': '',
+            })]
+        payload = build_ui_order(session, partner, product, payments, sequence)
+        order_ids += [result['id'] for result in Order.create_from_ui([payload])]
+    return Order.browse(order_ids)
+
+
+def timed(env, func):
+    env.flush_all()
+    env.invalidate_all()
+    count_before = env.cr.sql_log_count
+    start = time.perf_counter()
+    func()
+    env.flush_all()
+    return {
+        'seconds': round(time.perf_counter() - start, 3),
+        'queries': env.cr.sql_log_count - count_before,
+    }
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--orders', type=int, default=600, help="Orders invoiced per mode")
+    parser.add_argument('--insurance-every', type=int, default=3, help="Every Nth order has an insurance payment")
+    args = parser.parse_args()
+    registry = load_registry(args)
+
+    with environment(registry) as env:
+        session = find_optical_session(env)
+        if not session:
+            raise SystemExit("Needs an opened session of an optical POS configuration.")
+        config = session.config_id
+        config.write({'optical_invoice_mode': 'session_close', 'optical_defer_invoice_postprocess': False})
+        cash = config.payment_method_ids.filtered(lambda m: not m.is_insurance_method and m.type != 'pay_later')[:1]
+        insurance = config.payment_method_ids.filtered('is_insurance_method')[:1]
+        insurer = env['optical.insurance.company'].search([], limit=1)
+        product = env['product.product'].search([('available_in_pos', '=', True)], limit=1)
+        partner = env['res.partner'].search([('customer_rank', '>', 0)], limit=1)
+
+        inline_orders = push_orders(env, session, partner, product, cash, insurance, insurer,
+                                    args.orders, 70000, args.insurance_every)
+        batch_orders = push_orders(env, session, partner, product, cash, insurance, insurer,
+                                   args.orders, 80000, args.insurance_every)
+
+        def inline():
+            for order in inline_orders:
+                order.write({'to_invoice': True})
+                order.with_context(generate_pdf=False)._generate_pos_order_invoice()
+
+        results = {
+            'orders': args.orders,
+            'order_by_order': timed(env, inline),
+            'batched': timed(env, batch_orders._optical_generate_invoices_batch),
+        }
+
+    for mode in ('order_by_order', 'batched'):
+        print("%-16s %10.3f s %10d queries" % (mode, results[mode]['seconds'], results[mode]['queries']))
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
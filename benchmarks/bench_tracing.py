@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Compare the structured tracing of the order sync path with the INFO logging
+it replaced.
+
+The first phase replays the logging sites of ``_order_fields``,
+``_payment_fields`` and ``add_payment`` for a stream of synthetic orders:
+once with the former INFO statements (full UI payment lines formatted into a
+log file) and once per tracing configuration. The optional second phase
+pushes real orders through ``create_from_ui`` with tracing off and fully on.
+Everything runs in a rolled-back transaction; logs go to a temporary file.
+
+    python3 benchmarks/bench_tracing.py -c /etc/odoo.conf -d bench_db --orders 20000 --sync-orders 200
+"""
+
+import logging
+import os
+import tempfile
+import time
+
+from common import (
+    build_ui_order, environment, find_optical_session, load_registry, make_parser,
+    write_results,
+)
+
+TRACE_SCENARIOS = {
+    'trace_default': {'level': 'warning', 'sampling': ''},
+    'trace_sampled_1pct': {'level': 'debug', 'sampling': '*=0.01'},
+    'trace_full': {'level': 'debug', 'sampling': '*=1'},
+}
+
+
+def synthetic_orders(count):
+    """UI-shaped orders with one cash and one insurance payment line."""
+    for sequence in range(count):
+        yield {
+            'name': 'Order 00001-001-%06d' % sequence,
+            'statement_ids': [
+                [0, 0, {'payment_method_id': 1, 'amount': 40.0, 'name': '2025-01-01 10:00:00'}],
+                [0, 0, {
+                    'payment_method_id': 2, 'amount': 60.0, 'name': '2025-01-01 10:00:00',
+                    'is_insurance': True,
+                    'insuranceData': {
+                        'insurance_company_id': 3, 'insurance_company_name': 'Bench Insurer',
+                        'policy_number': 'POL-%08d' % sequence, 'member_number': 'MEM-%08d' % sequence,
+                        'employer': 'Bench Employer Ltd', 'coverage_details': 'Frames and lenses, 1 pair/year',
+                    },
+                }],
+            ],
+        }
+
+
+def legacy_logging(logger, ui_order):
+    """The INFO statements the order sync path used to emit."""
+    logger.info('[BP Optical POS] Forcing invoice creation for order (Insurance: %s)', True)
+    for statement in ui_order['statement_ids']:
+        line = statement[2]
+        logger.info('[BP Optical POS] _payment_fields UI line: %s', line)
+        data = dict(line, insurance_raw_data=line.get('insuranceData'))
+        logger.info('[BP Optical POS] add_payment called with data keys: %s', data.keys())
+        if data.get('insurance_raw_data'):
+            logger.info('[BP Optical POS] Insurance data present: %s', True)
+            logger.info('[BP Optical POS] Insurance raw data content: %s', data['insurance_raw_data'])
+
+
+def traced(env, trace, ui_order):
+    """The trace events that replaced them."""
+    trace(env, 'order.force_invoice', order=ui_order['name'], insurance=True)
+    for statement in ui_order['statement_ids']:
+        line = statement[2]
+        insurance_data = line.get('insuranceData')
+        trace(env, 'payment.fields', level='debug', order=ui_order['name'],
+              payment_method=line['payment_method_id'], insurance=bool(insurance_data))
+        trace(env, 'payment.add', level='debug', order=ui_order['name'], keys=sorted(line),
+              insurance_company=insurance_data.get('insurance_company_id') if insurance_data else None)
+
+
+def _configure(env, level, sampling):
+    params = env['ir.config_parameter'].sudo()
+    params.set_param('bp_optical_pos.trace_level', level)
+    params.set_param('bp_optical_pos.trace_sampling', sampling)
+
+
+def _log_to(handler, *names):
+    for name in names:
+        logger = logging.getLogger(name)
+        logger.handlers = [handler]
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--orders', type=int, default=20000, help="Synthetic orders replayed per scenario")
+    parser.add_argument('--sync-orders', type=int, default=0, help="Real orders pushed through create_from_ui per mode")
+    args = parser.parse_args()
+    registry = load_registry(args)
+
+    from odoo.addons.bp_optical_pos.tools import tracing
+
+    log_fd, log_path = tempfile.mkstemp(suffix='.log', prefix='bp_optical_trace_')
+    os.close(log_fd)
+    handler = logging.FileHandler(log_path)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s'))
+    legacy_logger = logging.getLogger('odoo.addons.bp_optical_pos.models.pos_order_ext')
+    _log_to(handler, legacy_logger.name, 'odoo.addons.bp_optical_pos.trace')
+
+    results = {'orders': args.orders}
+    with environment(registry) as env:
+        start = time.perf_counter()
+        for ui_order in synthetic_orders(args.orders):
+            legacy_logging(legacy_logger, ui_order)
+        handler.flush()
+        elapsed = time.perf_counter() - start
+        results['legacy_info_logging'] = {
+            'request_path_s': round(elapsed, 4),
+            'orders_per_s': round(args.orders / elapsed, 1),
+            'log_bytes': os.path.getsize(log_path),
+        }
+
+        for name, settings in TRACE_SCENARIOS.items():
+            _configure(env, settings['level'], settings['sampling'])
+            tracing.flush()
+            size_before = os.path.getsize(log_path)
+            start = time.perf_counter()
+            for ui_order in synthetic_orders(args.orders):
+                traced(env, tracing.trace, ui_order)
+            elapsed = time.perf_counter() - start
+            flush_start = time.perf_counter()
+            tracing.flush()
+            handler.flush()
+            results[name] = {
+                'request_path_s': round(elapsed, 4),
+                'orders_per_s': round(args.orders / elapsed, 1),
+                'flush_s': round(time.perf_counter() - flush_start, 4),
+                'log_bytes': os.path.getsize(log_path) - size_before,
+            }
+
+        session = find_optical_session(env)
+        if args.sync_orders and session:
+            config = session.config_id
+            cash = config.payment_method_ids.filtered(lambda m: not m.is_insurance_method)[:1]
+            product = env['product.product'].search([('available_in_pos', '=', True)], limit=1)
+            partner = env['res.partner'].search([('customer_rank', '>', 0)], limit=1)
+            for mode, settings in (('sync_trace_off', TRACE_SCENARIOS['trace_default']),
+                                   ('sync_trace_full', TRACE_SCENARIOS['trace_full'])):
+                _configure(env, settings['level'], settings['sampling'])
+                payloads = [build_ui_order(session, partner, product, [(cash, 100.0, None)], 50000 + i)
+                            for i in range(args.sync_orders)]
+                start = time.perf_counter()
+                for payload in payloads:
+                    env['pos.order'].create_from_ui([payload])
+                elapsed = time.perf_counter() - start
+                results[mode] = {'orders': args.sync_orders, 'orders_per_s': round(args.sync_orders / elapsed, 1)}
+        env.registry.clear_cache()
+
+    print("%-22s %12s %12s %12s" % ('scenario', 'orders/s', 'flush s', 'log bytes'))
+    for name, stats in results.items():
+        if isinstance(stats, dict):
+            print("%-22s %12s %12s %12s" % (
+                name, stats.get('orders_per_s'), stats.get('flush_s', '-'), stats.get('log_bytes', '-')))
+    os.remove(log_path)
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
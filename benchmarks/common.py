@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Shared helpers for the BP Optical POS benchmark scripts.
+
+The scripts run against a local database that has bp_optical_pos installed,
+using the Odoo interpreter (or PYTHONPATH pointing at the Odoo sources):
+
+    python3 benchmarks/<script>.py -c /etc/odoo.conf -d <database> [options]
+
+Never point them at a production database: the seeding steps write large
+amounts of synthetic data.
+"""
+
+import argparse
+import contextlib
+import json
+import statistics
+import time
+import uuid
+
+import odoo
+from odoo import api, fields, SUPERUSER_ID
+from odoo.tools import config
+
+
+def make_parser(description):
+    """Return an argument parser with the options shared by every script."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-c', '--config', help="Odoo configuration file")
+    parser.add_argument('-d', '--database', required=True, help="Local database with bp_optical_pos installed")
+    parser.add_argument('-o', '--output', help="Write the results as JSON to this file")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measured case (default 5)")
+    return parser
+
+
+def load_registry(args):
+    """Parse the Odoo configuration and return the registry of ``args.database``."""
+    odoo_args = ['-d', args.database]
+    if args.config:
+        odoo_args = ['-c', args.config] + odoo_args
+    config.parse_config(odoo_args)
+    return odoo.registry(args.database)
+
+
+@contextlib.contextmanager
+def environment(registry, commit=False, uid=SUPERUSER_ID, context=None):
+    """Yield an environment on a fresh cursor; roll back unless ``commit``."""
+    with registry.cursor() as cr:
+        env = api.Environment(cr, uid, context or {})
+        try:
+            yield env
+        finally:
+            if commit:
+                cr.commit()
+            else:
+                cr.rollback()
+
+
+def _split_query(query, params):
+    """Return ``(code, params)`` for both plain strings and ``odoo.tools.SQL``."""
+    if hasattr(query, 'code'):
+        return query.code, query.params
+    return query, params
+
+
+@contextlib.contextmanager
+def record_queries(cr):
+    """Record every query executed on ``cr`` as ``(code, params)`` tuples."""
+    queries = []
+    execute = cr.execute
+
+    def recording_execute(query, params=None, log_exceptions=True):
+        queries.append(_split_query(query, params))
+        return execute(query, params, log_exceptions)
+
+    cr.execute = recording_execute
+    try:
+        yield queries
+    finally:
+        del cr.execute
+
+
+def explain(cr, code, params, analyze=True):
+    """Return the plan of a recorded SELECT as a list of text lines."""
+    options = 'ANALYZE, BUFFERS' if analyze else 'COSTS'
+    cr.execute('EXPLAIN (%s) %s' % (options, code), params)
+    return [row[0] for row in cr.fetchall()]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (``pct`` between 0 and 100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def measure(env, func, repeat=5, setup=None):
+    """Run ``func`` ``repeat`` times on a cold cache and summarize the cost.
+
+    When ``setup`` is given it is called (untimed) before every run and its
+    result is passed to ``func``. Returns the maximum query count seen and
+    wall-time statistics in milliseconds.
+    """
+    cr = env.cr
+    timings = []
+    counts = []
+    for _i in range(repeat):
+        args = (setup(),) if setup else ()
+        env.invalidate_all()
+        count_before = cr.sql_log_count
+        start = time.perf_counter()
+        func(*args)
+        env.flush_all()
+        timings.append((time.perf_counter() - start) * 1000.0)
+        counts.append(cr.sql_log_count - count_before)
+    return {
+        'queries': max(counts),
+        'min_ms': round(min(timings), 3),
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'max_ms': round(max(timings), 3),
+    }
+
+
+def table_columns(cr, table):
+    """Return the column names of ``table``."""
+    cr.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = %s ORDER BY ordinal_position",
+        [table],
+    )
+    return [row[0] for row in cr.fetchall()]
+
+
+def clone_rows(cr, table, template_id, count, overrides, params=None):
+    """Insert ``count`` copies of row ``template_id`` of ``table``.
+
+    ``overrides`` maps column names to SQL expressions evaluated per copy;
+    ``gs`` is the copy number (1..count). Returns the new ids in order.
+    """
+    columns = [c for c in table_columns(cr, table) if c != 'id' and c not in overrides]
+    query = """
+        INSERT INTO "%s" (%s)
+        SELECT %s FROM "%s" t, generate_series(1, %%(count)s) gs
+        WHERE t.id = %%(template)s
+        ORDER BY gs
+        RETURNING id
+    """ % (
+        table,
+        ', '.join('"%s"' % c for c in columns + list(overrides)),
+        ', '.join(['t."%s"' % c for c in columns] + list(overrides.values())),
+        table,
+    )
+    cr.execute(query, dict(params or {}, count=count, template=template_id))
+    return [row[0] for row in cr.fetchall()]
+
+
+def find_optical_session(env):
+    """Return an opened session of an optical POS configuration, if any."""
+    return env['pos.session'].search([
+        ('state', '=', 'opened'),
+        ('config_id.optical_enabled', '=', True),
+    ], limit=1)
+
+
+def build_ui_order(session, partner, product, payments, sequence, price=100.0):
+    """Return a ``create_from_ui()`` payload shaped like the POS client's.
+
+    ``payments`` is a list of ``(payment_method, amount, insurance_data)``;
+    ``insurance_data`` is the ``insuranceData`` dict of an insurance line or
+    ``None``.
+    """
+    uid = '%05d-%03d-%04d' % (session.id, session.config_id.id % 1000, sequence)
+    now = fields.Datetime.to_string(fields.Datetime.now())
+    statement_ids = []
+    for method, amount, insurance_data in payments:
+        payment_vals = {
+            'name': now,
+            'payment_method_id': method.id,
+            'amount': amount,
+            'payment_status': '',
+            'ticket': '',
+            'card_type': '',
+            'cardholder_name': '',
+            'transaction_id': '',
+        }
+        if insurance_data:
+            payment_vals.update(is_insurance=True, insuranceData=insurance_data)
+        statement_ids.append([0, 0, payment_vals])
+    data = {
+        'name': 'Order %s' % uid,
+        'uid': uid,
+        'sequence_number': sequence,
+        'creation_date': now,
+        'pos_session_id': session.id,
+        'pricelist_id': session.config_id.pricelist_id.id,
+        'partner_id': partner.id if partner else False,
+        'user_id': session.user_id.id,
+        'fiscal_position_id': False,
+        'to_invoice': False,
+        'shipping_date': False,
+        'is_tipped': False,
+        'tip_amount': 0,
+        'access_token': uuid.uuid4().hex,
+        'amount_total': price,
+        'amount_tax': 0.0,
+        'amount_paid': sum(amount for _method, amount, _data in payments),
+        'amount_return': 0.0,
+        'lines': [[0, 0, {
+            'product_id': product.id,
+            'full_product_name': product.display_name,
+            'qty': 1,
+            'price_unit': price,
+            'price_subtotal': price,
+            'price_subtotal_incl': price,
+            'discount': 0,
+            'tax_ids': [[6, False, []]],
+            'pack_lot_ids': [],
+        }]],
+        'statement_ids': statement_ids,
+    }
+    return {'id': uid, 'data': data, 'to_invoice': False}
+
+
+def write_results(path, results):
+    """Dump ``results`` as JSON to ``path`` (no-op when ``path`` is empty)."""
+    if not path:
+        return
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True, default=str)
+    print("Results written to %s" % path)
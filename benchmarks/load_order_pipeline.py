@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Simulate many tills syncing optical orders at the same time.
+
+Every simulated till is a thread (or a process with ``--processes``) with its
+own database cursor. It pushes synthetic UI orders through
+``pos.order.create_from_ui`` with a mix of cash, card and insurance payments
+(the insurance lines carry ``insuranceData`` like the POS client sends) and
+retries serialization failures, deadlocks and lock timeouts with backoff, the
+way the RPC layer does. Tills are spread over the opened optical sessions.
+
+Each order is rolled back after it has been processed, unless ``--keep`` is
+given, so the database is left as it was. Row locks are held until then, so
+the contention between tills is the real one.
+
+    python3 benchmarks/load_order_pipeline.py -c /etc/odoo.conf -d bench_db --tills 40 --orders 50
+    python3 benchmarks/load_order_pipeline.py -d bench_db --tills 40 --mix cash=50,card=30,insurance=20 --processes
+"""
+
+import collections
+import concurrent.futures
+import multiprocessing
+import random
+import time
+
+from psycopg2 import errorcodes, OperationalError
+
+from common import build_ui_order, environment, load_registry, make_parser, percentile, write_results
+
+RETRYABLE = {
+    errorcodes.SERIALIZATION_FAILURE: 'serialization_failure',
+    errorcodes.DEADLOCK_DETECTED: 'deadlock',
+    errorcodes.LOCK_NOT_AVAILABLE: 'lock_not_available',
+}
+MAX_TRIES = 5
+
+_registries = {}
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        kind, _sep, weight = item.partition('=')
+        mix[kind.strip()] = float(weight)
+    unknown = set(mix) - {'cash', 'card', 'insurance'}
+    if unknown:
+        raise SystemExit("Unknown payment kinds in --mix: %s" % ', '.join(sorted(unknown)))
+    return mix
+
+
+def collect_fixtures(env, partner_count):
+    """Ids every till needs, gathered once so the workers stay independent."""
+    sessions = env['pos.session'].search([
+        ('state', '=', 'opened'),
+        ('config_id.optical_enabled', '=', True),
+    ])
+    if not sessions:
+        raise SystemExit("Needs at least one opened session of an optical POS configuration.")
+    tills = []
+    for session in sessions:
+        methods = session.config_id.payment_method_ids
+        tills.append({
+            'session_id': session.id,
+            'cash': methods.filtered(lambda m: m.is_cash_count)[:1].id,
+            'card': methods.filtered(
+                lambda m: not m.is_cash_count and not m.is_insurance_method and m.type != 'pay_later')[:1].id,
+            'insurance': methods.filtered('is_insurance_method')[:1].id,
+        })
+    return {
+        'tills': tills,
+        'partners': env['res.partner'].search([('customer_rank', '>', 0)], limit=partner_count).ids,
+        'products': env['product.product'].search([('available_in_pos', '=', True)], limit=50).ids,
+        'insurers': env['optical.insurance.company'].search([]).ids,
+    }
+
+
+def payment_plan(rng, till, mix, insurers, total):
+    """Pick the payment kind of an order and split ``total`` accordingly."""
+    kinds = [kind for kind in mix if till.get(kind)]
+    kind = rng.choices(kinds, weights=[mix[k] for k in kinds])[0]
+    if kind != 'insurance':
+        return [(till[kind], total, None)]
+    covered = round(total * rng.choice((0.5, 0.6, 0.8, 1.0)), 2)
+    policy = rng.randrange(10 ** 7)
+    payments = [(till['insurance'], covered, {
+        'insurance_company_id': rng.choice(insurers),
+        'insurance_company_name': 'Load Insurer',
+        'policy_number': 'LOAD-%07d' % policy,
+        'member_number': 'M-%07d' % policy,
+        'employer': 'Load Employer Ltd',
+        'coverage_details': 'Frames and lenses',
+        'notes': '',
+    })]
+    if covered < total:
+        payments.append((till['cash'] or till['card'], round(total - covered, 2), None))
+    return payments
+
+
+def run_till(options, fixtures, index):
+    """Push ``options['orders']`` orders for till ``index``; return its samples."""
+    from odoo import api, SUPERUSER_ID
+
+    database = options['database']
+    if database not in _registries:
+        _registries[database] = load_registry(options['args'])
+    registry = _registries[database]
+
+    rng = random.Random(options['seed'] + index)
+    till = fixtures['tills'][index % len(fixtures['tills'])]
+    samples = []
+    retries = collections.Counter()
+    failures = collections.Counter()
+    with registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        session = env['pos.session'].browse(till['session_id'])
+        Method = env['pos.payment.method']
+        for number in range(options['orders']):
+            sequence = options['sequence_base'] + index * 10000 + number
+            price = float(rng.randrange(20, 400) * 5)
+            plan = payment_plan(rng, till, options['mix'], fixtures['insurers'], price)
+            payload = build_ui_order(
+                session,
+                env['res.partner'].browse(rng.choice(fixtures['partners'])),
+                env['product.product'].browse(rng.choice(fixtures['products'])),
+                [(Method.browse(method_id), amount, data) for method_id, amount, data in plan],
+                sequence,
+                price,
+            )
+            start = time.perf_counter()
+            for attempt in range(1, MAX_TRIES + 1):
+                try:
+                    env['pos.order'].create_from_ui([payload])
+                    env.flush_all()
+                    if options['keep']:
+                        cr.commit()
+                    else:
+                        cr.rollback()
+                    break
+                except OperationalError as e:
+                    cr.rollback()
+                    env.invalidate_all()
+                    kind = RETRYABLE.get(e.pgcode)
+                    if not kind or attempt == MAX_TRIES:
+                        failures[kind or e.pgcode or 'operational_error'] += 1
+                        break
+                    retries[kind] += 1
+                    time.sleep(rng.uniform(0.0, 0.1 * 2 ** attempt))
+                except Exception as e:
+                    cr.rollback()
+                    env.invalidate_all()
+                    failures[type(e).__name__] += 1
+                    break
+            samples.append(time.perf_counter() - start)
+    return {'latencies': samples, 'retries': retries, 'failures': failures}
+
+
+def main():
+    parser = make_parser(__doc__)
+    parser.add_argument('--tills', type=int, default=40, help="Concurrent simulated tills")
+    parser.add_argument('--orders', type=int, default=50, help="Orders pushed by each till")
+    parser.add_argument('--mix', default='cash=50,card=30,insurance=20', help="Weights of the payment kinds")
+    parser.add_argument('--partners', type=int, default=500, help="Customers orders are spread over")
+    parser.add_argument('--processes', action='store_true', help="Run tills as processes instead of threads")
+    parser.add_argument('--keep', action='store_true', help="Commit the orders instead of rolling them back")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    registry = load_registry(args)
+    _registries[args.database] = registry
+
+    with environment(registry) as env:
+        fixtures = collect_fixtures(env, args.partners)
+    if not fixtures['partners'] or not fixtures['products']:
+        raise SystemExit("Needs customers and products available in POS.")
+
+    options = {
+        'args': args,
+        'database': args.database,
+        'orders': args.orders,
+        'mix': parse_mix(args.mix),
+        'keep': args.keep,
+        'seed': args.seed,
+        # Unique UI references across runs when --keep commits the orders
+        'sequence_base': int(time.time()) % 100000 * 100,
+    }
+    if args.processes:
+        # Spawned, not forked: a child must not share the parent's connections
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.tills, mp_context=multiprocessing.get_context('spawn'))
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.tills)
+    print("%d tills x %d orders over %d session(s) (%s)" % (
+        args.tills, args.orders, len(fixtures['tills']), 'processes' if args.processes else 'threads'))
+
+    start = time.perf_counter()
+    with executor:
+        outcomes = list(executor.map(run_till, [options] * args.tills, [fixtures] * args.tills, range(args.tills)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [value * 1000.0 for outcome in outcomes for value in outcome['latencies']]
+    retries = sum((outcome['retries'] for outcome in outcomes), collections.Counter())
+    failures = sum((outcome['failures'] for outcome in outcomes), collections.Counter())
+    completed = len(latencies) - sum(failures.values())
+    results = {
+        'tills': args.tills,
+        'orders_per_till': args.orders,
+        'sessions': len(fixtures['tills']),
+        'mode': 'processes' if args.processes else 'threads',
+        'elapsed_s': round(elapsed, 3),
+        'completed': completed,
+        'throughput_per_s': round(completed / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(max(latencies), 2) if latencies else 0.0,
+        },
+        'deadlocks': retries['deadlock'] + failures['deadlock'],
+        'retries': dict(retries),
+        'failures': dict(failures),
+    }
+
+    print("completed %d orders in %.1f s: %.1f orders/s" % (completed, elapsed, results['throughput_per_s']))
+    print("latency p50 %(p50).1f ms  p95 %(p95).1f ms  p99 %(p99).1f ms  max %(max).1f ms" % results['latency_ms'])
+    print("retries %s  failures %s" % (dict(retries) or '-', dict(failures) or '-'))
+    write_results(args.output, results)
+
+
+if __name__ == '__main__':
+    main()
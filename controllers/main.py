@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import hmac
+
+from odoo import api, http, registry
+from odoo.http import content_disposition, request
+
+from ..tools import metrics
+
+METRICS_TOKEN_PARAM = 'bp_optical_pos.metrics_token'
+
+
+class OpticalPosController(http.Controller):
+
+    @http.route('/bp_optical_pos/metrics', type='http', auth='public', methods=['GET'], csrf=False)
+    def optical_metrics(self, **kwargs):
+        """
+        Prometheus scrape endpoint for the worker serving the request.
+
+        Allowed for logged-in Optical POS managers, or for scrapers sending
+        ``Authorization: Bearer <token>`` matching the
+        ``bp_optical_pos.metrics_token`` system parameter.
+        """
+        token = request.env['ir.config_parameter'].sudo().get_param(METRICS_TOKEN_PARAM)
+        header = request.httprequest.headers.get('Authorization', '')
+        authorized = bool(token) and hmac.compare_digest(header, 'Bearer %s' % token)
+        if not authorized and not request.env.user.has_group('bp_optical_pos.group_optical_pos_manager'):
+            return request.make_response('Forbidden\n', status=403, headers=[('Content-Type', 'text/plain')])
+        return request.make_response(
+            metrics.render_prometheus(request.env['optical.invoice.job'].sudo()._prometheus_lines()),
+            headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')],
+        )
+
+    @http.route('/bp_optical_pos/branch_kpis', type='json', auth='user')
+    def optical_branch_kpis(self, date_from=None, date_to=None, branch_ids=None, interval='day'):
+        """Branch KPIs from the daily snapshots, for dashboards (JSON-RPC)."""
+        return request.env['optical.branch.kpi'].get_dashboard_data(
+            date_from=date_from, date_to=date_to, branch_ids=branch_ids, interval=interval)
+
+    @http.route('/bp_optical_pos/recalls.csv', type='http', auth='user', methods=['GET'])
+    def optical_recalls_csv(self, horizon_days=30, branch_id=None, **kwargs):
+        """
+        Stream the pending recalls due within ``horizon_days`` as CSV.
+
+        Rows are read in keyset-paged chunks on a cursor of their own while
+        the response is sent, so the export never holds the whole queue.
+        """
+        Recall = request.env['optical.recall']
+        Recall.check_access_rights('read')
+        domain = Recall._export_domain(horizon_days, branch_id)
+        dbname, uid, context = request.env.cr.dbname, request.env.uid, dict(request.env.context)
+
+        def generate():
+            with registry(dbname).cursor() as cr:
+                env = api.Environment(cr, uid, context)
+                for chunk in env['optical.recall']._iter_csv(domain):
+                    yield chunk.encode('utf-8')
+
+        return request.make_response(generate(), headers=[
+            ('Content-Type', 'text/csv; charset=utf-8'),
+            ('Content-Disposition', content_disposition('recalls.csv')),
+        ])
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Refresh planner statistics for the tables that gained optical indexes.
+
+    The indexes themselves are created by the field definitions and the
+    ``init()`` hooks of ``account.move`` and ``optical.insurance.payment``,
+    which run on every install and upgrade. Without fresh statistics the
+    planner keeps choosing sequential scans on ``account_move`` until the next
+    autovacuum, so analyze both tables right away.
+    """
+    if not version:
+        return
+    for table in ('account_move', 'optical_insurance_payment'):
+        _logger.info('[BP Optical POS] Analyzing %s after index creation', table)
+        cr.execute('ANALYZE "%s"' % table)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from odoo.tools.sql import column_exists, create_column
+
+_logger = logging.getLogger(__name__)
+
+# SQL twins of normalize_phone() and normalize_email() in res_partner_pos_ext
+PHONE_KEY = """
+    CASE WHEN length(regexp_replace(coalesce({column}, ''), '\\D', '', 'g')) >= 7
+         THEN right(regexp_replace({column}, '\\D', '', 'g'), 9) END
+"""
+EMAIL_KEY = """
+    CASE WHEN position('@' in lower(trim(email))) > 0
+              AND lower(trim(email)) NOT LIKE '%@pos.local'
+         THEN lower(trim(email)) END
+"""
+
+
+def migrate(cr, version):
+    """Fill the normalized contact keys of res.partner in SQL.
+
+    Creating the stored computed columns up front keeps the ORM from
+    recomputing them partner by partner in Python during the upgrade.
+    """
+    if not version or column_exists(cr, 'res_partner', 'optical_phone_key'):
+        return
+    for column in ('optical_phone_key', 'optical_mobile_key', 'optical_email_key'):
+        create_column(cr, 'res_partner', column, 'varchar')
+    _logger.info('[BP Optical POS] Computing normalized partner contact keys')
+    cr.execute("""
+        UPDATE res_partner
+        SET optical_phone_key = {phone},
+            optical_mobile_key = {mobile},
+            optical_email_key = {email}
+    """.format(
+        phone=PHONE_KEY.format(column='phone'),
+        mobile=PHONE_KEY.format(column='mobile'),
+        email=EMAIL_KEY,
+    ))
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    """Build the insurance utilization ledger from the existing claims.
+
+    From now on the ledger is maintained as claims are created, refunded or
+    written off; the history has to be summed once.
+    """
+    if not version:
+        return
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    env['optical.insurance.utilization']._rebuild()
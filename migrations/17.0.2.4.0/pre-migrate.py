@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from odoo.tools.sql import column_exists, create_column
+
+_logger = logging.getLogger(__name__)
+
+
+def migrate(cr, version):
+    """Fill the payment summary of pos.order in SQL.
+
+    Same reasoning as the partner contact keys: with the columns created up
+    front the ORM does not recompute every order of the history in Python.
+    The SQL mirrors pos.order._compute_optical_payment_summary(). The claim
+    status of insurance payments is itself a stored compute added in
+    17.0.2.1.0; when upgrading from an older version its column does not exist
+    yet, so the insurer and claim status of the orders are left to the ORM.
+    """
+    if not version or column_exists(cr, 'pos_order', 'optical_insurance_amount'):
+        return
+    create_column(cr, 'pos_order', 'optical_insurance_amount', 'float8')
+    create_column(cr, 'pos_order', 'optical_customer_amount', 'float8')
+
+    _logger.info('[BP Optical POS] Computing the insurance payment summary of POS orders')
+    cr.execute("""
+        UPDATE pos_order o
+        SET optical_insurance_amount = s.insurance_amount,
+            optical_customer_amount = s.customer_amount
+        FROM (
+            SELECT p.pos_order_id,
+                   COALESCE(SUM(p.amount) FILTER (WHERE p.is_insurance OR m.is_insurance_method), 0) AS insurance_amount,
+                   COALESCE(SUM(p.amount) FILTER (
+                       WHERE (p.is_insurance OR m.is_insurance_method) IS NOT TRUE
+                   ), 0) AS customer_amount
+            FROM pos_payment p
+            JOIN pos_payment_method m ON m.id = p.payment_method_id
+            GROUP BY p.pos_order_id
+        ) s
+        WHERE s.pos_order_id = o.id
+    """)
+
+    if not column_exists(cr, 'optical_insurance_payment', 'claim_state'):
+        return
+    create_column(cr, 'pos_order', 'optical_insurance_company_id', 'int4')
+    create_column(cr, 'pos_order', 'optical_claim_state', 'varchar')
+    cr.execute("""
+        UPDATE pos_order o
+        SET optical_insurance_company_id = c.insurance_company_id,
+            optical_claim_state = CASE
+                WHEN c.all_written_off THEN 'written_off'
+                WHEN c.all_settled THEN 'paid'
+                WHEN c.any_paid THEN 'partial'
+                ELSE 'pending'
+            END
+        FROM (
+            SELECT order_id,
+                   (array_agg(insurance_company_id ORDER BY id))[1] AS insurance_company_id,
+                   bool_and(claim_state = 'written_off') AS all_written_off,
+                   bool_and(claim_state IN ('paid', 'written_off')) AS all_settled,
+                   bool_or(claim_state IN ('paid', 'partial')) AS any_paid
+            FROM optical_insurance_payment
+            GROUP BY order_id
+        ) c
+        WHERE c.order_id = o.id
+    """)
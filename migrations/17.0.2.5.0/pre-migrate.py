@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+
+def migrate(cr, version):
+    """Drop what the id-ordered recall walk left behind.
+
+    The recall queue is now refreshed from the tests written since the last
+    run, through the write_date index; the follow-up and validity date
+    indexes were never used by it. The old walk's resume point is obsolete.
+    """
+    if not version:
+        return
+    cr.execute("DROP INDEX IF EXISTS optical_test_follow_up_date_idx")
+    cr.execute("DROP INDEX IF EXISTS optical_test_validity_until_idx")
+    cr.execute("DELETE FROM ir_config_parameter WHERE key = 'bp_optical_pos.recall_last_test_id'")
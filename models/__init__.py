@@ -5,14 +5,23 @@ from . import pos_config_ext
 from . import stock_location_ext
 from . import pos_order_ext
 from . import optical_insurance_payment
+from . import optical_insurance_utilization
 from . import pos_payment_ext
 from . import pos_payment_method_ext
 from . import pos_session_ext
 from . import optical_insurance_ext
 from . import res_partner_pos_ext
 from . import account_move_ext
+from . import account_payment_ext
 from . import optical_branch_ext
 from . import optical_optician_ext
 from . import optical_test_ext
 from . import res_config_settings
+from . import optical_pos_metrics
 
+from . import optical_invoice_job
+from . import optical_branch_kpi
+from . import optical_test_stage_log
+from . import optical_staff_report
+from . import optical_recall
+from . import optical_prescription_search
@@ -2,6 +2,7 @@
 # Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
 
 from odoo import models, fields, api
+from odoo.tools.sql import create_index
 
 
 class AccountMove(models.Model):
@@ -15,6 +16,7 @@ class AccountMove(models.Model):
     associated_patient = fields.Many2one(
         "res.partner",
         string="Associated Patient",
+        index="btree_not_null",
         help="The actual customer/patient for this insurance invoice"
     )
     associated_patient_name = fields.Char(
@@ -48,6 +50,7 @@ class AccountMove(models.Model):
     branch_id = fields.Many2one(
         "optical.branch",
         string="Branch",
+        index="btree_not_null",
         help="The branch where this invoice was created."
     )
     
@@ -56,9 +59,73 @@ class AccountMove(models.Model):
         string="Insurance Company",
         compute="_compute_insurance_company",
         store=True,
+        index="btree_not_null",
         help="The insurance company associated with this invoice."
     )
 
+    def init(self):
+        super().init()
+        # Pending Insurance action and its search panel: only open insurance
+        # invoices are ever listed, so keep that index small.
+        create_index(
+            self.env.cr,
+            'account_move_optical_open_insurance_idx',
+            self._table,
+            ['branch_id', 'insurance_company_id', 'invoice_date'],
+            where="is_insurance_invoice AND move_type = 'out_invoice' AND state = 'posted' "
+                  "AND payment_state IN ('not_paid', 'partial')",
+        )
+        # Insurance Claims filter and insurer/branch grouping over all claims
+        create_index(
+            self.env.cr,
+            'account_move_optical_insurance_company_branch_idx',
+            self._table,
+            ['insurance_company_id', 'branch_id'],
+            where="is_insurance_invoice",
+        )
+
+    def _optical_lock_receivable_lines(self):
+        """
+        Lock the receivable lines of ``self`` before reconciling them.
+
+        Rows are locked in id order with NOWAIT: a settlement that finds them
+        taken fails fast with LockNotAvailable (retried by the caller) instead
+        of queueing behind, or deadlocking with, another till or a remittance.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT line.id
+            FROM account_move_line line
+            JOIN account_account account ON account.id = line.account_id
+            WHERE line.move_id IN %s AND account.account_type = 'asset_receivable'
+            ORDER BY line.id
+            FOR UPDATE OF line NOWAIT
+        """, [tuple(self.ids)])
+        line_ids = [row[0] for row in self.env.cr.fetchall()]
+        # Values cached before the lock may predate another settlement
+        self.invalidate_recordset(['payment_state', 'amount_residual'])
+        lines = self.env['account.move.line'].browse(line_ids)
+        lines.invalidate_recordset(['reconciled', 'amount_residual', 'amount_residual_currency'])
+        return lines
+
+    def button_cancel(self):
+        """Override to release the cover of claims on cancelled invoices."""
+        res = super().button_cancel()
+        self.insurance_payment_ids._optical_sync_utilization()
+        return res
+
+    def button_draft(self):
+        """Override to count the claims of invoices reset from cancelled again."""
+        res = super().button_draft()
+        self.insurance_payment_ids._optical_sync_utilization()
+        return res
+
+    def _reverse_moves(self, default_values_list=None, cancel=False):
+        """Override to release the cover of claims on fully reversed invoices."""
+        reverse_moves = super()._reverse_moves(default_values_list=default_values_list, cancel=cancel)
+        self.insurance_payment_ids._optical_sync_utilization()
+        return reverse_moves
+
     @api.depends('insurance_payment_ids', 'insurance_payment_ids.insurance_company_id')
     def _compute_insurance_company(self):
         for move in self:
@@ -71,15 +138,14 @@ class AccountMove(models.Model):
 
     @api.depends('partner_id')
     def _compute_patient_has_insurance(self):
-        """Check if the selected customer has any active insurance."""
+        """Check if the selected customer has any active insurance (one query per batch)."""
+        partners = self.partner_id
+        insured_partners = set()
+        if partners:
+            groups = self.env['optical.patient.insurance']._read_group(
+                [('patient_id', 'in', partners.ids), ('active', '=', True)],
+                groupby=['patient_id'],
+            )
+            insured_partners = {partner.id for partner, in groups}
         for move in self:
-            move.patient_has_insurance = False
-            if move.partner_id:
-                # Check if partner has insurance (using the logic from res_partner_pos_ext)
-                # We can check the optical.patient.insurance model directly
-                insurance_count = self.env['optical.patient.insurance'].search_count([
-                    ('patient_id', '=', move.partner_id.id),
-                    ('active', '=', True)
-                ])
-                if insurance_count > 0:
-                    move.patient_has_insurance = True
+            move.patient_has_insurance = move.partner_id.id in insured_partners
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from odoo import models, fields
+
+
+class AccountPayment(models.Model):
+    _inherit = "account.payment"
+
+    is_optical_balance_payment = fields.Boolean(
+        string="Optical Balance Payment",
+        default=False,
+        readonly=True,
+        copy=False,
+        help="Customer balance settled from the POS after the order (deposit scenario)."
+    )
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import datetime
+
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+
+from ..tools.tracing import trace
+
+WATERMARK_PARAM = 'bp_optical_pos.branch_kpi_watermark'
+# Rows written by transactions still running when the watermark was taken
+# carry an older write_date; rescanning a margin catches them.
+WATERMARK_MARGIN = datetime.timedelta(minutes=15)
+DAYS_PER_BATCH = 500
+SALE_STATES = ('paid', 'done', 'invoiced')
+
+
+def _kpi_ratios(revenue, order_count, insurance_amount, test_count, converted_test_count):
+    return {
+        'insurance_share': round(100.0 * insurance_amount / revenue, 2) if revenue else 0.0,
+        'average_ticket': round(revenue / order_count, 2) if order_count else 0.0,
+        'conversion_rate': round(100.0 * converted_test_count / test_count, 2) if test_count else 0.0,
+    }
+
+
+class OpticalBranchKpi(models.Model):
+    _name = "optical.branch.kpi"
+    _description = "Optical Branch Daily KPIs"
+    _order = "date desc, branch_id"
+
+    date = fields.Date(string="Date", required=True, readonly=True, index=True)
+    branch_id = fields.Many2one(
+        "optical.branch",
+        string="Branch",
+        required=True,
+        readonly=True,
+        ondelete="cascade"
+    )
+    company_id = fields.Many2one("res.company", string="Company", readonly=True)
+    revenue = fields.Float(string="Revenue", readonly=True)
+    order_count = fields.Integer(string="Orders", readonly=True)
+    insurance_amount = fields.Float(string="Insurance Amount", readonly=True)
+    insurance_open_amount = fields.Float(
+        string="Open Insurance Balance",
+        readonly=True,
+        help="Part of the day's insurance claims still owed by the insurers."
+    )
+    test_count = fields.Integer(string="Tests", readonly=True)
+    converted_test_count = fields.Integer(
+        string="Tests Converted",
+        readonly=True,
+        help="Tests whose patient bought at the branch on the day of the test."
+    )
+    insurance_share = fields.Float(string="Insurance Share (%)", compute="_compute_ratios")
+    average_ticket = fields.Float(string="Average Ticket", compute="_compute_ratios")
+    conversion_rate = fields.Float(string="Conversion Rate (%)", compute="_compute_ratios")
+
+    _sql_constraints = [
+        ('branch_date_unique', 'unique(branch_id, date)', 'There can only be one KPI line per branch and day.'),
+    ]
+
+    def init(self):
+        super().init()
+        # The incremental refresh looks up rows changed since the last run
+        for table in ('pos_order', 'optical_test', 'optical_insurance_payment'):
+            create_index(self.env.cr, '%s_optical_write_date_idx' % table, table, ['write_date'])
+
+    @api.depends('revenue', 'order_count', 'insurance_amount', 'test_count', 'converted_test_count')
+    def _compute_ratios(self):
+        for line in self:
+            totals = _kpi_ratios(line.revenue, line.order_count, line.insurance_amount,
+                                 line.test_count, line.converted_test_count)
+            line.insurance_share = totals['insurance_share']
+            line.average_ticket = totals['average_ticket']
+            line.conversion_rate = totals['conversion_rate']
+
+    def _kpi_tz(self):
+        return self.env.company.partner_id.tz or 'UTC'
+
+    def _dirty_days(self, since):
+        """Return the ``(branch_id, day)`` pairs with activity written since ``since``."""
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT c.optical_branch_id, (o.date_order AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date
+            FROM pos_order o
+            JOIN pos_session s ON s.id = o.session_id
+            JOIN pos_config c ON c.id = s.config_id
+            WHERE o.write_date >= %(since)s AND c.optical_branch_id IS NOT NULL
+            UNION
+            SELECT c.optical_branch_id, (o.date_order AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date
+            FROM optical_insurance_payment claim
+            JOIN pos_order o ON o.id = claim.order_id
+            JOIN pos_session s ON s.id = o.session_id
+            JOIN pos_config c ON c.id = s.config_id
+            WHERE claim.write_date >= %(since)s AND c.optical_branch_id IS NOT NULL
+            UNION
+            SELECT t.branch_id, (t.test_date AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date
+            FROM optical_test t
+            WHERE t.write_date >= %(since)s AND t.branch_id IS NOT NULL AND t.test_date IS NOT NULL
+        """, {'since': since, 'tz': self._kpi_tz()})
+        return self.env.cr.fetchall()
+
+    def _all_days(self):
+        """Return every ``(branch_id, day)`` pair with activity (first build)."""
+        return self._dirty_days(datetime.datetime(1970, 1, 1))
+
+    def _refresh_days(self, pairs):
+        """Recompute the KPI lines of the given ``(branch_id, day)`` pairs in SQL."""
+        if not pairs:
+            return
+        branch_ids = [branch_id for branch_id, _day in pairs]
+        days = [day for _branch_id, day in pairs]
+        params = {
+            'branches': branch_ids,
+            'days': days,
+            # Bounds on the raw timestamps, so the date_order index narrows the scan
+            'date_from': datetime.datetime.combine(min(days), datetime.time.min) - datetime.timedelta(days=1),
+            'date_to': datetime.datetime.combine(max(days), datetime.time.min) + datetime.timedelta(days=2),
+            'tz': self._kpi_tz(),
+            'states': SALE_STATES,
+            'uid': self.env.uid,
+        }
+        cr = self.env.cr
+        cr.execute("""
+            DELETE FROM optical_branch_kpi kpi
+            USING unnest(%(branches)s::int[], %(days)s::date[]) AS dirty(branch_id, day)
+            WHERE kpi.branch_id = dirty.branch_id AND kpi.date = dirty.day
+        """, params)
+        cr.execute("""
+            WITH dirty AS (
+                SELECT DISTINCT branch_id, day
+                FROM unnest(%(branches)s::int[], %(days)s::date[]) AS d(branch_id, day)
+            ),
+            orders AS (
+                SELECT o.id, o.partner_id, o.amount_total, o.company_id, dirty.branch_id, dirty.day
+                FROM pos_order o
+                JOIN pos_session s ON s.id = o.session_id
+                JOIN pos_config c ON c.id = s.config_id
+                JOIN dirty ON dirty.branch_id = c.optical_branch_id
+                          AND dirty.day = (o.date_order AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date
+                WHERE o.date_order >= %(date_from)s AND o.date_order < %(date_to)s
+                  AND o.state IN %(states)s
+            ),
+            sales AS (
+                SELECT branch_id, day, min(company_id) AS company_id,
+                       sum(amount_total) AS revenue, count(*) AS order_count
+                FROM orders
+                GROUP BY branch_id, day
+            ),
+            claims AS (
+                SELECT orders.branch_id, orders.day,
+                       sum(claim.amount) AS insurance_amount,
+                       sum(COALESCE(claim.claim_residual, claim.amount)) AS insurance_open_amount
+                FROM optical_insurance_payment claim
+                JOIN orders ON orders.id = claim.order_id
+                GROUP BY orders.branch_id, orders.day
+            ),
+            tests AS (
+                SELECT dirty.branch_id, dirty.day, min(t.company_id) AS company_id, count(*) AS test_count,
+                       count(*) FILTER (WHERE EXISTS (
+                           SELECT 1 FROM orders
+                           WHERE orders.branch_id = dirty.branch_id AND orders.day = dirty.day
+                             AND orders.partner_id = t.patient_id
+                       )) AS converted_test_count
+                FROM optical_test t
+                JOIN dirty ON dirty.branch_id = t.branch_id
+                          AND dirty.day = (t.test_date AT TIME ZONE 'UTC' AT TIME ZONE %(tz)s)::date
+                WHERE t.test_date >= %(date_from)s AND t.test_date < %(date_to)s
+                GROUP BY dirty.branch_id, dirty.day
+            )
+            INSERT INTO optical_branch_kpi
+                (branch_id, date, company_id, revenue, order_count, insurance_amount, insurance_open_amount,
+                 test_count, converted_test_count, create_uid, create_date, write_uid, write_date)
+            SELECT dirty.branch_id, dirty.day, COALESCE(sales.company_id, tests.company_id),
+                   COALESCE(sales.revenue, 0), COALESCE(sales.order_count, 0),
+                   COALESCE(claims.insurance_amount, 0), COALESCE(claims.insurance_open_amount, 0),
+                   COALESCE(tests.test_count, 0), COALESCE(tests.converted_test_count, 0),
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM dirty
+            LEFT JOIN sales ON sales.branch_id = dirty.branch_id AND sales.day = dirty.day
+            LEFT JOIN claims ON claims.branch_id = dirty.branch_id AND claims.day = dirty.day
+            LEFT JOIN tests ON tests.branch_id = dirty.branch_id AND tests.day = dirty.day
+            WHERE sales.branch_id IS NOT NULL OR tests.branch_id IS NOT NULL
+        """, params)
+
+    @api.model
+    def _cron_refresh(self):
+        """
+        Refresh the KPI lines of the days with new activity since the last run.
+
+        The first run (or a run after the watermark parameter is removed)
+        builds the whole history. Days are refreshed in batches, committing
+        after each; the watermark only moves once every day is done.
+        """
+        Param = self.env['ir.config_parameter'].sudo()
+        started_at = self.env.cr.now()
+        watermark = Param.get_param(WATERMARK_PARAM)
+        if watermark:
+            pairs = self._dirty_days(fields.Datetime.to_datetime(watermark) - WATERMARK_MARGIN)
+        else:
+            pairs = self._all_days()
+        pairs.sort(key=lambda pair: pair[1])
+        for start in range(0, len(pairs), DAYS_PER_BATCH):
+            self._refresh_days(pairs[start:start + DAYS_PER_BATCH])
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+        Param.set_param(WATERMARK_PARAM, fields.Datetime.to_string(started_at))
+        self.invalidate_model()
+        trace(self.env, 'kpi.refreshed', days=len(pairs), full=not watermark)
+
+    @api.model
+    def get_dashboard_data(self, date_from=None, date_to=None, branch_ids=None, interval='day'):
+        """
+        Return the KPIs per branch and ``interval`` (day, week, month or year) for the dashboard.
+
+        Sums come from the snapshot lines with one grouped query; the ratios
+        are derived from the sums, so they stay correct over any period.
+        """
+        if interval not in ('day', 'week', 'month', 'year'):
+            interval = 'day'
+        domain = []
+        if date_from:
+            domain.append(('date', '>=', date_from))
+        if date_to:
+            domain.append(('date', '<=', date_to))
+        if branch_ids:
+            domain.append(('branch_id', 'in', [int(branch_id) for branch_id in branch_ids]))
+        measures = ['revenue', 'order_count', 'insurance_amount', 'insurance_open_amount',
+                    'test_count', 'converted_test_count']
+        groups = self._read_group(
+            domain,
+            groupby=['date:%s' % interval, 'branch_id'],
+            aggregates=['%s:sum' % measure for measure in measures],
+            order='date:%s' % interval,
+        )
+        rows = []
+        for period, branch, *sums in groups:
+            values = dict(zip(measures, sums))
+            values.update(_kpi_ratios(values['revenue'], values['order_count'], values['insurance_amount'],
+                                      values['test_count'], values['converted_test_count']))
+            values.update(period=fields.Date.to_string(period), branch_id=branch.id, branch=branch.display_name)
+            rows.append(values)
+        watermark = self.env['ir.config_parameter'].sudo().get_param(WATERMARK_PARAM)
+        return {'interval': interval, 'rows': rows, 'refreshed_at': watermark or False}
@@ -6,4 +6,9 @@ from odoo import models, fields
 # Fields and logic moved to bp_optical_core/models/optical_config.py
 class OpticalInsuranceCompany(models.Model):
     _inherit = "optical.insurance.company"
-    pass
+    
+    annual_cover_limit = fields.Float(
+        string="Annual Cover Limit",
+        help="Cover available to each patient per calendar year. The POS warns before an insurance "
+             "payment exceeds what is left. Leave at zero for no limit."
+    )
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 # Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
 
-from odoo import models, fields
+from collections import defaultdict
+
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+
+# Fields deciding what a claim adds to the utilization ledger
+UTILIZATION_FIELDS = {'amount', 'insurance_company_id', 'order_id'}
+UTILIZATION_SYNC_KEY = 'bp_optical_pos.utilization_sync'
 
 
 class OpticalInsurancePayment(models.Model):
@@ -13,6 +20,7 @@ class OpticalInsurancePayment(models.Model):
         "pos.order",
         string="POS Order",
         required=True,
+        index=True,
         ondelete="cascade"
     )
     payment_id = fields.Many2one(
@@ -23,6 +31,7 @@ class OpticalInsurancePayment(models.Model):
     invoice_id = fields.Many2one(
         "account.move",
         string="Invoice",
+        index="btree_not_null",
         ondelete="set null"
     )
     
@@ -49,3 +58,214 @@ class OpticalInsurancePayment(models.Model):
         store=True,
         readonly=True
     )
+
+    claim_state = fields.Selection(
+        [
+            ('pending', 'Pending'),
+            ('partial', 'Partially Paid'),
+            ('paid', 'Paid'),
+            ('written_off', 'Written Off'),
+        ],
+        string="Claim Status",
+        compute="_compute_claim_status",
+        store=True,
+        help="Settlement status of this claim, derived from the linked invoice."
+    )
+    claim_residual = fields.Float(
+        string="Outstanding Amount",
+        compute="_compute_claim_status",
+        store=True,
+        help="Part of this claim still owed by the insurance company."
+    )
+
+    utilization_id = fields.Many2one(
+        "optical.insurance.utilization",
+        string="Utilization Line",
+        readonly=True,
+        copy=False,
+        ondelete="set null"
+    )
+    utilization_amount = fields.Float(
+        string="Counted Cover",
+        readonly=True,
+        copy=False,
+        help="Amount of this claim currently counted in the utilization ledger."
+    )
+
+    @api.depends(
+        'amount',
+        'invoice_id.state',
+        'invoice_id.payment_state',
+        'invoice_id.amount_total',
+        'invoice_id.amount_residual',
+        'invoice_id.insurance_payment_ids.amount',
+    )
+    def _compute_claim_status(self):
+        """
+        Allocate the open residual of each invoice to its claims.
+
+        Insurance payments are never reconciled at the till (see
+        pos.order._apply_invoice_payments). The part of the residual the
+        customer still owes is taken out first; the rest is consumed by the
+        claims, oldest claim first.
+        """
+        allocated = {}
+        for invoice in self.invoice_id:
+            claims = invoice.insurance_payment_ids.sorted('id')
+            residual_left = invoice.amount_residual - self._optical_customer_open_amount(invoice, claims)
+            for claim in claims:
+                share = max(min(claim.amount, residual_left), 0.0)
+                allocated[claim.id] = share
+                residual_left -= share
+
+        for claim in self:
+            invoice = claim.invoice_id
+            if not invoice or invoice.state == 'draft':
+                claim.claim_residual = claim.amount
+                claim.claim_state = 'pending'
+                continue
+            if invoice.state == 'cancel' or invoice.payment_state == 'reversed':
+                claim.claim_residual = 0.0
+                claim.claim_state = 'written_off'
+                continue
+
+            currency = invoice.currency_id
+            residual = currency.round(allocated.get(claim.id, claim.amount))
+            claim.claim_residual = residual
+            if currency.is_zero(residual):
+                claim.claim_state = 'paid'
+            elif currency.compare_amounts(residual, claim.amount) < 0:
+                claim.claim_state = 'partial'
+            else:
+                claim.claim_state = 'pending'
+
+        # Written-off claims stop counting: settle the ledger once the new states are flushed
+        self._optical_queue_utilization_sync()
+
+    @api.model
+    def _optical_customer_open_amount(self, invoice, claims):
+        """
+        Part of the customer's share of ``invoice`` still unpaid.
+
+        The customer pays at the till (insurance and pay-later lines aside)
+        and through POS balance payments; anything else reconciled with the
+        invoice is the insurer's.
+        """
+        customer_share = invoice.amount_total - sum(claims.mapped('amount'))
+        paid = sum(
+            payment.amount
+            for payment in invoice.pos_order_ids.payment_ids
+            if not (payment.is_insurance or payment.payment_method_id.is_insurance_method)
+            and payment.payment_method_id.type != 'pay_later'
+        )
+        receivable = invoice.line_ids.filtered(lambda l: l.account_id.account_type == 'asset_receivable')
+        paid += sum(
+            partial.amount
+            for partial in receivable.matched_credit_ids
+            if partial.credit_move_id.payment_id.is_optical_balance_payment
+        )
+        return max(invoice.currency_id.round(customer_share - paid), 0.0)
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        claims = super().create(vals_list)
+        claims._optical_sync_utilization()
+        return claims
+
+    def write(self, vals):
+        res = super().write(vals)
+        if UTILIZATION_FIELDS & set(vals):
+            self._optical_sync_utilization()
+        return res
+
+    def unlink(self):
+        self._optical_sync_utilization(release=True)
+        return super().unlink()
+
+    def _optical_queue_utilization_sync(self):
+        """
+        Sync the ledger of ``self`` at the end of the transaction.
+
+        Claim status is a stored compute, so status changes coming from the
+        invoice (reconciliation, credit note) never go through write(). The
+        sync is diff-based, so queuing claims whose status did not change
+        costs nothing.
+        """
+        claim_ids = [claim_id for claim_id in self.ids if isinstance(claim_id, int)]
+        if not claim_ids:
+            return
+        pending = self.env.cr.precommit.data.setdefault(UTILIZATION_SYNC_KEY, set())
+        if not pending:
+            self.env.cr.precommit.add(self.sudo()._optical_run_queued_utilization_sync)
+        pending.update(claim_ids)
+
+    def _optical_run_queued_utilization_sync(self):
+        claim_ids = self.env.cr.precommit.data.pop(UTILIZATION_SYNC_KEY, set())
+        self.browse(claim_ids).exists()._optical_sync_utilization()
+        self.env.flush_all()
+
+    def _optical_utilization_key(self):
+        """Ledger key of the claim: patient, insurer, benefit (calendar) year, company."""
+        order = self.order_id
+        if not order.partner_id or not order.date_order:
+            return None
+        return (order.partner_id.id, self.insurance_company_id.id, order.date_order.year, order.company_id.id)
+
+    def _optical_sync_utilization(self, release=False):
+        """
+        Move the contribution of each claim in the utilization ledger.
+
+        Only the difference between what the claim counts now and what it
+        counted before is applied, so this is cheap to call after any change.
+        Written-off claims (cancelled or reversed invoices) stop counting;
+        refunds count through their negative amounts.
+        """
+        deltas = defaultdict(lambda: [0.0, 0])
+        updates = []
+        for claim in self:
+            old_line = claim.utilization_id
+            old_key = old_line and (old_line.partner_id.id, old_line.insurance_company_id.id,
+                                    old_line.benefit_year, old_line.company_id.id)
+            new_key = None if release else claim._optical_utilization_key()
+            new_amount = claim.amount if new_key and claim.claim_state != 'written_off' else 0.0
+            if not new_amount:
+                new_key = None
+            if old_key == new_key and claim.utilization_amount == new_amount:
+                continue
+            if old_key:
+                deltas[old_key][0] -= claim.utilization_amount
+                deltas[old_key][1] -= 1
+            if new_key:
+                deltas[new_key][0] += new_amount
+                deltas[new_key][1] += 1
+            updates.append((claim, new_key, new_amount))
+        if not updates:
+            return
+        line_ids = self.env['optical.insurance.utilization']._apply_deltas(
+            {key: tuple(delta) for key, delta in deltas.items()})
+        if release:
+            return
+        for claim, key, amount in updates:
+            # Bookkeeping fields only: does not trigger another sync
+            claim.write({
+                'utilization_id': line_ids[key] if key else False,
+                'utilization_amount': amount,
+            })
+
+    def init(self):
+        super().init()
+        # Per-insurer lookups, optionally narrowed to the invoiced claims
+        create_index(
+            self.env.cr,
+            'optical_insurance_payment_company_invoice_idx',
+            self._table,
+            ['insurance_company_id', 'invoice_id'],
+        )
+        # Insurer exposure, aging and follow-up lists only read open claims
+        create_index(
+            self.env.cr,
+            'optical_insurance_payment_open_claim_idx',
+            self._table,
+            ['insurance_company_id', 'create_date'],
+            where="claim_state IN ('pending', 'partial')",
+        )
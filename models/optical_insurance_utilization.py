@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import logging
+
+from odoo import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+
+class OpticalInsuranceUtilization(models.Model):
+    _name = "optical.insurance.utilization"
+    _description = "Optical Insurance Cover Utilization"
+    _order = "benefit_year desc, partner_id, insurance_company_id"
+
+    partner_id = fields.Many2one(
+        "res.partner",
+        string="Patient",
+        required=True,
+        readonly=True,
+        ondelete="cascade"
+    )
+    insurance_company_id = fields.Many2one(
+        "optical.insurance.company",
+        string="Insurance Company",
+        required=True,
+        readonly=True,
+        index=True,
+        ondelete="cascade"
+    )
+    benefit_year = fields.Integer(string="Benefit Year", required=True, readonly=True)
+    company_id = fields.Many2one(
+        "res.company",
+        string="Company",
+        required=True,
+        readonly=True,
+        ondelete="cascade"
+    )
+    amount_used = fields.Float(
+        string="Cover Used",
+        readonly=True,
+        help="Insurance amounts claimed in the benefit year, net of refunds; written-off claims are excluded."
+    )
+    claim_count = fields.Integer(string="Claims", readonly=True)
+    annual_cover_limit = fields.Float(related="insurance_company_id.annual_cover_limit")
+    remaining_cover = fields.Float(
+        string="Remaining Cover",
+        compute="_compute_remaining_cover",
+        help="Annual cover left; zero when the insurer has no annual limit."
+    )
+
+    _sql_constraints = [
+        (
+            'utilization_key_unique',
+            'unique(partner_id, insurance_company_id, benefit_year, company_id)',
+            'There can only be one utilization line per patient, insurer, benefit year and company.',
+        ),
+    ]
+
+    @api.depends('amount_used', 'annual_cover_limit')
+    def _compute_remaining_cover(self):
+        for line in self:
+            limit = line.annual_cover_limit
+            line.remaining_cover = max(limit - line.amount_used, 0.0) if limit else 0.0
+
+    def _apply_deltas(self, deltas):
+        """
+        Add ``{(partner_id, insurer_id, year, company_id): (amount, claims)}`` to the ledger.
+
+        Each key is one upsert, so concurrent tills adding to the same patient
+        serialize on the ledger row instead of losing an update. Returns the
+        ledger id of every key.
+        """
+        ids = {}
+        for key, (amount, claims) in deltas.items():
+            partner_id, insurance_company_id, benefit_year, company_id = key
+            self.env.cr.execute("""
+                INSERT INTO optical_insurance_utilization AS line
+                    (partner_id, insurance_company_id, benefit_year, company_id, amount_used, claim_count,
+                     create_uid, create_date, write_uid, write_date)
+                VALUES (%(partner)s, %(insurer)s, %(year)s, %(company)s, %(amount)s, %(claims)s,
+                        %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC')
+                ON CONFLICT (partner_id, insurance_company_id, benefit_year, company_id) DO UPDATE
+                SET amount_used = line.amount_used + EXCLUDED.amount_used,
+                    claim_count = line.claim_count + EXCLUDED.claim_count,
+                    write_uid = EXCLUDED.write_uid,
+                    write_date = EXCLUDED.write_date
+                RETURNING id
+            """, {
+                'partner': partner_id,
+                'insurer': insurance_company_id,
+                'year': benefit_year,
+                'company': company_id,
+                'amount': amount,
+                'claims': claims,
+                'uid': self.env.uid,
+            })
+            ids[key] = self.env.cr.fetchone()[0]
+        self.invalidate_model(['amount_used', 'claim_count', 'write_uid', 'write_date'])
+        return ids
+
+    @api.model
+    def _rebuild(self):
+        """Recompute the whole ledger from the insurance claims (install and repair)."""
+        Claim = self.env['optical.insurance.payment']
+        Claim.flush_model()
+        self.env['pos.order'].flush_model(['partner_id', 'date_order', 'company_id'])
+        cr = self.env.cr
+        _logger.info('[BP Optical POS] Rebuilding the insurance utilization ledger')
+        cr.execute("UPDATE optical_insurance_payment SET utilization_id = NULL, utilization_amount = 0")
+        cr.execute("DELETE FROM optical_insurance_utilization")
+        cr.execute("""
+            INSERT INTO optical_insurance_utilization
+                (partner_id, insurance_company_id, benefit_year, company_id, amount_used, claim_count,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT o.partner_id, c.insurance_company_id, EXTRACT(YEAR FROM o.date_order)::int, o.company_id,
+                   SUM(c.amount), COUNT(*),
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM optical_insurance_payment c
+            JOIN pos_order o ON o.id = c.order_id
+            WHERE o.partner_id IS NOT NULL
+              AND c.claim_state IS DISTINCT FROM 'written_off'
+            GROUP BY o.partner_id, c.insurance_company_id, EXTRACT(YEAR FROM o.date_order)::int, o.company_id
+        """, {'uid': self.env.uid})
+        cr.execute("""
+            UPDATE optical_insurance_payment c
+            SET utilization_id = line.id, utilization_amount = c.amount
+            FROM pos_order o, optical_insurance_utilization line
+            WHERE o.id = c.order_id
+              AND c.claim_state IS DISTINCT FROM 'written_off'
+              AND line.partner_id = o.partner_id
+              AND line.insurance_company_id = c.insurance_company_id
+              AND line.benefit_year = EXTRACT(YEAR FROM o.date_order)::int
+              AND line.company_id = o.company_id
+        """)
+        self.env.invalidate_all()
+
+    @api.model
+    def optical_get_remaining_cover(self, partner_id, insurance_company_id, date=None):
+        """
+        Return the patient's annual cover usage with an insurer.
+
+        Reads the single ledger line of the benefit year instead of summing
+        the claim history. ``remaining`` is ``None`` when the insurer has no
+        annual limit.
+        """
+        benefit_year = (fields.Date.to_date(date) if date else fields.Date.context_today(self)).year
+        line = self.search([
+            ('partner_id', '=', int(partner_id)),
+            ('insurance_company_id', '=', int(insurance_company_id)),
+            ('benefit_year', '=', benefit_year),
+            ('company_id', '=', self.env.company.id),
+        ], limit=1)
+        limit = self.env['optical.insurance.company'].browse(int(insurance_company_id)).annual_cover_limit
+        used = line.amount_used
+        return {
+            'benefit_year': benefit_year,
+            'used': used,
+            'claims': line.claim_count,
+            'limit': limit,
+            'remaining': max(limit - used, 0.0) if limit else None,
+        }
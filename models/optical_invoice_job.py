@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from datetime import timedelta
+import logging
+
+from odoo import models, fields, api
+from odoo.tools.sql import create_index
+
+_logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+
+
+class OpticalInvoiceJob(models.Model):
+    _name = "optical.invoice.job"
+    _description = "Optical POS Invoice Post-Processing Job"
+    _order = "id desc"
+
+    order_id = fields.Many2one(
+        "pos.order",
+        string="POS Order",
+        required=True,
+        index=True,
+        ondelete="cascade"
+    )
+    invoice_id = fields.Many2one(
+        "account.move",
+        string="Invoice",
+        ondelete="set null"
+    )
+    state = fields.Selection(
+        [
+            ('pending', 'Pending'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+        ],
+        string="Status",
+        default='pending',
+        required=True
+    )
+    attempts = fields.Integer(string="Attempts", default=0)
+    next_attempt_at = fields.Datetime(
+        string="Next Attempt",
+        default=fields.Datetime.now,
+        help="Pending jobs are not picked up before this time."
+    )
+    done_at = fields.Datetime(string="Processed On", readonly=True)
+    last_error = fields.Text(string="Last Error", readonly=True)
+    company_id = fields.Many2one(
+        "res.company",
+        string="Company",
+        related="order_id.company_id",
+        store=True,
+        readonly=True
+    )
+
+    def init(self):
+        super().init()
+        # Queue polling only ever reads pending jobs
+        create_index(
+            self.env.cr,
+            'optical_invoice_job_pending_idx',
+            self._table,
+            ['next_attempt_at', 'id'],
+            where="state = 'pending'",
+        )
+
+    @api.model
+    def _enqueue(self, orders):
+        """Queue the deferred invoice post-processing of ``orders``."""
+        jobs = self.sudo().create([{
+            'order_id': order.id,
+            'invoice_id': order.account_move.id,
+        } for order in orders])
+        self.env.ref('bp_optical_pos.ir_cron_optical_invoice_jobs').sudo()._trigger()
+        return jobs
+
+    @api.model
+    def _claim_jobs(self, limit):
+        """Lock and return due pending jobs that no other worker is processing."""
+        self.env.cr.execute("""
+            SELECT id FROM optical_invoice_job
+            WHERE state = 'pending' AND next_attempt_at <= %s
+            ORDER BY next_attempt_at, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, [fields.Datetime.now(), limit])
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    def _process(self):
+        """Run each job in its own savepoint; reschedule the ones that fail."""
+        for job in self:
+            try:
+                with self.env.cr.savepoint():
+                    job.order_id._optical_run_deferred_invoice_postprocess()
+            except Exception as e:
+                _logger.warning('[BP Optical POS] Invoice job %s failed: %s', job.id, e)
+                job._schedule_retry(str(e))
+            else:
+                job.write({'state': 'done', 'done_at': fields.Datetime.now(), 'last_error': False})
+
+    def _schedule_retry(self, error):
+        attempts = self.attempts + 1
+        vals = {'attempts': attempts, 'last_error': error}
+        if attempts >= MAX_ATTEMPTS:
+            vals['state'] = 'failed'
+        else:
+            delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+            vals['next_attempt_at'] = fields.Datetime.now() + timedelta(seconds=delay)
+        self.write(vals)
+
+    @api.model
+    def _cron_process_jobs(self, batch_size=BATCH_SIZE, max_batches=20):
+        """
+        Process due jobs in batches, committing after each batch.
+
+        Jobs are claimed with SKIP LOCKED, so several cron workers (or a manual
+        run next to the cron) share the queue without processing a job twice.
+        """
+        for _batch in range(max_batches):
+            jobs = self._claim_jobs(batch_size)
+            if not jobs:
+                break
+            jobs._process()
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+
+    def action_retry(self):
+        self.filtered(lambda j: j.state != 'done').write({
+            'state': 'pending',
+            'attempts': 0,
+            'next_attempt_at': fields.Datetime.now(),
+        })
+        self.env.ref('bp_optical_pos.ir_cron_optical_invoice_jobs')._trigger()
+
+    @api.model
+    def get_queue_metrics(self):
+        """Return queue depth, failures and lag (age of the oldest pending job)."""
+        self.env.cr.execute("""
+            SELECT count(*) FILTER (WHERE state = 'pending'),
+                   count(*) FILTER (WHERE state = 'pending' AND next_attempt_at <= %s),
+                   count(*) FILTER (WHERE state = 'failed'),
+                   min(create_date) FILTER (WHERE state = 'pending')
+            FROM optical_invoice_job
+            WHERE state IN ('pending', 'failed')
+        """, [fields.Datetime.now()])
+        pending, due, failed, oldest = self.env.cr.fetchone()
+        lag = (fields.Datetime.now() - oldest).total_seconds() if oldest else 0.0
+        return {
+            'pending': pending,
+            'due': due,
+            'failed': failed,
+            'lag_seconds': lag,
+        }
+
+    @api.model
+    def _prometheus_lines(self):
+        """Queue gauges in Prometheus text format; unlike the RPC metrics they are database-wide."""
+        queue = self.get_queue_metrics()
+        lines = []
+        gauges = (
+            ('bp_optical_pos_invoice_jobs_pending', 'pending', "Invoice post-processing jobs waiting."),
+            ('bp_optical_pos_invoice_jobs_due', 'due', "Pending invoice jobs whose next attempt is due."),
+            ('bp_optical_pos_invoice_jobs_failed', 'failed', "Invoice jobs that exhausted their retries."),
+            ('bp_optical_pos_invoice_jobs_lag_seconds', 'lag_seconds', "Age of the oldest pending invoice job."),
+        )
+        for name, key, help_text in gauges:
+            lines += ['# HELP %s %s' % (name, help_text), '# TYPE %s gauge' % name, '%s %r' % (name, float(queue[key]))]
+        return lines
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from odoo import models, api, _
+from odoo.exceptions import AccessError
+
+from ..tools import metrics
+
+
+class OpticalPosMetrics(models.AbstractModel):
+    _name = "optical.pos.metrics"
+    _description = "Optical POS Endpoint Metrics"
+
+    def _check_metrics_access(self):
+        if not self.env.user.has_group('bp_optical_pos.group_optical_pos_manager'):
+            raise AccessError(_("Only Optical POS managers can read the endpoint metrics."))
+
+    @api.model
+    def get_prometheus_metrics(self):
+        """Return the metrics of the worker serving this call, Prometheus text format."""
+        self._check_metrics_access()
+        return metrics.render_prometheus(self.env['optical.invoice.job'].sudo()._prometheus_lines())
+
+    @api.model
+    def get_recent_calls(self, limit=100):
+        """Return the most recent instrumented calls of this worker, newest first."""
+        self._check_metrics_access()
+        return [{
+            'method': sample.method,
+            'timestamp': sample.timestamp,
+            'wall_ms': round(sample.wall * 1000.0, 3),
+            'queries': sample.queries,
+            'sql_ms': round(sample.sql_time * 1000.0, 3),
+            'failed': sample.failed,
+        } for sample in metrics.recent_samples(limit)]
+
+    @api.model
+    def reset_metrics(self):
+        """Clear the metrics of the worker serving this call."""
+        self._check_metrics_access()
+        metrics.reset()
+        return True
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import datetime
+import logging
+import threading
+import time
+
+from odoo import models, fields, api, SUPERUSER_ID, _
+from odoo.exceptions import UserError
+
+from ..tools.prescription_cache import get_cache
+from ..tools.tracing import trace
+
+_logger = logging.getLogger(__name__)
+
+PRESCRIPTION_FIELDS = (
+    'sphere_od', 'cylinder_od', 'axis_od', 'add_od', 'pd_od',
+    'sphere_os', 'cylinder_os', 'axis_os', 'add_os', 'pd_os',
+)
+# Tests written by transactions still open at the last refresh carry an older write_date
+WATERMARK_MARGIN = datetime.timedelta(minutes=5)
+# Patients losing a test are logged this long; an older cache is rebuilt instead
+CHANGE_RETENTION = datetime.timedelta(days=7)
+REBUILD_CHUNK_SIZE = 50000
+
+
+class OpticalPrescriptionChange(models.Model):
+    _name = "optical.prescription.change"
+    _description = "Optical Prescription Cache Change"
+    _log_access = False
+
+    # Plain integer: the log must outlive the partner
+    partner_id = fields.Integer(string="Partner", required=True)
+    changed_at = fields.Datetime(string="Changed At", required=True, index=True, default=fields.Datetime.now)
+
+    @api.model
+    def _mark(self, partner_ids):
+        """Log patients whose latest test may be gone (test deleted or moved away)."""
+        partner_ids = {partner_id for partner_id in partner_ids if partner_id}
+        if partner_ids:
+            self.sudo().create([{'partner_id': partner_id} for partner_id in sorted(partner_ids)])
+
+    @api.autovacuum
+    def _gc_changes(self):
+        self.env.cr.execute(
+            "DELETE FROM optical_prescription_change WHERE changed_at < %s",
+            [self.env.cr.now() - CHANGE_RETENTION - WATERMARK_MARGIN],
+        )
+
+
+class OpticalPrescriptionSearch(models.AbstractModel):
+    _name = "optical.prescription.search"
+    _description = "Optical Prescription Range Search"
+
+    def _latest_prescriptions_query(self, where):
+        return """
+            SELECT DISTINCT ON (t.patient_id) t.patient_id, t.company_id, %s
+            FROM optical_test t
+            WHERE t.patient_id IS NOT NULL AND %s
+            ORDER BY t.patient_id, t.test_date DESC NULLS LAST, t.id DESC
+        """ % (', '.join('t.%s' % name for name in PRESCRIPTION_FIELDS), where)
+
+    def _rebuild(self, cache):
+        """Load the latest prescription of every patient, in patient-ordered chunks."""
+        cr = self.env.cr
+        watermark = cr.now()
+        cache.reset()
+        last_partner_id = 0
+        while True:
+            cr.execute(self._latest_prescriptions_query('t.patient_id > %s') + ' LIMIT %s',
+                       [last_partner_id, REBUILD_CHUNK_SIZE])
+            rows = cr.fetchall()
+            if not rows:
+                break
+            cache.upsert(rows)
+            last_partner_id = rows[-1][0]
+        cache.watermark = watermark
+        cache.built_at = time.monotonic()
+
+    def _build(self, cache):
+        try:
+            with cache.lock:
+                self._rebuild(cache)
+        finally:
+            cache.building = False
+        trace(self.env, 'prescription_cache.rebuilt', patients=len(cache))
+
+    def _build_in_thread(self, registry, cache):
+        try:
+            with registry.cursor() as cr:
+                api.Environment(cr, SUPERUSER_ID, {})[self._name]._build(cache)
+        except Exception:
+            cache.building = False
+            _logger.exception('[BP Optical POS] Prescription cache build failed')
+
+    def _schedule_build(self, cache):
+        """(Re)build the cache of this worker off the request path."""
+        with cache.lock:
+            if cache.building:
+                return
+            cache.building = True
+            cache.built_at = None
+        if self.env.registry.in_test_mode():
+            self._build(cache)
+            return
+        threading.Thread(
+            target=self._build_in_thread,
+            args=(self.env.registry, cache),
+            name='bp_optical_pos.prescription_cache',
+            daemon=True,
+        ).start()
+
+    def _refresh(self):
+        """
+        Bring this worker's cache up to date, or return ``None`` while it is being built.
+
+        Patients with a test written since the last refresh are re-read, as
+        are the patients logged in optical.prescription.change (a test
+        deleted or moved to another patient); those left without tests leave
+        the cache.
+        """
+        cache = get_cache(self.env.cr.dbname, PRESCRIPTION_FIELDS)
+        self.env['optical.test'].flush_model()
+        self.env['optical.prescription.change'].flush_model()
+        cr = self.env.cr
+        now = cr.now()
+        if cache.built_at is None or now - cache.watermark > CHANGE_RETENTION:
+            self._schedule_build(cache)
+            return cache if cache.built_at is not None else None
+        with cache.lock:
+            since = cache.watermark - WATERMARK_MARGIN
+            cr.execute("""
+                SELECT patient_id FROM optical_test WHERE write_date >= %(since)s AND patient_id IS NOT NULL
+                UNION
+                SELECT partner_id FROM optical_prescription_change WHERE changed_at >= %(since)s
+            """, {'since': since})
+            partner_ids = [row[0] for row in cr.fetchall()]
+            if partner_ids:
+                cr.execute(self._latest_prescriptions_query('t.patient_id IN %s'), [tuple(partner_ids)])
+                rows = cr.fetchall()
+                cache.upsert(rows)
+                cache.remove(set(partner_ids) - {row[0] for row in rows})
+            cache.watermark = now
+        return cache
+
+    def _search_database(self, bounds, limit=None):
+        """Answer a query from the database, with the cache's float32 comparison."""
+        conditions = ['(l.company_id IS NULL OR l.company_id IN %s)']
+        params = [tuple(self.env.companies.ids)]
+        for name, (low, high) in bounds.items():
+            if low is None and high is None:
+                conditions.append('l.%s IS NOT NULL' % name)
+            if low is not None:
+                conditions.append('l.%s::real >= %%s::real' % name)
+                params.append(low)
+            if high is not None:
+                conditions.append('l.%s::real <= %%s::real' % name)
+                params.append(high)
+        query = 'SELECT l.patient_id FROM (%s) l WHERE %s ORDER BY l.patient_id' % (
+            self._latest_prescriptions_query('TRUE'), ' AND '.join(conditions))
+        if limit:
+            query += ' LIMIT %s'
+            params.append(limit)
+        self.env.cr.execute(query, params)
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    @api.model
+    def search_partners(self, ranges, limit=None):
+        """
+        Return the ids of the patients whose latest prescription matches every range.
+
+        ``ranges`` maps prescription fields to ``[low, high]`` (inclusive,
+        ``None`` for an open side), e.g. ``{'sphere_od': [-6, -4],
+        'cylinder_od': [None, -2]}``. Only the patients of the allowed
+        companies are returned. Until this worker's cache is built, the
+        query runs in the database.
+        """
+        self.env['optical.test'].check_access_rights('read')
+        unknown = set(ranges) - set(PRESCRIPTION_FIELDS)
+        if unknown:
+            raise UserError(_("Unknown prescription fields: %s", ', '.join(sorted(unknown))))
+        bounds = {}
+        for name, (low, high) in ranges.items():
+            bounds[name] = (
+                None if low is None or low is False else float(low),
+                None if high is None or high is False else float(high),
+            )
+        cache = self._refresh()
+        if cache is None:
+            return self._search_database(bounds, limit)
+        with cache.lock:
+            return cache.query(bounds, company_ids=self.env.companies.ids, limit=limit)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import csv
+import datetime
+import io
+
+from odoo import models, fields, api
+from odoo.tools import split_every
+from odoo.tools.sql import create_index
+
+from ..tools.tracing import trace
+from .optical_prescription_search import CHANGE_RETENTION
+
+WATERMARK_PARAM = 'bp_optical_pos.recall_watermark'
+# Tests written by transactions still running when the watermark was taken
+# carry an older write_date; rescanning a margin catches them.
+WATERMARK_MARGIN = datetime.timedelta(minutes=15)
+CHUNK_SIZE = 10000
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FIELDS = ['partner_id', 'phone', 'mobile', 'email', 'branch_id', 'reason', 'due_date', 'test_id', 'state']
+
+
+class OpticalRecall(models.Model):
+    _name = "optical.recall"
+    _description = "Optical Patient Recall"
+    _order = "due_date, id"
+
+    partner_id = fields.Many2one("res.partner", string="Patient", required=True, readonly=True, ondelete="cascade")
+    test_id = fields.Many2one(
+        "optical.test",
+        string="Latest Test",
+        required=True,
+        readonly=True,
+        ondelete="cascade"
+    )
+    test_date = fields.Datetime(string="Test Date", readonly=True)
+    branch_id = fields.Many2one("optical.branch", string="Branch", readonly=True, index="btree_not_null")
+    company_id = fields.Many2one("res.company", string="Company", readonly=True)
+    reason = fields.Selection(
+        [('follow_up', 'Follow-up'), ('expiry', 'Prescription Expiry')],
+        string="Reason",
+        readonly=True
+    )
+    due_date = fields.Date(string="Due Date", readonly=True)
+    state = fields.Selection(
+        [('pending', 'Pending'), ('contacted', 'Contacted'), ('dismissed', 'Dismissed')],
+        string="Status",
+        default='pending',
+        required=True
+    )
+    phone = fields.Char(related="partner_id.phone")
+    mobile = fields.Char(related="partner_id.mobile")
+    email = fields.Char(related="partner_id.email")
+
+    _sql_constraints = [
+        ('partner_unique', 'unique(partner_id)', 'A patient can only be in the recall queue once.'),
+    ]
+
+    def init(self):
+        super().init()
+        cr = self.env.cr
+        # Recall lists are read by due date, pending ones first
+        create_index(cr, 'optical_recall_pending_due_idx', self._table, ['due_date'], where="state = 'pending'")
+
+    def action_mark_contacted(self):
+        self.write({'state': 'contacted'})
+
+    def action_dismiss(self):
+        self.write({'state': 'dismissed'})
+
+    def action_reset(self):
+        self.write({'state': 'pending'})
+
+    def _dirty_patients(self, since):
+        """
+        Patients whose latest test may have changed since ``since``.
+
+        Tests written since then, and patients who lost a test (deleted or
+        moved to another patient, logged in optical.prescription.change).
+        """
+        self.env.cr.execute("""
+            SELECT patient_id FROM optical_test WHERE write_date >= %(since)s AND patient_id IS NOT NULL
+            UNION
+            SELECT partner_id FROM optical_prescription_change WHERE changed_at >= %(since)s
+            ORDER BY 1
+        """, {'since': since})
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _all_patients(self, after_id, limit):
+        """Next ``limit`` patients with tests after ``after_id`` (first build)."""
+        self.env.cr.execute("""
+            SELECT DISTINCT patient_id FROM optical_test
+            WHERE patient_id > %s ORDER BY patient_id LIMIT %s
+        """, [after_id, limit])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _merge_patients(self, partner_ids):
+        """
+        Queue the latest test of each patient of ``partner_ids``.
+
+        A patient whose latest test changes is recalled again (state back
+        to pending); patients left without tests leave the queue.
+        """
+        cr = self.env.cr
+        cr.execute("""
+            INSERT INTO optical_recall AS recall
+                (partner_id, test_id, test_date, branch_id, company_id, reason, due_date, state,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT DISTINCT ON (t.patient_id)
+                   t.patient_id, t.id, t.test_date, t.branch_id, t.company_id,
+                   CASE WHEN t.follow_up_required AND t.follow_up_date IS NOT NULL
+                             AND (t.validity_until IS NULL OR t.follow_up_date <= t.validity_until)
+                        THEN 'follow_up'
+                        WHEN t.validity_until IS NOT NULL THEN 'expiry'
+                   END,
+                   LEAST(CASE WHEN t.follow_up_required THEN t.follow_up_date END, t.validity_until),
+                   'pending',
+                   %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM optical_test t
+            WHERE t.patient_id = ANY(%(partners)s)
+            ORDER BY t.patient_id, t.test_date DESC NULLS LAST, t.id DESC
+            ON CONFLICT (partner_id) DO UPDATE
+            SET test_id = EXCLUDED.test_id,
+                test_date = EXCLUDED.test_date,
+                branch_id = EXCLUDED.branch_id,
+                company_id = EXCLUDED.company_id,
+                reason = EXCLUDED.reason,
+                due_date = EXCLUDED.due_date,
+                state = CASE WHEN recall.test_id = EXCLUDED.test_id THEN recall.state ELSE 'pending' END,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+        """, {'partners': partner_ids, 'uid': self.env.uid})
+        cr.execute("""
+            DELETE FROM optical_recall recall
+            WHERE recall.partner_id = ANY(%s)
+              AND NOT EXISTS (SELECT 1 FROM optical_test t WHERE t.patient_id = recall.partner_id)
+        """, [partner_ids])
+
+    @api.model
+    def _cron_build_recalls(self, chunk_size=CHUNK_SIZE):
+        """
+        Refresh the recall queue of the patients with tests written since the last run.
+
+        The first run (or a run after the watermark parameter is removed,
+        or after a pause longer than the change log is kept) walks every
+        patient. Patients are merged in chunks, committing after
+        each; the watermark only moves once every chunk is done.
+        """
+        Param = self.env['ir.config_parameter'].sudo()
+        started_at = self.env.cr.now()
+        watermark = Param.get_param(WATERMARK_PARAM)
+        self.env['optical.test'].flush_model()
+        self.env['optical.prescription.change'].flush_model()
+        # Patients who lost a test are only logged for CHANGE_RETENTION
+        full = not watermark or started_at - fields.Datetime.to_datetime(watermark) >= CHANGE_RETENTION
+        if full:
+            chunks = self._iter_all_patients(chunk_size)
+        else:
+            since = fields.Datetime.to_datetime(watermark) - WATERMARK_MARGIN
+            chunks = split_every(chunk_size, self._dirty_patients(since), list)
+        patients = 0
+        for partner_ids in chunks:
+            self._merge_patients(partner_ids)
+            patients += len(partner_ids)
+            if not self.env.registry.in_test_mode():
+                self.env.cr.commit()
+        Param.set_param(WATERMARK_PARAM, fields.Datetime.to_string(started_at))
+        self.invalidate_model()
+        trace(self.env, 'recall.built', patients=patients, full=full)
+
+    def _iter_all_patients(self, chunk_size):
+        after_id = 0
+        while True:
+            partner_ids = self._all_patients(after_id, chunk_size)
+            if not partner_ids:
+                return
+            yield partner_ids
+            after_id = partner_ids[-1]
+
+    @api.model
+    def _export_domain(self, horizon_days=30, branch_id=None):
+        """Pending recalls due within ``horizon_days``."""
+        due_before = fields.Date.context_today(self) + datetime.timedelta(days=int(horizon_days))
+        domain = [('state', '=', 'pending'), ('due_date', '!=', False), ('due_date', '<=', due_before)]
+        if branch_id:
+            domain.append(('branch_id', '=', int(branch_id)))
+        return domain
+
+    @api.model
+    def _iter_csv(self, domain):
+        """Yield the recalls matching ``domain`` as CSV text, one chunk at a time (keyset paging)."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        labels = self.fields_get(EXPORT_FIELDS, ['string'])
+        writer.writerow([labels[name]['string'] for name in EXPORT_FIELDS])
+        reasons = dict(self._fields['reason'].selection)
+        states = dict(self._fields['state'].selection)
+        last_id = 0
+        while True:
+            records = self.search_read(domain + [('id', '>', last_id)], EXPORT_FIELDS, order='id', limit=EXPORT_CHUNK_SIZE)
+            if not records:
+                break
+            for record in records:
+                writer.writerow([
+                    record['partner_id'][1] if record['partner_id'] else '',
+                    record['phone'] or '',
+                    record['mobile'] or '',
+                    record['email'] or '',
+                    record['branch_id'][1] if record['branch_id'] else '',
+                    reasons.get(record['reason'], ''),
+                    fields.Date.to_string(record['due_date']) if record['due_date'] else '',
+                    record['test_id'][1] if record['test_id'] else '',
+                    states.get(record['state'], ''),
+                ])
+            last_id = records[-1]['id']
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            self.env.invalidate_all()
+        if buffer.tell():
+            yield buffer.getvalue()
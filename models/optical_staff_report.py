@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from odoo import models, fields, tools
+
+# A sale more than this many days after the test is not credited to it
+SALE_WINDOW_DAYS = 90
+
+
+class OpticalStaffReport(models.Model):
+    _name = "optical.staff.report"
+    _description = "Optometrist and Optician Throughput"
+    _auto = False
+    _order = "test_date desc"
+
+    test_id = fields.Many2one("optical.test", string="Test", readonly=True)
+    test_date = fields.Datetime(string="Test Date", readonly=True)
+    branch_id = fields.Many2one("optical.branch", string="Branch", readonly=True)
+    company_id = fields.Many2one("res.company", string="Company", readonly=True)
+    optometrist_id = fields.Many2one("res.users", string="Optometrist", readonly=True)
+    optician_id = fields.Many2one("optical.optician", string="Optician", readonly=True)
+    stage_id = fields.Many2one("optical.prescription.stage", string="Stage", readonly=True)
+    patient_id = fields.Many2one("res.partner", string="Patient", readonly=True)
+    sale_order_id = fields.Many2one("pos.order", string="Sale", readonly=True)
+    test_count = fields.Integer(string="Tests", readonly=True)
+    converted_count = fields.Integer(
+        string="Tests Sold",
+        readonly=True,
+        help="Tests followed by a sale to the patient within %d days." % SALE_WINDOW_DAYS
+    )
+    completed_count = fields.Integer(string="Jobs Completed", readonly=True)
+    hours_to_sale = fields.Float(
+        string="Hours to Sale",
+        readonly=True,
+        group_operator="avg",
+        help="Time from the test to the first sale to the patient."
+    )
+    turnaround_hours = fields.Float(
+        string="Turnaround (h)",
+        readonly=True,
+        group_operator="avg",
+        help="Time from the test until the job reached a final stage."
+    )
+
+    def _query(self):
+        # Jobs completed before stage transitions were logged fall back on their last write
+        return """
+            SELECT t.id AS id,
+                   t.id AS test_id,
+                   t.test_date AS test_date,
+                   t.branch_id AS branch_id,
+                   t.company_id AS company_id,
+                   t.optometrist_id AS optometrist_id,
+                   t.optician_id AS optician_id,
+                   t.stage_id AS stage_id,
+                   t.patient_id AS patient_id,
+                   sale.id AS sale_order_id,
+                   1 AS test_count,
+                   CASE WHEN sale.id IS NOT NULL THEN 1 ELSE 0 END AS converted_count,
+                   CASE WHEN stage.is_final THEN 1 ELSE 0 END AS completed_count,
+                   EXTRACT(EPOCH FROM sale.date_order - t.test_date) / 3600.0 AS hours_to_sale,
+                   CASE WHEN stage.is_final
+                        THEN EXTRACT(EPOCH FROM COALESCE(done.date, t.write_date) - t.test_date) / 3600.0
+                   END AS turnaround_hours
+            FROM optical_test t
+            LEFT JOIN optical_prescription_stage stage ON stage.id = t.stage_id
+            LEFT JOIN LATERAL (
+                SELECT o.id, o.date_order
+                FROM pos_order o
+                WHERE o.partner_id = t.patient_id
+                  AND o.date_order >= t.test_date
+                  AND o.date_order < t.test_date + interval '%d days'
+                  AND o.state IN ('paid', 'done', 'invoiced')
+                ORDER BY o.date_order
+                LIMIT 1
+            ) sale ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT min(log.date) AS date
+                FROM optical_test_stage_log log
+                JOIN optical_prescription_stage final_stage ON final_stage.id = log.to_stage_id
+                WHERE log.test_id = t.id AND final_stage.is_final
+            ) done ON stage.is_final
+            WHERE t.test_date IS NOT NULL
+        """ % SALE_WINDOW_DAYS
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("CREATE OR REPLACE VIEW %s AS (%s)" % (self._table, self._query()))
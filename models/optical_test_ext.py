@@ -3,8 +3,57 @@
 
 from odoo import models, fields, api, _
 from odoo.exceptions import AccessError
+from odoo.tools.sql import create_index
 
 # Logic moved to bp_optical_core/models/optical_test.py
 class OpticalTest(models.Model):
     _inherit = "optical.test"
-    pass
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override to log the initial stage of new tests."""
+        tests = super().create(vals_list)
+        # Historical imports must not date their stage from the import
+        if self.env.context.get('optical_skip_stage_log'):
+            return tests
+        self.env['optical.test.stage.log']._log_transitions([
+            (test, False, test.stage_id.id) for test in tests if test.stage_id
+        ])
+        return tests
+
+    def write(self, vals):
+        """Override to log stage transitions, including bulk ones."""
+        if 'patient_id' in vals:
+            # The previous patients' latest test may be gone from the prescription cache
+            self.env['optical.prescription.change']._mark(
+                self.filtered(lambda test: test.patient_id.id != vals['patient_id']).patient_id.ids)
+        if 'stage_id' not in vals:
+            return super().write(vals)
+        previous = {test.id: test.stage_id.id for test in self}
+        res = super().write(vals)
+        self.env['optical.test.stage.log']._log_transitions([
+            (test, previous[test.id], test.stage_id.id)
+            for test in self if test.stage_id.id != previous[test.id]
+        ])
+        return res
+
+    def unlink(self):
+        """Override to drop the patients' deleted tests from the prescription cache."""
+        self.env['optical.prescription.change']._mark(self.patient_id.ids)
+        return super().unlink()
+
+    def init(self):
+        super().init()
+        cr = self.env.cr
+        # Throughput report filters and groups tests by staff or branch over a period
+        create_index(cr, 'optical_test_optometrist_date_idx', self._table, ['optometrist_id', 'test_date'])
+        create_index(cr, 'optical_test_branch_date_idx', self._table, ['branch_id', 'test_date'])
+        create_index(
+            cr,
+            'optical_test_optician_date_idx',
+            self._table,
+            ['optician_id', 'test_date'],
+            where='optician_id IS NOT NULL',
+        )
+        # Latest test of a patient (recalls, prescription cache)
+        create_index(cr, 'optical_test_patient_date_idx', self._table, ['patient_id', 'test_date DESC', 'id DESC'])
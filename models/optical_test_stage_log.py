@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import datetime
+
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
+
+
+class OpticalTestStageLog(models.Model):
+    _name = "optical.test.stage.log"
+    _description = "Optical Test Stage Transition"
+    _order = "date desc, id desc"
+    _log_access = False
+
+    test_id = fields.Many2one("optical.test", string="Test", required=True, readonly=True, ondelete="cascade")
+    from_stage_id = fields.Many2one("optical.prescription.stage", string="From Stage", readonly=True, ondelete="set null")
+    to_stage_id = fields.Many2one("optical.prescription.stage", string="To Stage", readonly=True, ondelete="set null")
+    user_id = fields.Many2one("res.users", string="User", readonly=True, ondelete="set null")
+    date = fields.Datetime(string="Date", required=True, readonly=True)
+    branch_id = fields.Many2one("optical.branch", string="Branch", readonly=True, ondelete="set null")
+    hours_in_stage = fields.Float(
+        string="Hours in Previous Stage",
+        readonly=True,
+        group_operator="avg",
+        help="Time the job spent in the stage it left."
+    )
+
+    def init(self):
+        super().init()
+        # Last transition of a test, when logging the next one
+        create_index(self.env.cr, 'optical_test_stage_log_test_date_idx', self._table, ['test_id', 'date'])
+
+    def write(self, vals):
+        raise UserError(_("Stage transitions are an append-only history and cannot be modified."))
+
+    def unlink(self):
+        raise UserError(_("Stage transitions are an append-only history and cannot be deleted."))
+
+    @api.model
+    def _log_transitions(self, transitions):
+        """
+        Append ``[(test, from_stage_id, to_stage_id)]`` to the log and the weekly aggregates.
+
+        One INSERT covers the whole batch, so bulk stage changes cost the
+        same few queries as a single one. The time spent in the stage left
+        is measured from the previous transition of the test, or from its
+        creation for the first one.
+        """
+        if not transitions:
+            return
+        cr = self.env.cr
+        now = fields.Datetime.now()
+        test_ids = tuple({test.id for test, _from, _to in transitions})
+        cr.execute("""
+            SELECT test_id, max(date)
+            FROM optical_test_stage_log
+            WHERE test_id IN %s
+            GROUP BY test_id
+        """, [test_ids])
+        entered_at = dict(cr.fetchall())
+
+        rows = []
+        for test, from_stage_id, to_stage_id in transitions:
+            since = entered_at.get(test.id) or test.create_date
+            hours = (now - since).total_seconds() / 3600.0 if since and from_stage_id else None
+            rows.append((test.id, from_stage_id or None, to_stage_id or None, self.env.uid, now,
+                         test.branch_id.id or None, hours))
+            entered_at[test.id] = now
+        cr.execute(
+            """
+            INSERT INTO optical_test_stage_log
+                (test_id, from_stage_id, to_stage_id, user_id, date, branch_id, hours_in_stage)
+            VALUES %s
+            """ % ', '.join(['%s'] * len(rows)),
+            rows,
+        )
+        self.env['optical.stage.time.weekly']._add_transitions([
+            (branch_id, from_stage_id, now, hours)
+            for _test, from_stage_id, _to, _uid, now, branch_id, hours in rows
+            if from_stage_id and hours is not None
+        ])
+        self.invalidate_model()
+
+
+class OpticalStageTimeWeekly(models.Model):
+    _name = "optical.stage.time.weekly"
+    _description = "Optical Time in Stage per Branch and Week"
+    _order = "week desc, branch_id, stage_id"
+
+    week = fields.Date(string="Week", required=True, readonly=True, help="Monday of the week the jobs left the stage.")
+    branch_id = fields.Many2one("optical.branch", string="Branch", readonly=True, ondelete="cascade")
+    stage_id = fields.Many2one(
+        "optical.prescription.stage",
+        string="Stage",
+        required=True,
+        readonly=True,
+        ondelete="cascade"
+    )
+    transition_count = fields.Integer(string="Jobs", readonly=True)
+    total_hours = fields.Float(string="Total Hours", readonly=True)
+    max_hours = fields.Float(string="Longest (h)", readonly=True, group_operator="max")
+    average_hours = fields.Float(string="Average (h)", compute="_compute_average_hours")
+
+    def init(self):
+        super().init()
+        # Branch may be empty; COALESCE keeps one line per key for the upsert
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS optical_stage_time_weekly_key_idx
+            ON optical_stage_time_weekly (week, COALESCE(branch_id, 0), stage_id)
+        """)
+
+    @api.depends('transition_count', 'total_hours')
+    def _compute_average_hours(self):
+        for line in self:
+            line.average_hours = line.total_hours / line.transition_count if line.transition_count else 0.0
+
+    @api.model
+    def _add_transitions(self, transitions):
+        """Add ``[(branch_id, stage_id, left_at, hours)]`` to the weekly lines, one upsert per line."""
+        totals = {}
+        for branch_id, stage_id, left_at, hours in transitions:
+            week = left_at.date() - datetime.timedelta(days=left_at.weekday())
+            count, total, longest = totals.get((week, branch_id, stage_id), (0, 0.0, 0.0))
+            totals[(week, branch_id, stage_id)] = (count + 1, total + hours, max(longest, hours))
+        for (week, branch_id, stage_id), (count, total, longest) in totals.items():
+            self.env.cr.execute("""
+                INSERT INTO optical_stage_time_weekly AS line
+                    (week, branch_id, stage_id, transition_count, total_hours, max_hours,
+                     create_uid, create_date, write_uid, write_date)
+                VALUES (%(week)s, %(branch)s, %(stage)s, %(count)s, %(total)s, %(longest)s,
+                        %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC')
+                ON CONFLICT (week, COALESCE(branch_id, 0), stage_id) DO UPDATE
+                SET transition_count = line.transition_count + EXCLUDED.transition_count,
+                    total_hours = line.total_hours + EXCLUDED.total_hours,
+                    max_hours = GREATEST(line.max_hours, EXCLUDED.max_hours),
+                    write_uid = EXCLUDED.write_uid,
+                    write_date = EXCLUDED.write_date
+            """, {
+                'week': week,
+                'branch': branch_id,
+                'stage': stage_id,
+                'count': count,
+                'total': total,
+                'longest': longest,
+                'uid': self.env.uid,
+            })
+        self.invalidate_model()
@@ -37,3 +37,80 @@ class PosConfig(models.Model):
         help="Journal used for Invoices when the order includes Insurance payments."
     )
 
+    optical_invoice_mode = fields.Selection(
+        [
+            ('inline', 'At Order Sync'),
+            ('session_close', 'At Session Close'),
+        ],
+        string="Invoicing",
+        default='inline',
+        required=True,
+        help="At Session Close: orders the cashier did not explicitly invoice are invoiced together when "
+             "the session is closed, instead of one by one while the till syncs them."
+    )
+
+    optical_defer_invoice_postprocess = fields.Boolean(
+        string="Defer Invoice Post-Processing",
+        help="If enabled, insurance flagging, insurance payment linking and analytic distribution of "
+             "invoices run in a background job instead of while the till waits for the order sync."
+    )
+
+    optical_branch_partner_preload = fields.Boolean(
+        string="Preload Branch Patients Only",
+        help="If enabled, the POS only loads the most frequent and recent patients of its branch at session "
+             "opening. Other patients are found through a server search on name, phone, email and policy number."
+    )
+
+    optical_partner_preload_limit = fields.Integer(
+        string="Patients to Preload",
+        default=1000,
+        help="Maximum number of branch patients loaded at session opening."
+    )
+
+    optical_partner_preload_days = fields.Integer(
+        string="Patient Activity Window (Days)",
+        default=365,
+        help="Only patients with an order or an optical test at the branch within this window are preloaded."
+    )
+
+    def _optical_defers_invoice_postprocess(self):
+        """Whether the invoice post-processing of this config's orders runs in the job queue."""
+        self.ensure_one()
+        return self.optical_enabled and self.optical_defer_invoice_postprocess
+    
+    def _optical_preload_partner_ids(self):
+        """Return the ids of the branch patients to preload, most frequent first."""
+        self.ensure_one()
+        since = fields.Datetime.subtract(fields.Datetime.now(), days=self.optical_partner_preload_days)
+        branch_id = self.optical_branch_id.id
+        self.env.cr.execute("""
+            WITH activity AS (
+                SELECT o.partner_id, o.date_order AS activity_date
+                FROM pos_order o
+                JOIN pos_session s ON s.id = o.session_id
+                JOIN pos_config c ON c.id = s.config_id
+                WHERE o.partner_id IS NOT NULL
+                  AND o.date_order >= %(since)s
+                  AND (c.id = %(config)s OR c.optical_branch_id = %(branch)s)
+                UNION ALL
+                SELECT t.patient_id, t.test_date
+                FROM optical_test t
+                WHERE t.patient_id IS NOT NULL
+                  AND t.test_date >= %(since)s
+                  AND t.branch_id = %(branch)s
+            )
+            SELECT a.partner_id
+            FROM activity a
+            JOIN res_partner p ON p.id = a.partner_id
+            WHERE p.active AND (p.company_id = %(company)s OR p.company_id IS NULL)
+            GROUP BY a.partner_id
+            ORDER BY count(*) DESC, max(a.activity_date) DESC
+            LIMIT %(limit)s
+        """, {
+            'since': since,
+            'config': self.id,
+            'branch': branch_id or 0,
+            'company': self.company_id.id,
+            'limit': self.optical_partner_preload_limit,
+        })
+        return [row[0] for row in self.env.cr.fetchall()]
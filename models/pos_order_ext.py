@@ -1,17 +1,116 @@
 # -*- coding: utf-8 -*-
 # Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
 
+from collections import defaultdict
+
 from odoo import models, fields, _, api
 from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
 import logging
 
+from ..tools.concurrency import is_concurrency_error, retry_on_lock_conflict
+from ..tools.metrics import instrumented
+from ..tools.profiling import profiled
+from ..tools.tracing import trace
+
 _logger = logging.getLogger(__name__)
 
+# Per-eye numeric prescription fields of optical.test (suffixed _od / _os)
+PRESCRIPTION_NUMERIC_FIELDS = ('sphere', 'cylinder', 'axis', 'prism', 'add', 'pd')
+
+
+CLAIM_STATES = [
+    ('pending', 'Pending'),
+    ('partial', 'Partially Paid'),
+    ('paid', 'Paid'),
+    ('written_off', 'Written Off'),
+]
+
 
 class PosOrder(models.Model):
     _inherit = "pos.order"
     
+    optical_claim_ids = fields.One2many(
+        "optical.insurance.payment",
+        "order_id",
+        string="Insurance Claims",
+        readonly=True
+    )
+    optical_insurance_amount = fields.Float(
+        string="Insurance Paid",
+        compute="_compute_optical_payment_summary",
+        store=True,
+        help="Part of the order paid through insurance payment methods."
+    )
+    optical_customer_amount = fields.Float(
+        string="Customer Paid",
+        compute="_compute_optical_payment_summary",
+        store=True,
+        help="Part of the order paid by the customer."
+    )
+    optical_insurance_company_id = fields.Many2one(
+        "optical.insurance.company",
+        string="Insurance Company",
+        compute="_compute_optical_payment_summary",
+        store=True,
+        index="btree_not_null",
+        help="Insurer of the order's first insurance claim."
+    )
+    optical_claim_state = fields.Selection(
+        CLAIM_STATES,
+        string="Claim Status",
+        compute="_compute_optical_payment_summary",
+        store=True,
+        index="btree_not_null",
+        help="Settlement status of the order's insurance claims, empty without insurance."
+    )
+    
+    def init(self):
+        super().init()
+        # First sale to the patient after a test (staff throughput report)
+        create_index(
+            self.env.cr,
+            'pos_order_optical_partner_date_idx',
+            self._table,
+            ['partner_id', 'date_order'],
+            where='partner_id IS NOT NULL',
+        )
+
+    @api.depends(
+        'payment_ids.amount',
+        'payment_ids.is_insurance',
+        'payment_ids.payment_method_id.is_insurance_method',
+        'optical_claim_ids.insurance_company_id',
+        'optical_claim_ids.claim_state',
+    )
+    def _compute_optical_payment_summary(self):
+        """Insurance and customer shares of the payments, and the status of the claims."""
+        for order in self:
+            insurance_amount = customer_amount = 0.0
+            for payment in order.payment_ids:
+                if payment.is_insurance or payment.payment_method_id.is_insurance_method:
+                    insurance_amount += payment.amount
+                else:
+                    customer_amount += payment.amount
+            order.optical_insurance_amount = insurance_amount
+            order.optical_customer_amount = customer_amount
+
+            claims = order.optical_claim_ids.sorted('id')
+            order.optical_insurance_company_id = claims[:1].insurance_company_id
+            states = set(claims.mapped('claim_state'))
+            if not states:
+                order.optical_claim_state = False
+            elif states == {'written_off'}:
+                order.optical_claim_state = 'written_off'
+            elif states <= {'paid', 'written_off'}:
+                order.optical_claim_state = 'paid'
+            elif states & {'paid', 'partial'}:
+                order.optical_claim_state = 'partial'
+            else:
+                order.optical_claim_state = 'pending'
+    
     @api.model
+    @profiled(reference=lambda self, ui_order: ui_order.get('name'))
     def _order_fields(self, ui_order):
         """Override to force invoice creation for optical POS."""
         order_fields = super()._order_fields(ui_order)
@@ -38,8 +137,12 @@ class PosOrder(models.Model):
             
             # Force invoice if configured globally OR if insurance payment is present
             if has_customer and (session.config_id.optical_force_invoice or has_insurance_payment):
-                _logger.info('[BP Optical POS] Forcing invoice creation for order (Insurance: %s)', has_insurance_payment)
-                order_fields['to_invoice'] = True
+                if session.config_id.optical_invoice_mode == 'session_close':
+                    # Invoiced with the rest of the session by _validate_session
+                    trace(self.env, 'order.invoice_at_close', order=ui_order.get('name'), insurance=has_insurance_payment)
+                else:
+                    trace(self.env, 'order.force_invoice', order=ui_order.get('name'), insurance=has_insurance_payment)
+                    order_fields['to_invoice'] = True
         
         return order_fields
 
@@ -47,26 +150,23 @@ class PosOrder(models.Model):
     def _payment_fields(self, order, ui_paymentline):
         """Override to extract insurance data from UI payment line."""
         fields = super()._payment_fields(order, ui_paymentline)
-        
-        # Log the incoming UI payment line for debugging
-        _logger.info('[BP Optical POS] _payment_fields UI line: %s', ui_paymentline)
 
         # Check for insurance data (flag OR data presence)
-        if ui_paymentline.get('is_insurance') or ui_paymentline.get('insuranceData'):
+        is_insurance = bool(ui_paymentline.get('is_insurance') or ui_paymentline.get('insuranceData'))
+        if is_insurance:
             fields['is_insurance'] = True
             fields['insurance_raw_data'] = ui_paymentline.get('insuranceData')
-        
+
+        trace(self.env, 'payment.fields', level='debug', order=order.pos_reference,
+              payment_method=ui_paymentline.get('payment_method_id'), insurance=is_insurance)
         return fields
 
+    @profiled()
     def add_payment(self, data):
         """Override to handle insurance payment creation."""
-        # Log incoming payment data for debugging
-        _logger.info('[BP Optical POS] add_payment called with data keys: %s', data.keys())
-        if 'insurance_raw_data' in data:
-            _logger.info('[BP Optical POS] Insurance data present: %s', True)
-            _logger.info('[BP Optical POS] Insurance raw data content: %s', data['insurance_raw_data'])
-        
         insurance_data = data.pop('insurance_raw_data', False)
+        trace(self.env, 'payment.add', level='debug', order=self.pos_reference, keys=sorted(data),
+              insurance_company=insurance_data.get('insurance_company_id') if insurance_data else None)
         insurance_record = False
 
         if insurance_data:
@@ -97,6 +197,11 @@ class PosOrder(models.Model):
             
         return payment
 
+    def unlink(self):
+        """Override to release the cover of claims removed with their order."""
+        self.env['optical.insurance.payment'].search([('order_id', 'in', self.ids)])._optical_sync_utilization(release=True)
+        return super().unlink()
+
     def _optical_check_requirements(self):
         """
         Validate optical POS requirements before order completion.
@@ -152,6 +257,7 @@ class PosOrder(models.Model):
                     "Insurance payment amount (%.2f) cannot exceed the order total (%.2f)."
                 ) % (insurance_total, order_total))
 
+    @profiled()
     def action_pos_order_paid(self):
         """Override to add optical validation before marking order as paid."""
         # Perform optical checks for each order
@@ -161,45 +267,16 @@ class PosOrder(models.Model):
         # Call parent method
         return super().action_pos_order_paid()
 
+    @profiled()
     def _apply_invoice_payments(self, is_reverse=False):
         """
         Override to prevent insurance payments from being applied to the invoice.
         This ensures the invoice remains open (unpaid) for the insurance portion.
         """
-        # Strategy: Temporarily set the amount of insurance payments to 0.
-        # This prevents _apply_invoice_payments from reconciling them,
-        # without deleting the payment records (which causes issues due to required fields).
-        
-        insurance_payments_data = {}
-        
-        for order in self:
-            if order.config_id.optical_enabled:
-                # Identify insurance payments
-                insurance_payments = order.payment_ids.filtered(
-                    lambda p: p.is_insurance or p.payment_method_id.is_insurance_method
-                )
-                
-                for payment in insurance_payments:
-                    # Store original amount
-                    insurance_payments_data[payment.id] = payment.amount
-                    # Set amount to 0 to skip reconciliation
-                    payment.write({'amount': 0})
-        
-        try:
-            # Call super - it will ignore 0 amount payments
-            res = super()._apply_invoice_payments(is_reverse)
-        except Exception as e:
-            _logger.error("Error in _apply_invoice_payments: %s", str(e))
-            raise
-        finally:
-            # Restore original amounts
-            for payment_id, amount in insurance_payments_data.items():
-                payment = self.env['pos.payment'].browse(payment_id)
-                if payment.exists():
-                    payment.write({'amount': amount})
-        
-        return res
+        # pos.payment._create_payment_moves() leaves the insurance payments out
+        return super(PosOrder, self.with_context(optical_skip_insurance_payment_moves=True))._apply_invoice_payments(is_reverse)
 
+    @profiled()
     def _generate_pos_order_invoice(self):
         """Override to ensure invoice creation for optical POS when required."""
         # Pre-validate optical requirements before invoice generation
@@ -218,7 +295,81 @@ class PosOrder(models.Model):
         # Call parent method to generate invoices
         result = super()._generate_pos_order_invoice()
         
-        # Post-process invoices for insurance
+        # Post-process invoices for insurance, now or through the job queue
+        self._optical_dispatch_invoice_postprocess()
+        
+        return result
+
+    def _optical_dispatch_invoice_postprocess(self):
+        """Post-process the invoices of ``self`` now, or queue them when the config defers it."""
+        deferred = self.filtered(
+            lambda o: o.account_move and o.config_id._optical_defers_invoice_postprocess()
+        )
+        (self - deferred)._optical_postprocess_invoices()
+        if deferred:
+            self.env['optical.invoice.job']._enqueue(deferred)
+
+    def _optical_needs_invoice(self):
+        """Whether an optical order left uninvoiced at sync must be invoiced at session close."""
+        self.ensure_one()
+        if not self.partner_id or self.account_move or self.state != 'paid':
+            return False
+        has_insurance_payment = any(
+            p.is_insurance or p.payment_method_id.is_insurance_method for p in self.payment_ids
+        )
+        return self.config_id.optical_force_invoice or has_insurance_payment
+
+    @profiled()
+    def _optical_generate_invoices_batch(self):
+        """
+        Invoice ``self`` in bulk (session closing path).
+
+        Move values are prepared up front, invoices are created with one
+        create() per company/type/journal and posted together, and the
+        insurance payments of all orders are zeroed and restored once around
+        the payment reconciliation. PDFs are not generated.
+        """
+        orders = self.filtered(lambda o: o.state == 'paid' and not o.account_move and o.partner_id)
+        if not orders:
+            return self.env['account.move']
+
+        # Cash rounding adjusts each invoice after its creation; keep the standard path
+        rounded = orders.filtered(lambda o: o.config_id.cash_rounding)
+        if rounded:
+            rounded.write({'to_invoice': True})
+            rounded.with_context(generate_pdf=False)._generate_pos_order_invoice()
+            orders -= rounded
+
+        groups = defaultdict(list)
+        for order in orders:
+            move_vals = order._prepare_invoice_vals()
+            order._optical_prepare_invoice_vals(move_vals)
+            groups[(order.company_id, move_vals['move_type'], move_vals.get('journal_id'))].append((order, move_vals))
+
+        Move = self.env['account.move'].sudo()
+        moves = Move
+        for (company, move_type, _journal_id), items in groups.items():
+            group_moves = Move.with_company(company).with_context(
+                default_move_type=move_type, linked_to_pos=True,
+            ).create([move_vals for _order, move_vals in items])
+            for (order, _move_vals), move in zip(items, group_moves):
+                order.account_move = move
+                move.message_post(body=_(
+                    "This invoice has been created from the point of sale session: %s", order._get_html_link()
+                ))
+            group_moves.with_context(skip_invoice_sync=True)._post()
+            moves |= group_moves
+        orders.write({'to_invoice': True, 'state': 'invoiced'})
+
+        for order in orders:
+            order._apply_invoice_payments(order.session_id.state == 'closed')
+
+        orders._optical_dispatch_invoice_postprocess()
+        trace(self.env, 'invoice.batch', orders=len(orders), invoices=len(moves), groups=len(groups))
+        return moves
+
+    def _optical_postprocess_invoices(self):
+        """Flag insurance invoices and link their insurance payment records."""
         for order in self:
             if order.account_move and order.config_id.optical_enabled:
                 invoice = order.account_move
@@ -240,8 +391,14 @@ class PosOrder(models.Model):
                     for payment in insurance_payments:
                         if payment.insurance_data_id:
                             payment.insurance_data_id.write({'invoice_id': invoice.id})
-        
-        return result
+
+    def _optical_run_deferred_invoice_postprocess(self):
+        """Work moved off the order sync RPC when post-processing is deferred."""
+        for order in self:
+            if not order.account_move:
+                continue
+            order._apply_location_analytic_to_invoice(order.account_move)
+            order._optical_postprocess_invoices()
     
     def _create_insurance_payment_record(self, payment_vals):
         """
@@ -283,8 +440,19 @@ class PosOrder(models.Model):
 
     def _create_invoice(self, move_vals):
         """Override to apply analytic distribution and set insurance journal."""
+        self._optical_prepare_invoice_vals(move_vals)
+        
+        # Call parent method to create the invoice
+        invoice = super()._create_invoice(move_vals)
+        
+        return invoice
+
+    def _optical_prepare_invoice_vals(self, move_vals):
+        """Complete ``move_vals`` with the branch, analytic and insurance journal of the order."""
         # Apply location analytic to invoice line values before creation
-        self._apply_location_analytic_to_move_vals(move_vals)
+        # (the invoice job applies it later when post-processing is deferred)
+        if not self.config_id._optical_defers_invoice_postprocess():
+            self._apply_location_analytic_to_move_vals(move_vals)
         
         # Set branch from POS config
         if self.config_id.optical_enabled and self.config_id.optical_branch_id:
@@ -297,11 +465,6 @@ class PosOrder(models.Model):
             )
             if insurance_payments:
                 move_vals['journal_id'] = self.config_id.optical_insurance_journal_id.id
-        
-        # Call parent method to create the invoice
-        invoice = super()._create_invoice(move_vals)
-        
-        return invoice
 
     def _apply_location_analytic_to_move_vals(self, move_vals):
         """Apply the analytic account from POS config's branch or location to invoice line values."""
@@ -367,6 +530,26 @@ class PosOrder(models.Model):
                 move_line.analytic_distribution = {str(analytic_account.id): 100}
 
     @api.model
+    def _optical_prepare_test_vals(self, test_vals):
+        """
+        Map the prescription values of the POS test popup (or an import row) to optical.test values.
+        
+        Numeric fields are kept unless ``False``; visual acuity and notes only when set.
+        """
+        vals = {}
+        for eye in ('od', 'os'):
+            for name in PRESCRIPTION_NUMERIC_FIELDS:
+                field = '%s_%s' % (name, eye)
+                if field in test_vals and test_vals[field] is not False:
+                    vals[field] = test_vals[field]
+            if test_vals.get('va_%s' % eye):
+                vals['va_%s' % eye] = test_vals['va_%s' % eye]
+        if test_vals.get('notes'):
+            vals['notes'] = test_vals['notes']
+        return vals
+
+    @api.model
+    @instrumented()
     def optical_create_test(self, order_uid, partner_id, test_vals):
         """
         Create a full optical.test record from POS popup.
@@ -413,47 +596,8 @@ class PosOrder(models.Model):
             if branch_id:
                 vals['branch_id'] = branch_id
             
-            # Map OD (Right Eye) fields
-            if test_vals.get('sphere_od') is not False:
-                vals['sphere_od'] = test_vals['sphere_od']
-            if test_vals.get('cylinder_od') is not False:
-                vals['cylinder_od'] = test_vals['cylinder_od']
-            if test_vals.get('axis_od') is not False:
-                vals['axis_od'] = test_vals['axis_od']
-            if test_vals.get('prism_od') is not False:
-                vals['prism_od'] = test_vals['prism_od']
-            if test_vals.get('add_od') is not False:
-                vals['add_od'] = test_vals['add_od']
-            if test_vals.get('va_od'):
-                vals['va_od'] = test_vals['va_od']
-            if test_vals.get('pd_od') is not False:
-                vals['pd_od'] = test_vals['pd_od']
-            
-            # Map OS (Left Eye) fields
-            if test_vals.get('sphere_os') is not False:
-                vals['sphere_os'] = test_vals['sphere_os']
-            if test_vals.get('cylinder_os') is not False:
-                vals['cylinder_os'] = test_vals['cylinder_os']
-            if test_vals.get('axis_os') is not False:
-                vals['axis_os'] = test_vals['axis_os']
-            if test_vals.get('prism_os') is not False:
-                vals['prism_os'] = test_vals['prism_os']
-            if test_vals.get('add_os') is not False:
-                vals['add_os'] = test_vals['add_od']
-            if test_vals.get('va_os'):
-                vals['va_os'] = test_vals['va_os']
-            if test_vals.get('pd_os') is not False:
-                vals['pd_os'] = test_vals['pd_os']
-            
-            # Map additional fields
-            if test_vals.get('notes'):
-                vals['notes'] = test_vals['notes']
-            
-            # Handle valid_until if provided (otherwise computed field will handle it)
-            if test_vals.get('valid_until'):
-                # Note: validity_until is computed from test_date by default,
-                # but we can still set it if a custom value is provided
-                pass  # Let the computed field handle it
+            # Map the prescription fields (OD = right eye, OS = left eye)
+            vals.update(self._optical_prepare_test_vals(test_vals))
             
             # Create the optical test record
             test = self.env['optical.test'].sudo().create(vals)
@@ -472,6 +616,7 @@ class PosOrder(models.Model):
             }
     
     @api.model
+    @instrumented()
     def optical_get_patient_tests(self, partner_id, limit=10):
         """
         Retrieve optical test history for a patient to display in POS.
@@ -529,6 +674,7 @@ class PosOrder(models.Model):
             return []
     
     @api.model
+    @instrumented()
     def optical_get_patient_tests_full(self, partner_id, limit=10):
         """
         Retrieve full optical test details for a patient (for comprehensive view in POS).
@@ -607,6 +753,7 @@ class PosOrder(models.Model):
             return []
     
     @api.model
+    @instrumented()
     def optical_change_test_stage(self, test_id, stage_name):
         """
         Change the stage of an optical test from POS.
@@ -675,6 +822,7 @@ class PosOrder(models.Model):
             return []
     
     @api.model
+    @instrumented()
     def optical_register_balance_payment(self, invoice_id, payment_vals):
         """
         Register a balance settlement payment for an optical POS invoice.
@@ -711,11 +859,11 @@ class PosOrder(models.Model):
             if invoice.state != 'posted':
                 return {"error": "Invoice is not posted.", "success": False}
             
-            if invoice.payment_state == 'paid':
+            if invoice.payment_state in ('paid', 'in_payment'):
                 return {
                     "error": "Invoice is already fully paid.",
                     "success": False,
-                    "payment_state": "paid"
+                    "payment_state": invoice.payment_state
                 }
             
             # Get payment journal
@@ -728,57 +876,76 @@ class PosOrder(models.Model):
             if isinstance(payment_date, str):
                 payment_date = fields.Date.from_string(payment_date)
             
-            # Create payment record
-            payment_obj_vals = {
-                'payment_type': 'inbound',
-                'partner_type': 'customer',
-                'partner_id': invoice.partner_id.id,
-                'amount': payment_vals['amount'],
-                'currency_id': invoice.currency_id.id,
-                'journal_id': journal.id,
-                'date': payment_date,
-                'ref': payment_vals.get('ref', _('Balance Payment - %s') % invoice.name),
-                'payment_method_line_id': journal.inbound_payment_method_line_ids[0].id if journal.inbound_payment_method_line_ids else False,
-            }
-            
-            payment = self.env['account.payment'].sudo().create(payment_obj_vals)
-            payment.action_post()
-            
-            # Reconcile with invoice
-            payment_line = payment.line_ids.filtered(
-                lambda l: l.account_id.account_type == 'asset_receivable' and l.credit > 0
+            # Lock, pay and reconcile as one unit, retried while another
+            # settlement of the same invoice holds its receivable lines
+            return retry_on_lock_conflict(
+                self.env,
+                lambda: self._optical_settle_invoice(invoice, journal, payment_date, payment_vals),
+                'balance_payment',
             )
             
-            invoice_line = invoice.line_ids.filtered(
-                lambda l: (
-                    l.account_id.account_type == 'asset_receivable' and 
-                    l.debit > 0 and
-                    not l.reconciled
-                )
-            )
-            
-            if payment_line and invoice_line:
-                (payment_line + invoice_line).reconcile()
-            
-            # Refresh invoice to get updated payment state
-            invoice.invalidate_recordset(['payment_state', 'amount_residual'])
-            
-            return {
-                "success": True,
-                "payment_id": payment.id,
-                "payment_name": payment.name,
-                "invoice_payment_state": invoice.payment_state,
-                "invoice_amount_residual": invoice.amount_residual,
-            }
-            
         except Exception as e:
+            if is_concurrency_error(e):
+                # Let the RPC layer replay the call in a new transaction
+                raise
             _logger.error("Error registering balance payment: %s", str(e))
             return {
                 "error": str(e),
                 "success": False
             }
     
+    def _optical_settle_invoice(self, invoice, journal, payment_date, payment_vals):
+        """Register and reconcile a balance payment on ``invoice``, holding its receivable lines."""
+        receivable_lines = invoice._optical_lock_receivable_lines()
+        
+        # Re-check under the lock: a parallel settlement may have paid it meanwhile
+        if invoice.payment_state in ('paid', 'in_payment'):
+            return {
+                "error": "Invoice is already fully paid.",
+                "success": False,
+                "payment_state": invoice.payment_state
+            }
+        
+        # Create payment record
+        payment_obj_vals = {
+            'payment_type': 'inbound',
+            'partner_type': 'customer',
+            'partner_id': invoice.partner_id.id,
+            'amount': payment_vals['amount'],
+            'currency_id': invoice.currency_id.id,
+            'journal_id': journal.id,
+            'date': payment_date,
+            'ref': payment_vals.get('ref', _('Balance Payment - %s') % invoice.name),
+            'payment_method_line_id': journal.inbound_payment_method_line_ids[0].id if journal.inbound_payment_method_line_ids else False,
+            'is_optical_balance_payment': True,
+        }
+        
+        payment = self.env['account.payment'].sudo().create(payment_obj_vals)
+        payment.action_post()
+        
+        # Reconcile with invoice
+        payment_line = payment.line_ids.filtered(
+            lambda l: l.account_id.account_type == 'asset_receivable' and l.credit > 0
+        )
+        
+        invoice_line = receivable_lines.filtered(lambda l: l.debit > 0 and not l.reconciled)
+        
+        if payment_line and invoice_line:
+            (payment_line + invoice_line).reconcile()
+        
+        # Refresh invoice to get updated payment state
+        invoice.invalidate_recordset(['payment_state', 'amount_residual'])
+        
+        return {
+            "success": True,
+            "payment_id": payment.id,
+            "payment_name": payment.name,
+            "invoice_payment_state": invoice.payment_state,
+            "invoice_amount_residual": invoice.amount_residual,
+        }
+    
     @api.model
+    @instrumented()
     def optical_finalize_payments(self, order_uid):
         """
         Finalize payments for an optical POS order.
@@ -798,50 +965,132 @@ class PosOrder(models.Model):
             return {"error": "No order specified.", "success": False}
         
         try:
-            # Find order by reference
-            order = self.search([('pos_reference', '=', order_uid)], limit=1)
-            if not order:
-                return {"error": "Order not found.", "success": False}
+            return self._optical_finalize_payments([order_uid])[order_uid]
             
-            invoice = order.account_move
-            if not invoice:
-                return {
+        except Exception as e:
+            _logger.error("Error finalizing payments for order %s: %s", order_uid, str(e))
+            return {
+                "error": str(e),
+                "success": False
+            }
+    
+    @api.model
+    @instrumented()
+    def optical_finalize_payments_batch(self, order_uids):
+        """
+        Finalize payments for many optical POS orders at once.
+        
+        Same result as optical_finalize_payments for each order, in a fixed
+        number of queries whatever the number of orders, for reconciling
+        whole sessions.
+        
+        Args:
+            order_uids: list of POS order UIDs (pos_reference)
+        
+        Returns:
+            Dictionary of payment summaries keyed by order UID
+        """
+        order_uids = [uid for uid in dict.fromkeys(order_uids or []) if uid]
+        if not order_uids:
+            return {}
+        
+        try:
+            return self._optical_finalize_payments(order_uids)
+            
+        except Exception as e:
+            _logger.error("Error finalizing payments for %s orders: %s", len(order_uids), str(e))
+            return {uid: {"error": str(e), "success": False} for uid in order_uids}
+    
+    def _optical_link_insurance_invoices(self, orders):
+        """Set the missing invoice of the insurance claims of ``orders`` in one statement."""
+        self.env['optical.insurance.payment'].check_access_rights('write')
+        self.env['pos.order'].flush_model(['account_move'])
+        self.env['pos.payment'].flush_model(['pos_order_id', 'is_insurance', 'insurance_data_id'])
+        self.env['optical.insurance.payment'].flush_model(['invoice_id'])
+        self.env.cr.execute("""
+            UPDATE optical_insurance_payment claim
+               SET invoice_id = o.account_move,
+                   write_uid = %s,
+                   write_date = now() at time zone 'UTC'
+              FROM pos_payment p
+              JOIN pos_order o ON o.id = p.pos_order_id
+             WHERE p.insurance_data_id = claim.id
+               AND p.is_insurance
+               AND o.id IN %s
+               AND o.account_move IS NOT NULL
+               AND claim.invoice_id IS NULL
+         RETURNING claim.id
+        """, [self.env.uid, tuple(orders.ids)])
+        claims = self.env['optical.insurance.payment'].browse(row[0] for row in self.env.cr.fetchall())
+        if claims:
+            # Claim status and the invoice insurer depend on the new links
+            claims.invalidate_recordset(['invoice_id', 'write_uid', 'write_date'])
+            self.env['account.move'].invalidate_model(['insurance_payment_ids'])
+            claims.modified(['invoice_id'])
+        return claims
+    
+    def _optical_receivables_due(self, orders):
+        """Open customer and insurance receivables of each order invoice, from one grouped query."""
+        self.env['pos.order'].flush_model(['account_move', 'partner_id'])
+        self.env['account.move.line'].flush_model(['move_id', 'account_id', 'partner_id', 'debit', 'amount_residual'])
+        self.env['account.account'].flush_model(['account_type'])
+        self.env.cr.execute("""
+            SELECT o.id,
+                   COALESCE(SUM(aml.amount_residual) FILTER (WHERE aml.partner_id IS NOT DISTINCT FROM o.partner_id), 0),
+                   COALESCE(SUM(aml.amount_residual) FILTER (WHERE aml.partner_id IS DISTINCT FROM o.partner_id), 0)
+              FROM pos_order o
+              JOIN account_move_line aml ON aml.move_id = o.account_move
+              JOIN account_account acc ON acc.id = aml.account_id
+             WHERE o.id IN %s
+               AND acc.account_type = 'asset_receivable'
+               AND aml.debit > 0
+          GROUP BY o.id
+        """, [tuple(orders.ids)])
+        return {order_id: (customer_due, insurance_due) for order_id, customer_due, insurance_due in self.env.cr.fetchall()}
+    
+    def _optical_finalize_payments(self, order_uids):
+        """Payment summaries of the orders referenced by ``order_uids``, keyed by reference."""
+        results = {uid: {"error": "Order not found.", "success": False} for uid in order_uids}
+        # First match per reference, as a search with limit=1 would return
+        orders_by_uid = {}
+        for order in self.search([('pos_reference', 'in', order_uids)]):
+            orders_by_uid.setdefault(order.pos_reference, order)
+        
+        invoiced = self.browse()
+        for uid, order in orders_by_uid.items():
+            if order.account_move:
+                invoiced |= order
+            else:
+                results[uid] = {
                     "error": "No invoice found for this order.",
                     "success": False,
                     "has_invoice": False
                 }
-            
-            # Update insurance payment records
-            insurance_payments = order.payment_ids.filtered(lambda p: p.is_insurance)
-            for payment in insurance_payments:
-                if payment.insurance_data_id and not payment.insurance_data_id.invoice_id:
-                    payment.insurance_data_id.write({'invoice_id': invoice.id})
-            
-            # Calculate payment breakdown
-            customer_payments = order.payment_ids.filtered(lambda p: not p.is_insurance)
-            insurance_payments_total = sum(insurance_payments.mapped('amount'))
-            customer_payments_total = sum(customer_payments.mapped('amount'))
-            
-            # Get receivable amounts from invoice
-            customer_receivables = invoice.line_ids.filtered(
-                lambda l: (
-                    l.account_id.account_type == 'asset_receivable' and
-                    l.partner_id == order.partner_id and
-                    l.debit > 0
-                )
-            )
-            customer_due = sum(customer_receivables.mapped('amount_residual'))
-            
-            insurance_receivables = invoice.line_ids.filtered(
-                lambda l: (
-                    l.account_id.account_type == 'asset_receivable' and
-                    l.partner_id != order.partner_id and
-                    l.debit > 0
-                )
-            )
-            insurance_due = sum(insurance_receivables.mapped('amount_residual'))
-            
-            return {
+        if not invoiced:
+            return results
+        
+        self._optical_link_insurance_invoices(invoiced)
+        
+        # Payment breakdown, split between the customer and the insurers
+        payments = defaultdict(lambda: {True: [0.0, 0], False: [0.0, 0]})
+        for order, is_insurance, amount, count in self.env['pos.payment']._read_group(
+            [('pos_order_id', 'in', invoiced.ids)],
+            ['pos_order_id', 'is_insurance'],
+            ['amount:sum', '__count'],
+        ):
+            totals = payments[order.id][bool(is_insurance)]
+            totals[0] += amount
+            totals[1] += count
+        receivables = self._optical_receivables_due(invoiced)
+        
+        for uid, order in orders_by_uid.items():
+            if order not in invoiced:
+                continue
+            invoice = order.account_move
+            customer_due, insurance_due = receivables.get(order.id, (0.0, 0.0))
+            (insurance_total, insurance_count), (customer_total, customer_count) = (
+                payments[order.id][True], payments[order.id][False])
+            results[uid] = {
                 "success": True,
                 "has_invoice": True,
                 "invoice_id": invoice.id,
@@ -852,16 +1101,10 @@ class PosOrder(models.Model):
                 "amount_residual": invoice.amount_residual,
                 "customer_due": customer_due,
                 "insurance_due": insurance_due,
-                "customer_payments": customer_payments_total,
-                "insurance_payments": insurance_payments_total,
-                "payment_count": len(order.payment_ids),
-                "insurance_payment_count": len(insurance_payments),
-            }
-            
-        except Exception as e:
-            _logger.error("Error finalizing payments for order %s: %s", order_uid, str(e))
-            return {
-                "error": str(e),
-                "success": False
+                "customer_payments": customer_total,
+                "insurance_payments": insurance_total,
+                "payment_count": customer_count + insurance_count,
+                "insurance_payment_count": insurance_count,
             }
+        return results
 
@@ -17,3 +17,13 @@ class PosPayment(models.Model):
         string="Insurance Payment Details",
         ondelete="set null"
     )
+
+    def _create_payment_moves(self, is_reverse=False):
+        """Override to keep insurance payments off invoices, left open for the insurer."""
+        if not self.env.context.get('optical_skip_insurance_payment_moves'):
+            return super()._create_payment_moves(is_reverse)
+        insurance_payments = self.filtered(
+            lambda p: p.pos_order_id.config_id.optical_enabled
+            and (p.is_insurance or p.payment_method_id.is_insurance_method)
+        )
+        return super(PosPayment, self - insurance_payments)._create_payment_moves(is_reverse)
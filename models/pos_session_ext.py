@@ -1,12 +1,39 @@
 # -*- coding: utf-8 -*-
 # Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
 
-from odoo import models
+from odoo import models, api
+from odoo.osv import expression
 
 
 class PosSession(models.Model):
     _inherit = "pos.session"
     
+    @api.model
+    def _optical_partner_context(self, uid, session_id=False):
+        """
+        Return ``(session_id, optical_enabled, branch_id)`` for POS partner creation.
+        
+        Uses the session sent by the POS, or else the opened session of ``uid``.
+        One query on the session and its configuration; the fallback branch is
+        only searched when the configuration has none.
+        """
+        self.flush_model(['state', 'user_id', 'config_id'])
+        self.env['pos.config'].flush_model(['optical_enabled', 'optical_branch_id'])
+        self.env.cr.execute("""
+            SELECT s.id, c.optical_enabled, c.optical_branch_id
+            FROM pos_session s
+            JOIN pos_config c ON c.id = s.config_id
+            WHERE s.state = 'opened' AND %s
+            ORDER BY s.id DESC
+            LIMIT 1
+        """ % ('s.id = %s' if session_id else 's.user_id = %s'), [session_id or uid])
+        session_id, optical_enabled, branch_id = self.env.cr.fetchone() or (False, False, False)
+        if not optical_enabled:
+            return (session_id, False, False)
+        if not branch_id:
+            branch_id = self.env['optical.branch'].sudo().search([], limit=1).id or False
+        return (session_id, True, branch_id)
+    
     def _loader_params_pos_payment_method(self):
         """Override to add is_insurance_method to loaded fields"""
         result = super()._loader_params_pos_payment_method()
@@ -14,21 +41,56 @@ class PosSession(models.Model):
         return result
     
     def _loader_params_res_partner(self):
-        """Override to add optical fields to partner loading"""
+        """
+        Override to add the optical fields needed to list and edit partners.
+        
+        Policy details and test history are fetched per partner when needed
+        (res.partner.optical_get_partner_details).
+        """
         result = super()._loader_params_res_partner()
         result['search_params']['fields'].extend([
             'date_of_birth',
-            'is_optical_patient',
             'has_insurance',
-            'insurance_company_id',
-            'policy_number',
-            'insurance_expiry_date',
-            'patient_company',
-            'insurance_invoice_number',
-            'coverage_details',
         ])
         return result
     
+    def _get_pos_ui_res_partner(self, params):
+        """Override to preload only the branch's patients when configured."""
+        config = self.config_id
+        if not (config.optical_enabled and config.optical_branch_partner_preload):
+            return super()._get_pos_ui_res_partner(params)
+        search_params = dict(params['search_params'], domain=[('id', 'in', config._optical_preload_partner_ids())])
+        return self.env['res.partner'].search_read(**search_params)
+    
+    def optical_search_partners(self, query, limit=30, offset=0):
+        """
+        Paginated partner search for the POS, returning loader-shaped records.
+        
+        Matches name, phone, mobile, email and insurance policy number.
+        """
+        self.ensure_one()
+        query = (query or '').strip()
+        if len(query) < 2:
+            return []
+        policy_partners = self.env['optical.patient.insurance'].search([('name', 'ilike', query)], limit=200).patient_id
+        domain = [
+            '|', '|', '|', '|',
+            ('name', 'ilike', query),
+            ('phone', 'ilike', query),
+            ('mobile', 'ilike', query),
+            ('email', 'ilike', query),
+            ('id', 'in', policy_partners.ids),
+        ]
+        loader_params = self._loader_params_res_partner()['search_params']
+        search_params = dict(
+            loader_params,
+            domain=expression.AND([loader_params.get('domain') or [], domain]),
+            limit=min(int(limit), 100),
+            offset=int(offset),
+            order='name, id',
+        )
+        return self.env['res.partner'].search_read(**search_params)
+    
     def _loader_params_optical_insurance_company(self):
         """Load insurance companies for optical POS"""
         return {
@@ -43,6 +105,15 @@ class PosSession(models.Model):
         """Load insurance companies for POS UI"""
         return self.env['optical.insurance.company'].search_read(**params['search_params'])
     
+    def _validate_session(self, balancing_account=False, amount_to_balance=0, bank_payment_method_diffs=None):
+        """Override to invoice the orders of session-close invoicing configs before closing."""
+        for session in self:
+            config = session.config_id
+            if config.optical_enabled and config.optical_invoice_mode == 'session_close':
+                orders = session.order_ids.filtered(lambda o: o._optical_needs_invoice())
+                orders._optical_generate_invoices_batch()
+        return super()._validate_session(balancing_account, amount_to_balance, bank_payment_method_diffs)
+    
     def _pos_data_process(self, loaded_data):
         """Override to add insurance companies to loaded data"""
         super()._pos_data_process(loaded_data)
@@ -7,6 +7,39 @@ from odoo import models, fields, api
 class ResConfigSettings(models.TransientModel):
     _inherit = 'res.config.settings'
 
+    optical_metrics_enabled = fields.Boolean(
+        string="Record Endpoint Metrics",
+        config_parameter='bp_optical_pos.metrics_enabled',
+        help="Record call count, wall time and SQL cost of the optical POS endpoints in each worker."
+    )
+    optical_profile_sample_rate = fields.Float(
+        string="Profiling Sample Rate",
+        config_parameter='bp_optical_pos.profile_sample_rate',
+        help="Fraction of order sync and invoicing calls profiled with cProfile (0 disables, 0.01 = 1%)."
+    )
+    optical_profile_dir = fields.Char(
+        string="Profile Directory",
+        config_parameter='bp_optical_pos.profile_dir',
+        help="Local directory receiving the .pstats files. Defaults to the data directory of the server."
+    )
+    optical_profile_max_mb = fields.Integer(
+        string="Profile Storage Cap (MB)",
+        config_parameter='bp_optical_pos.profile_max_mb',
+        default=200,
+        help="Oldest profiles are deleted once the directory exceeds this size."
+    )
+    optical_trace_level = fields.Selection(
+        [('debug', 'Debug'), ('info', 'Info'), ('warning', 'Warning'), ('error', 'Error')],
+        string="Trace Level",
+        config_parameter='bp_optical_pos.trace_level',
+        help="Minimum level of the optical POS trace events that are kept (default: Warning)."
+    )
+    optical_trace_sampling = fields.Char(
+        string="Trace Sampling",
+        config_parameter='bp_optical_pos.trace_sampling',
+        help="Per-event sampling rates below Warning, e.g. 'payment.add=0.01,order.*=0.1,*=0'."
+    )
+
     def action_manage_branch_users(self):
         """ Open the branch list view to manage user assignments """
         return {
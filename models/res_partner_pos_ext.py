@@ -1,11 +1,36 @@
 # -*- coding: utf-8 -*-
 # Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
 
-from odoo import models, fields, api
+from odoo import models, fields, api, _
+from odoo.exceptions import UserError
+from odoo.tools.sql import create_index
+from psycopg2 import errors
 import logging
+import re
+
+from ..tools.metrics import instrumented
+from ..tools.tracing import redact, trace
 
 _logger = logging.getLogger(__name__)
 
+DUPLICATE_TIMEOUT_PARAM = 'bp_optical_pos.duplicate_lookup_timeout_ms'
+DUPLICATE_TIMEOUT_DEFAULT = 200
+PLACEHOLDER_EMAIL_DOMAIN = '@pos.local'
+
+
+def normalize_phone(phone):
+    """Last nine digits of ``phone``, so +254 712 345 678 and 0712345678 match."""
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-9:] if len(digits) >= 7 else False
+
+
+def normalize_email(email):
+    """Lower-cased ``email``; placeholder addresses made up by the POS are ignored."""
+    email = (email or '').strip().lower()
+    if '@' not in email or email.endswith(PLACEHOLDER_EMAIL_DOMAIN):
+        return False
+    return email
+
 
 class ResPartnerPosExt(models.Model):
     _inherit = "res.partner"
@@ -53,43 +78,182 @@ class ResPartnerPosExt(models.Model):
         store=False,
     )
 
+    def init(self):
+        super().init()
+        # Trigram indexes behind the POS partner search (ilike '%term%').
+        # They serve the plain column, i.e. databases without unaccent.
+        if not self.env.registry.has_trigram:
+            _logger.info('[BP Optical POS] pg_trgm is not installed, partner search indexes skipped')
+            return
+        for column in ('name', 'phone', 'mobile', 'email'):
+            create_index(
+                self.env.cr,
+                'res_partner_optical_%s_trgm_idx' % column,
+                self._table,
+                ['"%s" gin_trgm_ops' % column],
+                method='gin',
+            )
+        create_index(
+            self.env.cr,
+            'optical_patient_insurance_optical_name_trgm_idx',
+            'optical_patient_insurance',
+            ['"name" gin_trgm_ops'],
+            method='gin',
+        )
+
+    # Normalized contact keys for duplicate detection
+    optical_phone_key = fields.Char(
+        string='Normalized Phone',
+        compute='_compute_optical_contact_keys',
+        store=True,
+        index='btree_not_null',
+    )
+    optical_mobile_key = fields.Char(
+        string='Normalized Mobile',
+        compute='_compute_optical_contact_keys',
+        store=True,
+        index='btree_not_null',
+    )
+    optical_email_key = fields.Char(
+        string='Normalized Email',
+        compute='_compute_optical_contact_keys',
+        store=True,
+        index='btree_not_null',
+    )
+
+    @api.depends('phone', 'mobile', 'email')
+    def _compute_optical_contact_keys(self):
+        for partner in self:
+            partner.optical_phone_key = normalize_phone(partner.phone)
+            partner.optical_mobile_key = normalize_phone(partner.mobile)
+            partner.optical_email_key = normalize_email(partner.email)
+
     @api.depends()
     def _compute_is_optical_patient(self):
         """Check if partner is linked to an optical.patient record"""
-        for partner in self:
-            partner.is_optical_patient = bool(
-                self.env['optical.patient'].search([
-                    ('partner_id', '=', partner.id)
-                ], limit=1)
+        patient_partner_ids = {
+            partner.id for [partner] in self.env['optical.patient']._read_group(
+                [('partner_id', 'in', self.ids)], ['partner_id'],
             )
+        }
+        for partner in self:
+            partner.is_optical_patient = partner.id in patient_partner_ids
 
     @api.depends()
     def _compute_insurance_fields(self):
         """Compute insurance fields from optical.patient.insurance records"""
+        # Latest active insurance per patient, fetched for all partners at once
+        latest_insurance = {}
+        for insurance in self.env['optical.patient.insurance'].search([
+            ('patient_id', 'in', self.ids),
+            ('active', '=', True),
+        ], order='date desc, id desc'):
+            latest_insurance.setdefault(insurance.patient_id.id, insurance)
+
         for partner in self:
-            # Default values
-            partner.has_insurance = False
-            partner.insurance_company_id = False
-            partner.policy_number = False
-            partner.insurance_expiry_date = False
-            partner.patient_company = False
-            partner.insurance_invoice_number = False
-            partner.coverage_details = False
-            
-            # Find active insurance for this patient
-            insurance = self.env['optical.patient.insurance'].search([
-                ('patient_id', '=', partner.id),
-                ('active', '=', True),
-            ], limit=1, order='date desc')
-            
-            if insurance:
-                partner.has_insurance = True
-                partner.insurance_company_id = insurance.insurance_company_id
-                partner.policy_number = insurance.name
-                partner.insurance_expiry_date = insurance.expiry_date
-                partner.patient_company = insurance.patient_company_id or False
-                partner.insurance_invoice_number = insurance.invoice_number
-                partner.coverage_details = insurance.coverage_details
+            insurance = latest_insurance.get(partner.id)
+            partner.has_insurance = bool(insurance)
+            partner.insurance_company_id = insurance.insurance_company_id if insurance else False
+            partner.policy_number = insurance.name if insurance else False
+            partner.insurance_expiry_date = insurance.expiry_date if insurance else False
+            partner.patient_company = (insurance.patient_company_id or False) if insurance else False
+            partner.insurance_invoice_number = insurance.invoice_number if insurance else False
+            partner.coverage_details = insurance.coverage_details if insurance else False
+
+    @api.model
+    @instrumented()
+    def optical_get_partner_details(self, partner_id, test_limit=10):
+        """
+        Optical details of a partner, fetched by the POS on first use.
+        
+        Returns the active insurance policies (newest first, as the insurance
+        selection popup and partner editor expect them) and the recent tests
+        shown in the patient history.
+        """
+        partner = self.browse(partner_id).exists()
+        if not partner:
+            return {}
+        insurances = self.env['optical.patient.insurance'].search_read(
+            [('patient_id', '=', partner.id)],
+            ['id', 'name', 'insurance_company_id', 'expiry_date', 'patient_company_id',
+             'invoice_number', 'coverage_details', 'active'],
+            order='date desc, id desc',
+        )
+        for insurance in insurances:
+            insurance['insurance_company_name'] = insurance['insurance_company_id'][1] if insurance['insurance_company_id'] else ''
+        return {
+            'id': partner.id,
+            'insurances': insurances,
+            'tests': self.env['pos.order'].optical_get_patient_tests(partner.id, test_limit),
+        }
+
+    @api.model
+    def optical_find_duplicates(self, partner, limit=5):
+        """
+        Return existing partners that look like the new POS customer ``partner``.
+        
+        Candidates share a normalized phone/mobile or email, or have the same
+        date of birth and a similar name. The lookup is bounded by the
+        ``bp_optical_pos.duplicate_lookup_timeout_ms`` system parameter; when
+        it runs out, no candidates are returned rather than keeping the
+        cashier waiting.
+        """
+        phones = [key for key in (normalize_phone(partner.get('phone')), normalize_phone(partner.get('mobile'))) if key]
+        email = normalize_email(partner.get('email'))
+        name = (partner.get('name') or '').strip()
+        date_of_birth = partner.get('date_of_birth') or None
+        if not phones and not email and not (name and date_of_birth):
+            return []
+
+        if self.env.registry.has_trigram:
+            name_match, name_score = "p.name %% %(name)s", "similarity(p.name, %(name)s)"
+        else:
+            name_match, name_score = "lower(p.name) = lower(%(name)s)", "1"
+        query = """
+            SELECT p.id, p.name, p.phone, p.mobile, p.email, p.date_of_birth
+            FROM res_partner p
+            WHERE p.active AND p.type = 'contact' AND (
+                p.optical_phone_key = ANY(%(phones)s)
+                OR p.optical_mobile_key = ANY(%(phones)s)
+                OR p.optical_email_key = %(email)s
+                OR (p.date_of_birth = %(date_of_birth)s AND {name_match})
+            )
+            ORDER BY (p.optical_phone_key = ANY(%(phones)s) OR p.optical_mobile_key = ANY(%(phones)s)) IS TRUE DESC,
+                     (p.optical_email_key = %(email)s) IS TRUE DESC,
+                     {name_score} DESC
+            LIMIT %(limit)s
+        """.format(name_match=name_match, name_score=name_score)
+        params = {
+            'phones': phones,
+            'email': email or None,
+            'name': name,
+            'date_of_birth': date_of_birth,
+            'limit': limit,
+        }
+
+        self.flush_model(['name', 'active', 'type', 'date_of_birth',
+                          'optical_phone_key', 'optical_mobile_key', 'optical_email_key'])
+        cr = self.env.cr
+        timeout = int(self.env['ir.config_parameter'].sudo().get_param(
+            DUPLICATE_TIMEOUT_PARAM, DUPLICATE_TIMEOUT_DEFAULT))
+        cr.execute("SHOW statement_timeout")
+        previous_timeout = cr.fetchone()[0]
+        cr.execute("SET LOCAL statement_timeout = %s", [timeout])
+        try:
+            with cr.savepoint(flush=False):
+                cr.execute(query, params)
+                rows = cr.dictfetchall()
+        except errors.QueryCanceled:
+            trace(self.env, 'partner.duplicates_timeout', level='warning', timeout_ms=timeout)
+            rows = []
+        finally:
+            cr.execute("SET LOCAL statement_timeout = %s", [previous_timeout])
+
+        # Only return what the user is allowed to see
+        allowed = set(self.browse([row['id'] for row in rows])._filter_access_rules('read').ids)
+        candidates = [dict(row, date_of_birth=fields.Date.to_string(row['date_of_birth'])) for row in rows if row['id'] in allowed]
+        trace(self.env, 'partner.duplicates', candidates=len(candidates))
+        return candidates
 
     @api.model
     def create_from_ui(self, partner):
@@ -97,8 +261,6 @@ class ResPartnerPosExt(models.Model):
         Override POS UI partner creation to create optical.patient for optical POS.
         This method is called from POS when creating/editing partners.
         """
-        _logger.info('[BP Optical POS] create_from_ui called for: %s', partner.get('name'))
-        
         # Handle image data (standard POS logic)
         if partner.get('image_1920'):
             partner['image_1920'] = partner['image_1920'].split(',')[1]
@@ -107,13 +269,14 @@ class ResPartnerPosExt(models.Model):
         
         if partner_id:
             # Modifying existing partner - filter out optical-specific fields
-            _logger.info('[BP Optical POS] Updating existing partner %s', partner_id)
+            trace(self.env, 'partner.update', partner=partner_id)
             
             # Remove optical-specific fields that don't exist on res.partner
             optical_fields = [
                 'has_insurance', 'insurance_company_id', 'policy_number',
                 'insurance_expiry_date', 'patient_company', 'insurance_invoice_number',
-                'coverage_details', 'document', 'document_name', 'insuranceData'
+                'coverage_details', 'document', 'document_name', 'insuranceData',
+                'optical_duplicates_checked', 'optical_pos_session_id',
             ]
             for field in optical_fields:
                 partner.pop(field, None)
@@ -124,28 +287,36 @@ class ResPartnerPosExt(models.Model):
             
             return partner_id
         
+        # The POS editor asks the cashier about look-alike patients first
+        duplicates_checked = partner.pop('optical_duplicates_checked', False)
+        
         # Clean up empty date_of_birth before processing
         if 'date_of_birth' in partner and not partner['date_of_birth']:
             partner['date_of_birth'] = False
         
-        # Creating NEW partner - check if optical POS
-        pos_session = self.env['pos.session'].search([
-            ('state', '=', 'opened'),
-            ('user_id', '=', self.env.uid)
-        ], limit=1)
-        
-        is_optical_pos = pos_session and pos_session.config_id.optical_enabled
-        
-        _logger.info('[BP Optical POS] Creating new partner, optical POS: %s', is_optical_pos)
+        # Creating NEW partner - check if optical POS (the POS sends its session)
+        session_id = partner.pop('optical_pos_session_id', False)
+        session_id, is_optical_pos, branch_id = self.env['pos.session']._optical_partner_context(
+            self.env.uid, int(session_id) if session_id else False)
         
+        trace(self.env, 'partner.create', optical=is_optical_pos, session=session_id,
+              name=redact(partner.get('name')))
+
         if not is_optical_pos:
             # Not optical POS - use standard creation
             partner_id = self.create(partner).id
             return partner_id
         
-        # OPTICAL POS: Create optical.patient instead
-        _logger.info('[BP Optical POS] Creating optical.patient for: %s', partner.get('name'))
+        if not duplicates_checked:
+            candidates = self.optical_find_duplicates(partner)
+            if candidates:
+                raise UserError(_(
+                    "This customer may already exist: %s. Search for the existing patient or confirm "
+                    "the creation from the customer form.",
+                    ", ".join(candidate['name'] for candidate in candidates),
+                ))
         
+        # OPTICAL POS: Create optical.patient instead
         # Extract optical insurance fields
         insurance_company_id = partner.pop('insurance_company_id', None)
         policy_number = partner.pop('policy_number', None)
@@ -165,38 +336,30 @@ class ResPartnerPosExt(models.Model):
             'mobile': partner.get('mobile', ''),
             'email': partner.get('email', ''),
             'date_of_birth': date_of_birth,
-            'branch_id': pos_session.config_id.optical_branch_id.id if pos_session.config_id.optical_branch_id else False,
+            'branch_id': branch_id,
             'has_insurance': bool(insurance_company_id and policy_number),
         }
         
         # Validate and fix required fields
         if not patient_vals['email']:
             patient_vals['email'] = f"{partner.get('name', 'patient').replace(' ', '_').lower()}@pos.local"
-            _logger.info('[BP Optical POS] Auto-generated email: %s', patient_vals['email'])
+            trace(self.env, 'patient.placeholder_email', email=redact(patient_vals['email'], keep=len(PLACEHOLDER_EMAIL_DOMAIN)))
         
         if not patient_vals['phone']:
             patient_vals['phone'] = partner.get('mobile', 'N/A')
         
         if not patient_vals['branch_id']:
-            default_branch = self.env['optical.branch'].search([], limit=1)
-            if default_branch:
-                patient_vals['branch_id'] = default_branch.id
-                _logger.info('[BP Optical POS] Using default branch: %s', default_branch.name)
-            else:
-                _logger.error('[BP Optical POS] No branch available, falling back to standard partner')
-                return self.create(partner).id
+            _logger.error('[BP Optical POS] No branch available, falling back to standard partner')
+            return self.create(partner).id
         
         try:
             # Create optical.patient (auto-creates and links res.partner)
-            _logger.info('[BP Optical POS] Creating optical.patient record...')
             optical_patient = self.env['optical.patient'].create(patient_vals)
             partner_id = optical_patient.partner_id.id
-            _logger.info('[BP Optical POS] Success! Optical patient ID: %s, Partner ID: %s', 
-                       optical_patient.id, partner_id)
+            trace(self.env, 'patient.created', patient=optical_patient.id, partner=partner_id)
             
             # Create insurance if provided
             if insurance_company_id and policy_number:
-                _logger.info('[BP Optical POS] Creating insurance record')
                 insurance_vals = {
                     'patient_id': partner_id,
                     'insurance_company_id': int(insurance_company_id),
@@ -214,8 +377,9 @@ class ResPartnerPosExt(models.Model):
                 if coverage_details:
                     insurance_vals['coverage_details'] = coverage_details
                 
-                self.env['optical.patient.insurance'].create(insurance_vals)
-                _logger.info('[BP Optical POS] Insurance created')
+                insurance = self.env['optical.patient.insurance'].create(insurance_vals)
+                trace(self.env, 'patient.insurance_created', partner=partner_id,
+                      insurance=insurance.id, insurance_company=insurance_vals['insurance_company_id'])
             
             return partner_id
             
@@ -64,6 +64,7 @@ export class InsurancePaymentSelectionPopup extends AbstractAwaitablePopup {
                     "create",
                     [insuranceVals]
                 );
+                this.env.services.pos.invalidateOpticalPartnerDetails(this.props.customerId);
 
                 // Read back the created insurance with company name
                 const newInsurance = await this.env.services.orm.searchRead(
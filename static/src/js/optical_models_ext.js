@@ -8,6 +8,7 @@ import { useService } from "@web/core/utils/hooks";
 import { OpticalInsurancePopup } from "./optical_insurance_popup";
 import { InsurancePaymentSelectionPopup } from "./insurance_payment_selection_popup";
 import { InsuranceFormPopup } from "./insurance_form_popup";
+import { ConfirmPopup } from "@point_of_sale/app/utils/confirm_popup/confirm_popup";
 import { registry } from "@web/core/registry";
 
 // Register the legacy popup (keep for backwards compatibility)
@@ -86,20 +87,11 @@ patch(PaymentScreen.prototype, {
             console.error("Error loading insurance companies:", error);
         }
 
-        // Load customer's insurance policies
+        // Load customer's insurance policies (cached per partner)
         let customerInsurances = [];
         try {
-            customerInsurances = await this.orm.searchRead(
-                "optical.patient.insurance",
-                [["patient_id", "=", customer.id]],
-                ["id", "name", "insurance_company_id", "expiry_date", "patient_company_id", "invoice_number", "coverage_details", "active"],
-                { order: "date desc" }
-            );
-
-            // Add insurance company name to each insurance
-            customerInsurances.forEach(insurance => {
-                insurance.insurance_company_name = insurance.insurance_company_id[1];
-            });
+            const details = await this.pos.getOpticalPartnerDetails(customer.id);
+            customerInsurances = (details.insurances || []).map((insurance) => ({ ...insurance }));
         } catch (error) {
             console.error("Error loading customer insurances:", error);
         }
@@ -127,6 +119,9 @@ patch(PaymentScreen.prototype, {
         );
 
         if (confirmed && payload) {
+            if (!(await this.confirmInsuranceCover(customer, payload, dueAmount))) {
+                return;
+            }
             // Create payment line
             const payment = order.add_paymentline(paymentMethod);
             if (payment) {
@@ -146,4 +141,38 @@ patch(PaymentScreen.prototype, {
             }
         }
     },
+
+    async confirmInsuranceCover(customer, payload, amount) {
+        // Warn when the payment exceeds what is left of the patient's annual cover
+        let cover;
+        try {
+            cover = await this.orm.silent.call(
+                "optical.insurance.utilization",
+                "optical_get_remaining_cover",
+                [customer.id, payload.insurance_company_id]
+            );
+        } catch (error) {
+            console.error("Error loading insurance cover:", error);
+            return true;
+        }
+        if (cover.remaining === null || amount <= cover.remaining) {
+            return true;
+        }
+        const { confirmed } = await this.popup.add(ConfirmPopup, {
+            title: _t("Insurance Cover Exceeded"),
+            body: _t(
+                "%s has used %s of the %s annual cover of %s in %s. Only %s remains for this payment of %s. Continue anyway?",
+                customer.name,
+                this.env.utils.formatCurrency(cover.used),
+                payload.insurance_company_name,
+                this.env.utils.formatCurrency(cover.limit),
+                cover.benefit_year,
+                this.env.utils.formatCurrency(cover.remaining),
+                this.env.utils.formatCurrency(amount)
+            ),
+            confirmText: _t("Continue"),
+            cancelText: _t("Cancel"),
+        });
+        return confirmed;
+    },
 });
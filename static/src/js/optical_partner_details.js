@@ -0,0 +1,30 @@
+/** @odoo-module */
+
+import { PosStore } from "@point_of_sale/app/store/pos_store";
+import { patch } from "@web/core/utils/patch";
+
+// Partners are loaded with a slim projection; their optical details (policies,
+// recent tests) are fetched on first use and cached per partner. The promise
+// is cached so concurrent callers share a single RPC.
+patch(PosStore.prototype, {
+    getOpticalPartnerDetails(partnerId, { force = false } = {}) {
+        if (!this._opticalPartnerDetails) {
+            this._opticalPartnerDetails = new Map();
+        }
+        const cache = this._opticalPartnerDetails;
+        if (force || !cache.has(partnerId)) {
+            const request = this.orm
+                .call("res.partner", "optical_get_partner_details", [partnerId])
+                .catch((error) => {
+                    cache.delete(partnerId);
+                    throw error;
+                });
+            cache.set(partnerId, request);
+        }
+        return cache.get(partnerId);
+    },
+
+    invalidateOpticalPartnerDetails(partnerId) {
+        this._opticalPartnerDetails?.delete(partnerId);
+    },
+});
@@ -72,6 +72,7 @@ export class OpticalTestButton extends Component {
                         body: _t("Failed to create optical test: %s", result.error),
                     });
                 } else {
+                    this.pos.invalidateOpticalPartnerDetails(client.id);
                     await popup.add(ConfirmPopup, {
                         title: _t("Success"),
                         body: _t("Optical test created successfully!\n\nTest ID: %s\nPatient: %s", result.test_id, client.name),
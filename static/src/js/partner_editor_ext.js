@@ -2,7 +2,9 @@
 
 import { PartnerDetailsEdit } from "@point_of_sale/app/screens/partner_list/partner_editor/partner_editor";
 import { InsurancePopup } from "@bp_optical_pos/js/insurance_popup";
+import { SelectionPopup } from "@point_of_sale/app/utils/input_popups/selection_popup";
 import { patch } from "@web/core/utils/patch";
+import { _t } from "@web/core/l10n/translation";
 import { onWillStart } from "@odoo/owl";
 
 patch(PartnerDetailsEdit.prototype, {
@@ -44,13 +46,9 @@ patch(PartnerDetailsEdit.prototype, {
         if (!this.props.partner.id) return;
 
         try {
-            // Load active insurance for this partner
-            const insurances = await this.env.services.orm.searchRead(
-                "optical.patient.insurance",
-                [['patient_id', '=', this.props.partner.id], ['active', '=', true]],
-                ["insurance_company_id", "name", "expiry_date", "patient_company_id", "invoice_number", "coverage_details"],
-                { order: "date desc", limit: 1 }
-            );
+            // Active policies of this partner, newest first (cached per partner)
+            const details = await this.pos.getOpticalPartnerDetails(this.props.partner.id);
+            const insurances = details.insurances || [];
 
             if (insurances && insurances.length > 0) {
                 this.existingInsurance = insurances[0];
@@ -146,6 +144,45 @@ patch(PartnerDetailsEdit.prototype, {
         return `${companyName} - ${this.changes.insuranceData.policy_number}`;
     },
 
+    async saveChanges() {
+        if (this.props.partner.id) {
+            this.pos.invalidateOpticalPartnerDetails(this.props.partner.id);
+        } else if (this.opticalEnabled && !this.changes.optical_duplicates_checked) {
+            // Offer look-alike patients before creating a new one
+            const candidates = await this.env.services.orm.call("res.partner", "optical_find_duplicates", [{
+                name: this.changes.name,
+                phone: this.changes.phone,
+                mobile: this.changes.mobile,
+                email: this.changes.email,
+                date_of_birth: this.changes.date_of_birth,
+            }]);
+            if (candidates.length) {
+                const { confirmed, payload: existingId } = await this.env.services.popup.add(SelectionPopup, {
+                    title: _t("This patient may already exist"),
+                    list: [
+                        ...candidates.map((candidate) => ({
+                            id: candidate.id,
+                            label: [candidate.name, candidate.phone || candidate.mobile, candidate.email, candidate.date_of_birth]
+                                .filter(Boolean)
+                                .join(" · "),
+                            item: candidate.id,
+                        })),
+                        { id: 0, label: _t("None of these, create a new patient"), item: false },
+                    ],
+                });
+                if (!confirmed) {
+                    return;
+                }
+                if (existingId) {
+                    // Selects the existing partner through the standard save flow
+                    return this.props.saveChanges({ id: existingId });
+                }
+            }
+            this.changes.optical_duplicates_checked = true;
+        }
+        return super.saveChanges(...arguments);
+    },
+
     get opticalEnabled() {
         return this.pos.config.optical_enabled;
     }
@@ -18,15 +18,9 @@ patch(PartnerLine.prototype, {
         const partner = this.props.partner;
         if (!partner || !partner.id) return;
         
-        // Use env.services.orm directly
-        const orm = this.env.services.orm;
-        
-        // Fetch optical tests for this patient
-        const tests = await orm.call(
-            "pos.order",
-            "optical_get_patient_tests",
-            [partner.id, 10]
-        );
+        // Recent optical tests come with the partner's cached details
+        const details = await this.env.services.pos.getOpticalPartnerDetails(partner.id);
+        const tests = details.tests || [];
         
         await this.env.services.popup.add(OpticalHistoryPopup, {
             partner: partner,
@@ -0,0 +1,31 @@
+/** @odoo-module */
+
+import { PartnerListScreen } from "@point_of_sale/app/screens/partner_list/partner_list";
+import { patch } from "@web/core/utils/patch";
+
+// Search patients on the server (name, phone, email, policy number) instead of
+// the standard address-oriented search, so tills that only preload their
+// branch's patients still find everyone else.
+patch(PartnerListScreen.prototype, {
+    async getNewPartners() {
+        if (!this.pos.config.optical_enabled) {
+            return await super.getNewPartners(...arguments);
+        }
+        return await this.orm.silent.call(
+            "pos.session",
+            "optical_search_partners",
+            [[this.pos.pos_session.id], this.state.query || "", 30, this.state.currentOffset]
+        );
+    },
+});
+
+// Send the till's session with saved partners so the server resolves the
+// optical mode and branch with one indexed lookup of that session.
+patch(PartnerListScreen.prototype, {
+    async saveChanges(processedChanges) {
+        if (this.pos.config.optical_enabled && !processedChanges.id) {
+            processedChanges = { ...processedChanges, optical_pos_session_id: this.pos.pos_session.id };
+        }
+        return await super.saveChanges(processedChanges);
+    },
+});
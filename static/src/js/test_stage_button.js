@@ -87,6 +87,7 @@ export class TestStageButton extends Component {
             });
 
             if (viewConfirmed && viewData) {
+                this.pos.invalidateOpticalPartnerDetails(this.selectedClient.id);
                 this.notification.add(viewData.message || "Stage updated successfully", {
                     type: "success",
                 });
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from . import test_hot_paths
+from . import test_account_move_insurance
+from . import test_balance_concurrency
+from . import test_partner_duplicates
+from . import test_claim_status
+from . import test_prescription_search
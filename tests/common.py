@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import json
+import time
+
+from odoo.tools import config
+
+from odoo.addons.point_of_sale.tests.common import TestPoSCommon
+
+
+def clone_rows(cr, table, template_id, count, overrides, params=None):
+    """Insert ``count`` copies of row ``template_id`` of ``table``; return the new ids.
+
+    ``overrides`` maps column names to SQL expressions evaluated per copy,
+    ``gs`` being the copy number (1..count).
+    """
+    cr.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", [table])
+    columns = [row[0] for row in cr.fetchall() if row[0] != 'id' and row[0] not in overrides]
+    cr.execute("""
+        INSERT INTO "%s" (%s)
+        SELECT %s FROM "%s" t, generate_series(1, %%(count)s) gs
+        WHERE t.id = %%(template)s
+        ORDER BY gs
+        RETURNING id
+    """ % (
+        table,
+        ', '.join('"%s"' % c for c in columns + list(overrides)),
+        ', '.join(['t."%s"' % c for c in columns] + list(overrides.values())),
+        table,
+    ), dict(params or {}, count=count, template=template_id))
+    return [row[0] for row in cr.fetchall()]
+
+
+def config_scales(option, default):
+    """Data scales of a case, overridable with ``option = 1000,10000`` in the Odoo configuration."""
+    return [int(value) for value in str(config.get(option) or default).split(',') if value]
+
+
+class OpticalPosCommon(TestPoSCommon):
+    """PoS fixtures with an optical configuration, an insurer and an insurance payment method."""
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        company = cls.company_data['company']
+        cls.insurer = cls.env['optical.insurance.company'].create({'name': 'Optical Test Insurer'})
+        cls.insurance_journal = cls.env['account.journal'].create({
+            'name': 'Insurance Invoices',
+            'code': 'OINS',
+            'type': 'sale',
+            'company_id': company.id,
+        })
+        cls.insurance_pm = cls.env['pos.payment.method'].create({
+            'name': 'Insurance',
+            'is_insurance_method': True,
+            'journal_id': cls.company_data['default_journal_bank'].id,
+            'receivable_account_id': cls.bank_pm1.receivable_account_id.id,
+            'company_id': company.id,
+        })
+        cls.optical_config = cls.basic_config
+        cls.optical_config.write({
+            'optical_enabled': True,
+            'optical_force_invoice': True,
+            'optical_insurance_journal_id': cls.insurance_journal.id,
+            'payment_method_ids': [(4, cls.insurance_pm.id)],
+        })
+        cls.frame = cls.env['product.product'].create({
+            'name': 'Optical Test Frame',
+            'type': 'consu',
+            'available_in_pos': True,
+            'lst_price': 100.0,
+            'taxes_id': [(5, 0, 0)],
+        })
+        cls.patient = cls.env['res.partner'].create({
+            'name': 'Optical Test Patient',
+            'phone': '+254700000001',
+            'email': 'optical.patient@example.com',
+        })
+
+    def setUp(self):
+        super().setUp()
+        self.config = self.optical_config
+
+    def insurance_order_data(self, cash=40.0, insurance=60.0, is_invoiced=True, pay_later=0.0):
+        """UI order of one frame paid partly in cash and partly through the insurer.
+
+        ``pay_later`` leaves that much of the customer's share on their account.
+        """
+        payments = [(self.cash_pm1, cash), (self.insurance_pm, insurance)]
+        if pay_later:
+            payments.append((self.pay_later_pm, pay_later))
+        order = self.create_ui_order_data(
+            [(self.frame, 1)],
+            customer=self.patient,
+            is_invoiced=is_invoiced,
+            payments=payments,
+        )
+        for _command, _id, payment in order['data']['statement_ids']:
+            if payment['payment_method_id'] == self.insurance_pm.id:
+                payment.update(is_insurance=True, insuranceData={
+                    'insurance_company_id': self.insurer.id,
+                    'policy_number': 'POL-001',
+                    'member_number': 'M-001',
+                    'employer': 'Optical Employer',
+                    'notes': '',
+                })
+        return order
+
+
+class QueryBudgetMixin:
+    """Measure hot paths against query budgets and collect the results.
+
+    Wall time is recorded for every case but only checked when
+    ``bp_optical_perf_check_time`` is set in the Odoo configuration, as it
+    depends on the machine. With ``bp_optical_perf_output`` set the results
+    are written to that JSON file at the end of the class, so runs can be
+    compared.
+    """
+
+    results = None
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        output = config.get('bp_optical_perf_output')
+        if output and cls.results:
+            try:
+                with open(output, encoding='utf-8') as handle:
+                    previous = json.load(handle)
+            except (OSError, ValueError):
+                previous = {}
+            previous[cls.__name__] = cls.results
+            with open(output, 'w', encoding='utf-8') as handle:
+                json.dump(previous, handle, indent=2, sort_keys=True)
+        super().tearDownClass()
+
+    def measure(self, case, scale, func, max_queries=None, max_ms=None):
+        """Run ``func`` on a cold cache, check its budget and return its result."""
+        self.env.invalidate_all()
+        self.env.flush_all()
+        queries_before = self.cr.sql_log_count
+        start = time.perf_counter()
+        if max_queries is None:
+            result = func()
+            self.env.flush_all()
+        else:
+            with self.assertQueryCount(max_queries):
+                result = func()
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self.results.setdefault(case, {})[str(scale)] = {
+            'queries': self.cr.sql_log_count - queries_before,
+            'ms': round(elapsed_ms, 3),
+        }
+        if max_ms is not None and config.get('bp_optical_perf_check_time'):
+            self.assertLessEqual(elapsed_ms, max_ms, "%s@%s took %.1f ms" % (case, scale, elapsed_ms))
+        return result
+
+    def assertFlatQueries(self, case, tolerance=2):
+        """The query count of ``case`` must not grow with the data."""
+        counts = [stats['queries'] for stats in self.results[case].values()]
+        self.assertLessEqual(max(counts) - min(counts), tolerance,
+                             "%s: query count grows with data (%s)" % (case, counts))
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from odoo import fields
+from odoo.tests import tagged
+
+from odoo.addons.account.tests.common import AccountTestInvoicingCommon
+
+
+@tagged('post_install', '-at_install')
+class TestPatientHasInsurance(AccountTestInvoicingCommon):
+
+    @classmethod
+    def setUpClass(cls, chart_template_ref=None):
+        super().setUpClass(chart_template_ref=chart_template_ref)
+        insurer = cls.env['optical.insurance.company'].create({'name': 'Optical Test Insurer'})
+        cls.partners = cls.env['res.partner'].create([{'name': 'Patient %s' % i} for i in range(40)])
+        # Every third patient has an active policy, every fifth an expired one
+        policies = []
+        for i, partner in enumerate(cls.partners):
+            if i % 3 == 0 or i % 5 == 0:
+                policies.append({
+                    'patient_id': partner.id,
+                    'insurance_company_id': insurer.id,
+                    'name': 'POL-%s' % i,
+                    'date': fields.Date.today(),
+                    'active': i % 3 == 0,
+                })
+        cls.env['optical.patient.insurance'].create(policies)
+        cls.insured = cls.partners.filtered(lambda p: int(p.name.split()[-1]) % 3 == 0)
+        cls.moves = cls.env['account.move'].create([{
+            'move_type': 'out_invoice',
+            'partner_id': partner.id,
+        } for partner in cls.partners])
+
+    def _compute_flags(self, moves):
+        self.env.invalidate_all()
+        with self.assertQueryCount(4):
+            return {move.id: move.patient_has_insurance for move in moves}
+
+    def test_patient_has_insurance(self):
+        flags = self._compute_flags(self.moves)
+        for move in self.moves:
+            self.assertEqual(flags[move.id], move.partner_id in self.insured, move.partner_id.name)
+
+    def test_query_count_is_flat(self):
+        counts = []
+        for size in (4, 40):
+            queries_before = self.cr.sql_log_count
+            self._compute_flags(self.moves[:size])
+            counts.append(self.cr.sql_log_count - queries_before)
+        self.assertEqual(counts[0], counts[1], "patient_has_insurance queries grow with the invoices")
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from unittest.mock import patch
+
+from psycopg2 import errorcodes, OperationalError
+
+from odoo import api, SUPERUSER_ID
+from odoo.tests import tagged, TransactionCase
+
+from odoo.addons.bp_optical_pos.tools import concurrency
+
+
+@tagged('post_install', '-at_install')
+class TestBalancePaymentConcurrency(TransactionCase):
+    """Two transactions settling the same invoice.
+
+    The invoice has to be visible to both cursors, so it is committed in
+    setUp and deleted again on cleanup, like the sequence concurrency tests
+    of the account module.
+    """
+
+    def setUp(self):
+        super().setUp()
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            company = env.company
+            Account = env['account.account']
+            receivable = Account.create({
+                'name': 'Optical Receivable', 'code': 'OPTREC', 'account_type': 'asset_receivable',
+                'reconcile': True, 'company_id': company.id,
+            })
+            income = Account.create({
+                'name': 'Optical Income', 'code': 'OPTINC', 'account_type': 'income', 'company_id': company.id,
+            })
+            bank = Account.create({
+                'name': 'Optical Bank', 'code': 'OPTBNK', 'account_type': 'asset_cash', 'company_id': company.id,
+            })
+            outstanding = Account.create({
+                'name': 'Optical Outstanding Receipts', 'code': 'OPTOUT', 'account_type': 'asset_current',
+                'reconcile': True, 'company_id': company.id,
+            })
+            sale_journal = env['account.journal'].create({
+                'name': 'Optical Sales', 'code': 'OPTS', 'type': 'sale',
+                'default_account_id': income.id, 'company_id': company.id,
+            })
+            bank_journal = env['account.journal'].create({
+                'name': 'Optical Bank', 'code': 'OPTB', 'type': 'bank',
+                'default_account_id': bank.id, 'company_id': company.id,
+            })
+            bank_journal.inbound_payment_method_line_ids.payment_account_id = outstanding
+            partner = env['res.partner'].create({
+                'name': 'Optical Balance Patient',
+                'property_account_receivable_id': receivable.id,
+            })
+            invoice = env['account.move'].create({
+                'move_type': 'out_invoice',
+                'partner_id': partner.id,
+                'journal_id': sale_journal.id,
+                'invoice_line_ids': [(0, 0, {
+                    'name': 'Frame',
+                    'quantity': 1,
+                    'price_unit': 250.0,
+                    'account_id': income.id,
+                    'tax_ids': [(6, 0, [])],
+                })],
+            })
+            invoice.action_post()
+            cr.commit()
+            self.data = {
+                'invoice': invoice.id,
+                'partner': partner.id,
+                'journals': (sale_journal + bank_journal).ids,
+                'accounts': (receivable + income + bank + outstanding).ids,
+            }
+            self.payment_vals = {'amount': invoice.amount_residual, 'journal_id': bank_journal.id, 'ref': 'Balance'}
+        self.addCleanup(self.cleanUp)
+
+    def cleanUp(self):
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            payments = env['account.payment'].search([('partner_id', '=', self.data['partner'])])
+            payments.action_draft()
+            invoice = env['account.move'].browse(self.data['invoice'])
+            invoice.button_draft()
+            moves = (invoice + payments.move_id).with_context(force_delete=True)
+            moves.posted_before = False
+            moves.unlink()
+            env['account.journal'].browse(self.data['journals']).unlink()
+            env['res.partner'].browse(self.data['partner']).unlink()
+            env['account.account'].browse(self.data['accounts']).unlink()
+            cr.commit()
+
+    def _settle(self, cr):
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        return env['pos.order'].optical_register_balance_payment(self.data['invoice'], dict(self.payment_vals))
+
+    def _hold_receivable_lines(self, cr):
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        return env['account.move'].browse(self.data['invoice'])._optical_lock_receivable_lines()
+
+    def _reconciled_payments(self, cr):
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        invoice = env['account.move'].browse(self.data['invoice'])
+        receivable = invoice.line_ids.filtered(lambda l: l.account_id.account_type == 'asset_receivable')
+        return invoice, receivable.matched_credit_ids.credit_move_id.move_id
+
+    def test_lock_conflict_is_retried_then_raised(self):
+        """A settlement that never gets the lock gives up and lets the RPC layer replay it."""
+        with self.registry.cursor() as holder_cr, self.registry.cursor() as cr:
+            self.assertTrue(self._hold_receivable_lines(holder_cr))
+            with patch.object(concurrency.time, 'sleep') as sleep, self.assertRaises(OperationalError) as caught:
+                self._settle(cr)
+            self.assertEqual(caught.exception.pgcode, errorcodes.LOCK_NOT_AVAILABLE)
+            self.assertEqual(sleep.call_count, concurrency.MAX_TRIES - 1)
+            # Every attempt was rolled back to its savepoint: nothing was paid
+            self.assertFalse(self._reconciled_payments(cr)[1])
+            cr.rollback()
+            holder_cr.rollback()
+
+    def test_parallel_settlements_reconcile_once(self):
+        """The waiting settlement pays once the lock is released; the next one finds the invoice paid."""
+        with self.registry.cursor() as holder_cr, self.registry.cursor() as cr:
+            self._hold_receivable_lines(holder_cr)
+            # The other settlement finishes while this one backs off
+            with patch.object(concurrency.time, 'sleep', side_effect=lambda delay: holder_cr.rollback()) as sleep:
+                first = self._settle(cr)
+            self.assertEqual(sleep.call_count, 1)
+            self.assertTrue(first['success'], first.get('error'))
+            cr.commit()
+
+        with self.registry.cursor() as cr:
+            second = self._settle(cr)
+            self.assertFalse(second['success'])
+            self.assertEqual(second['error'], "Invoice is already fully paid.")
+            invoice, payments = self._reconciled_payments(cr)
+            self.assertEqual(len(payments), 1)
+            self.assertIn(invoice.payment_state, ('paid', 'in_payment'))
+            self.assertTrue(invoice.currency_id.is_zero(invoice.amount_residual))
+            cr.rollback()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from odoo.tests import tagged
+
+from .common import OpticalPosCommon
+
+
+@tagged('post_install', '-at_install')
+class TestClaimStatus(OpticalPosCommon):
+    """Claim status of deposit orders, where the customer still owes part of their share."""
+
+    def setUp(self):
+        super().setUp()
+        self.open_new_session()
+        Order = self.env['pos.order']
+        result = Order.create_from_ui([self.insurance_order_data(cash=10.0, pay_later=30.0)])
+        self.order = Order.browse(result[0]['id'])
+        self.invoice = self.order.account_move
+        self.claim = self.order.optical_claim_ids
+        self.bank_journal = self.company_data['default_journal_bank']
+
+    def _insurer_pays(self, amount):
+        self.env['account.payment.register'].with_context(
+            active_model='account.move', active_ids=self.invoice.ids,
+        ).create({'amount': amount, 'journal_id': self.bank_journal.id})._create_payments()
+
+    def test_customer_balance_open(self):
+        self.assertAlmostEqual(self.invoice.amount_residual, 90.0)
+        self.assertEqual(self.claim.claim_state, 'pending')
+        self.assertAlmostEqual(self.claim.claim_residual, 60.0)
+
+    def test_insurer_paid_customer_balance_open(self):
+        """The customer's open balance is not charged to a claim the insurer settled."""
+        self._insurer_pays(60.0)
+        self.assertAlmostEqual(self.invoice.amount_residual, 30.0)
+        self.assertEqual(self.claim.claim_state, 'paid')
+        self.assertAlmostEqual(self.claim.claim_residual, 0.0)
+
+    def test_customer_balance_paid_before_insurer(self):
+        result = self.env['pos.order'].optical_register_balance_payment(
+            self.invoice.id, {'amount': 30.0, 'journal_id': self.bank_journal.id})
+        self.assertTrue(result['success'], result.get('error'))
+        self.assertAlmostEqual(self.invoice.amount_residual, 60.0)
+        self.assertEqual(self.claim.claim_state, 'pending')
+
+        self._insurer_pays(25.0)
+        self.assertEqual(self.claim.claim_state, 'partial')
+        self.assertAlmostEqual(self.claim.claim_residual, 35.0)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import datetime
+import json
+
+from odoo import fields
+from odoo.tests import tagged
+
+from .common import OpticalPosCommon, QueryBudgetMixin, clone_rows, config_scales
+
+
+@tagged('post_install', '-at_install', 'bp_optical_perf')
+class TestHotPaths(QueryBudgetMixin, OpticalPosCommon):
+    """Query budgets of the optical POS hot paths.
+
+    The default scales keep the suite fast; set ``bp_optical_perf_partners``
+    and ``bp_optical_perf_move_lines`` in the Odoo configuration to run it
+    at production sizes (e.g. ``1000,10000,50000`` and ``10000,100000``).
+    benchmarks/bench_hot_paths.py measures the same paths on a copy of a
+    real database.
+    """
+
+    def test_partner_load(self):
+        session = self.open_new_session()
+        scales = config_scales('bp_optical_perf_partners', '100,1000')
+        partner_ids = clone_rows(self.cr, 'res_partner', self.patient.id, max(scales), {
+            'name': "'Perf Patient ' || gs",
+            'complete_name': "'Perf Patient ' || gs",
+            'email': "'perf.patient.' || gs || '@example.com'",
+            'optical_phone_key': "'7' || lpad(gs::text, 8, '0')",
+            'optical_email_key': "'perf.patient.' || gs || '@example.com'",
+        })
+        search_params = session._loader_params_res_partner()['search_params']
+        Partner = self.env['res.partner']
+        for scale in scales:
+            domain = list(search_params.get('domain') or []) + [('id', 'in', partner_ids[:scale])]
+            loader = dict(search_params, domain=domain)
+            partners = self.measure('partner_load', scale, lambda: Partner.search_read(**loader), max_queries=60)
+            self.assertEqual(len(partners), scale)
+        self.assertFlatQueries('partner_load')
+
+    def test_order_with_insurance(self):
+        self.open_new_session()
+        Order = self.env['pos.order']
+        result = self.measure('process_order_insurance', 1,
+                              lambda: Order.create_from_ui([self.insurance_order_data()]), max_queries=400)
+        order = Order.browse(result[0]['id'])
+        self.assertTrue(order.account_move, "Insurance orders are always invoiced")
+        self.assertEqual(order.optical_insurance_amount, 60.0)
+        self.assertEqual(order.optical_customer_amount, 40.0)
+        self.assertEqual(order.optical_claim_ids.invoice_id, order.account_move)
+
+        draft = Order.browse(Order.create_from_ui([self.insurance_order_data()], draft=True)[0]['id'])
+        self.measure('order_paid_insurance', 1, draft.action_pos_order_paid, max_queries=150)
+        self.assertEqual(draft.state, 'paid')
+        self.measure('generate_invoice_insurance', 1,
+                     lambda: draft.with_context(generate_pdf=False)._generate_pos_order_invoice(), max_queries=300)
+        # Insurance payments are left open on the invoice for the insurer
+        self.assertAlmostEqual(draft.account_move.amount_residual, 60.0)
+
+    def test_patient_tests_full(self):
+        Order = self.env['pos.order']
+        created = Order.optical_create_test(False, self.patient.id, {'sphere_od': -1.5, 'sphere_os': -1.25})
+        self.assertTrue(created['success'], created.get('error'))
+        self.env.flush_all()
+        clone_rows(self.cr, 'optical_test', created['test_id'], 50, {
+            'name': "t.name || '/P' || gs",
+            'test_date': "now() - (gs || ' days')::interval",
+        })
+        for limit in (10, 50):
+            tests = self.measure('patient_tests_full', limit,
+                                 lambda: Order.optical_get_patient_tests_full(self.patient.id, limit), max_queries=30)
+            self.assertEqual(len(tests), limit)
+        self.assertFlatQueries('patient_tests_full')
+
+    def test_branch_pl_report(self):
+        plan = self.env['account.analytic.plan'].create({'name': 'Optical Branches'})
+        analytic = self.env['account.analytic.account'].create({'name': 'Perf Branch', 'plan_id': plan.id})
+        branch_vals = {'name': 'Perf Branch', 'analytic_account_id': analytic.id}
+        if 'code' in self.env['optical.branch']._fields:
+            branch_vals['code'] = 'PERF'
+        branch = self.env['optical.branch'].create(branch_vals)
+        today = datetime.date.today()
+        invoice = self.init_invoice('out_invoice', partner=self.patient, invoice_date=today, amounts=[100.0])
+        invoice.invoice_line_ids.analytic_distribution = {str(analytic.id): 100}
+        invoice.action_post()
+        income_line = invoice.invoice_line_ids
+        self.env.flush_all()
+
+        data = {'form': {
+            'date_from': fields.Date.to_string(today - datetime.timedelta(days=30)),
+            'date_to': fields.Date.to_string(today),
+            'branch_ids': branch.ids,
+            'target_move': 'posted',
+        }}
+        Report = self.env['report.bp_optical_pos.report_optical_branch_pl']
+        seeded = 1
+        for scale in config_scales('bp_optical_perf_move_lines', '1000,10000'):
+            clone_rows(self.cr, 'account_move_line', income_line.id, scale - seeded, {
+                'date': "CURRENT_DATE - (gs %% 28)",
+                'analytic_distribution': "%(distribution)s::jsonb",
+            }, {'distribution': json.dumps({str(analytic.id): 100})})
+            seeded = scale
+            values = self.measure('branch_pl_report', scale, lambda: Report._get_report_values([], data=data))
+            self.assertTrue(values)
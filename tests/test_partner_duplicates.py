@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from odoo.tests import tagged, TransactionCase
+
+
+@tagged('post_install', '-at_install')
+class TestPartnerDuplicates(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        Partner = cls.env['res.partner']
+        # Same name and birth date, no phone or email: NULL contact keys
+        cls.name_match = Partner.create({'name': 'Wanjiru Kamau Optical', 'date_of_birth': '1984-03-02'})
+        cls.phone_match = Partner.create({'name': 'W. Kamau', 'phone': '+254 799 123 456'})
+        cls.email_match = Partner.create({'name': 'Kamau W.', 'email': 'wanjiru.kamau.optical@example.com'})
+
+    def test_contact_matches_rank_before_name_matches(self):
+        """Partners without contact keys never push a phone or email match out of the limit."""
+        new_partner = {
+            'name': 'Wanjiru Kamau Optical',
+            'date_of_birth': '1984-03-02',
+            'phone': '0799123456',
+            'email': 'Wanjiru.Kamau.Optical@example.com',
+        }
+        Partner = self.env['res.partner']
+        ids = [candidate['id'] for candidate in Partner.optical_find_duplicates(new_partner)]
+        self.assertEqual(ids, [self.phone_match.id, self.email_match.id, self.name_match.id])
+        ids = [candidate['id'] for candidate in Partner.optical_find_duplicates(new_partner, limit=2)]
+        self.assertEqual(ids, [self.phone_match.id, self.email_match.id])
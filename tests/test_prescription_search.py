@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from odoo.tests import tagged, TransactionCase
+
+from odoo.addons.bp_optical_pos.models.optical_prescription_search import PRESCRIPTION_FIELDS
+from odoo.addons.bp_optical_pos.tools.prescription_cache import get_cache
+
+
+@tagged('post_install', '-at_install')
+class TestPrescriptionSearch(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.patients = cls.env['res.partner'].create([{'name': 'Myopic Patient %s' % i} for i in range(3)])
+        cls.tests = cls.env['optical.test']
+        for patient, sphere in zip(cls.patients, (-5.0, -4.5, -1.0)):
+            created = cls.env['pos.order'].optical_create_test(False, patient.id, {'sphere_od': sphere})
+            cls.tests |= cls.env['optical.test'].browse(created['test_id'])
+
+    def setUp(self):
+        super().setUp()
+        # The cache outlives the test transaction: never share it between cases
+        self.cache = get_cache(self.env.cr.dbname, PRESCRIPTION_FIELDS)
+        self.cache.reset()
+        self.addCleanup(self.cache.reset)
+        self.Search = self.env['optical.prescription.search']
+
+    def _search(self):
+        return set(self.Search.search_partners({'sphere_od': [-6, -4]}))
+
+    def test_cache_matches_database(self):
+        database = set(self.Search._search_database({'sphere_od': (-6.0, -4.0)}))
+        self.assertEqual(database, set(self.patients[:2].ids))
+        self.assertEqual(self._search(), database)
+        self.assertIsNotNone(self.cache.built_at)
+
+    def test_deleted_and_moved_tests_leave_the_cache(self):
+        self.assertEqual(self._search(), set(self.patients[:2].ids))
+        self.tests[0].unlink()
+        self.tests[1].patient_id = self.patients[2]
+        self.assertEqual(self._search(), {self.patients[2].id})
+        self.assertNotIn(self.patients[0].id, self.cache.rows)
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+from . import concurrency
+from . import csv_import
+from . import metrics
+from . import prescription_cache
+from . import profiling
+from . import tracing
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Retry helpers for settlement code that competes for the same rows.
+
+Settlement paths lock the rows they reconcile with ``FOR UPDATE NOWAIT`` in a
+fixed order (by id), so two settlements of one invoice never interleave and
+cannot deadlock each other. ``retry_on_lock_conflict()`` runs such a block in
+a savepoint and, when the lock is held elsewhere, rolls back to the savepoint
+and tries again after a jittered exponential backoff.
+
+Serialization failures and deadlocks cannot be retried inside the same
+transaction: under REPEATABLE READ the snapshot stays the same, so the retry
+would fail again. They are re-raised untouched and the RPC layer replays the
+whole call in a new transaction; ``is_concurrency_error()`` tells callers
+with a broad ``except`` which errors they must let through.
+"""
+
+import random
+import time
+
+from psycopg2 import errorcodes, OperationalError
+
+from .tracing import trace
+
+LOCK_CONFLICTS = (errorcodes.LOCK_NOT_AVAILABLE,)
+TRANSACTION_CONFLICTS = (errorcodes.SERIALIZATION_FAILURE, errorcodes.DEADLOCK_DETECTED)
+
+MAX_TRIES = 5
+BASE_DELAY = 0.05
+MAX_DELAY = 1.0
+
+
+def is_concurrency_error(error):
+    """Whether ``error`` is a lock or serialization conflict the caller must not swallow."""
+    return isinstance(error, OperationalError) and error.pgcode in LOCK_CONFLICTS + TRANSACTION_CONFLICTS
+
+
+def retry_on_lock_conflict(env, func, event, tries=MAX_TRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Call ``func()`` in a savepoint, retrying while its NOWAIT locks are taken.
+
+    The last lock conflict is re-raised, as is any other error.
+    """
+    for attempt in range(1, tries + 1):
+        try:
+            with env.cr.savepoint():
+                return func()
+        except OperationalError as e:
+            if e.pgcode not in LOCK_CONFLICTS or attempt == tries:
+                raise
+        env.invalidate_all()
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+        trace(env, event + '.lock_retry', attempt=attempt, delay_ms=round(delay * 1000.0, 1))
+        time.sleep(delay)
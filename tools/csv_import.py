@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Streaming CSV helpers for the bulk import wizards.
+
+The uploaded file is decoded lazily and handed out in chunks of parsed rows,
+so a large migration file never becomes one big list of dicts. Column names
+are normalized (stripped, lower-cased, spaces as underscores) so exports of
+other systems need little massaging. ``ErrorReport`` collects the rejected
+rows and renders them as a CSV the user can fix and import again.
+"""
+
+import base64
+import csv
+import datetime
+import io
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%m/%d/%Y')
+
+# Context of the import creates: mail bookkeeping is pure overhead for migrated records
+IMPORT_CONTEXT = {
+    'tracking_disable': True,
+    'mail_create_nolog': True,
+    'mail_create_nosubscribe': True,
+    'mail_notrack': True,
+}
+
+
+def normalize_header(name):
+    return (name or '').strip().lower().replace(' ', '_')
+
+
+def iter_chunks(data, chunk_size, encoding='utf-8-sig'):
+    """Yield ``(first_line, rows)`` chunks of the base64 encoded CSV ``data``.
+
+    ``rows`` are dicts keyed by normalized column names with stripped values;
+    ``first_line`` is the file line number of the first row (the header is
+    line 1). The delimiter is sniffed from the header.
+    """
+    stream = io.TextIOWrapper(io.BytesIO(base64.b64decode(data)), encoding=encoding, newline='')
+    header_line = stream.readline()
+    try:
+        dialect = csv.Sniffer().sniff(header_line, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    header = [normalize_header(name) for name in next(csv.reader([header_line], dialect))]
+    reader = csv.reader(stream, dialect)
+    chunk = []
+    first_line = 2
+    for line_number, values in enumerate(reader, start=2):
+        if not any(value.strip() for value in values):
+            continue
+        if not chunk:
+            first_line = line_number
+        row = {key: value.strip() for key, value in zip(header, values)}
+        row['_line'] = line_number
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield first_line, chunk
+            chunk = []
+    if chunk:
+        yield first_line, chunk
+
+
+def parse_float(value):
+    """Return a float for ``value`` (decimal comma accepted), ``None`` if empty; raise ``ValueError``."""
+    if value is None or not str(value).strip():
+        return None
+    return float(str(value).strip().replace(',', '.'))
+
+
+def parse_date(value):
+    """Return a ``date`` for the common date layouts, ``None`` if empty; raise ``ValueError``."""
+    if not value:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError("unrecognized date %r" % value)
+
+
+def name_map(model, names=('name', 'code')):
+    """Lower-cased ``names`` of every record of ``model`` (archived included) to id.
+
+    Names the model does not define are skipped, so optional fields such as
+    a branch code can be listed safely. The first record wins on duplicates.
+    """
+    model = model.with_context(active_test=False)
+    names = [name for name in names if name in model._fields]
+    mapping = {}
+    for record in model.search_read([], names):
+        for name in names:
+            if record[name]:
+                mapping.setdefault(record[name].strip().lower(), record['id'])
+    return mapping
+
+
+class ErrorReport:
+    """Rejected rows with their reason, rendered as a CSV."""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.rows = []
+
+    def add(self, row, error):
+        self.rows.append((row.get('_line'), error, row))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def to_base64(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['line', 'error'] + self.columns)
+        for line, error, row in self.rows:
+            writer.writerow([line, error] + [row.get(column, '') for column in self.columns])
+        return base64.b64encode(buffer.getvalue().encode('utf-8'))
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Per-worker call metrics for the optical POS RPC endpoints.
+
+Decorate a model method with ``@instrumented()`` to record its call count,
+wall time, SQL query count and SQL time. Totals and a ring buffer of the most
+recent calls live in module globals, so each Odoo worker process keeps its
+own figures. Recording is switched on by the ``bp_optical_pos.metrics_enabled``
+system parameter; when it is off the wrapper costs one cached parameter
+lookup.
+"""
+
+import collections
+import functools
+import os
+import threading
+import time
+
+from odoo.tools import str2bool
+
+ENABLED_PARAM = 'bp_optical_pos.metrics_enabled'
+RING_SIZE = 2048
+QUANTILES = (0.5, 0.9, 0.99)
+
+Sample = collections.namedtuple('Sample', 'method timestamp wall queries sql_time failed')
+
+_lock = threading.Lock()
+_samples = collections.deque(maxlen=RING_SIZE)
+# method -> [calls, errors, wall seconds, queries, sql seconds]
+_totals = collections.defaultdict(lambda: [0, 0, 0.0, 0, 0.0])
+
+
+def metrics_enabled(env):
+    """Return whether call metrics are recorded (cached system parameter)."""
+    return str2bool(env['ir.config_parameter'].sudo().get_param(ENABLED_PARAM, 'False'))
+
+
+def record(method, wall, queries, sql_time, failed=False):
+    """Add one call of ``method`` to the totals and the ring buffer."""
+    with _lock:
+        totals = _totals[method]
+        totals[0] += 1
+        totals[1] += int(failed)
+        totals[2] += wall
+        totals[3] += queries
+        totals[4] += sql_time
+        _samples.append(Sample(method, time.time(), wall, queries, sql_time, failed))
+
+
+def reset():
+    """Forget every recorded call of this worker."""
+    with _lock:
+        _samples.clear()
+        _totals.clear()
+
+
+def recent_samples(limit=None):
+    """Return the most recent samples, newest first."""
+    with _lock:
+        samples = list(_samples)
+    samples.reverse()
+    return samples[:limit] if limit else samples
+
+
+def instrumented(name=None):
+    """Decorator recording the cost of a model method when metrics are on."""
+    def decorator(method):
+        metric = name or method.__name__
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not metrics_enabled(self.env):
+                return method(self, *args, **kwargs)
+            cr = self.env.cr
+            thread = threading.current_thread()
+            queries_before = cr.sql_log_count
+            sql_time_before = getattr(thread, 'query_time', 0.0)
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = method(self, *args, **kwargs)
+                # Endpoints report their own errors as {'success': False}
+                failed = isinstance(result, dict) and result.get('success') is False
+                return result
+            finally:
+                record(
+                    metric,
+                    time.perf_counter() - start,
+                    cr.sql_log_count - queries_before,
+                    getattr(thread, 'query_time', 0.0) - sql_time_before,
+                    failed,
+                )
+        return wrapper
+    return decorator
+
+
+def _quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _sample_line(name, labels, value):
+    label_text = ','.join('%s="%s"' % (key, val) for key, val in labels)
+    return '%s{%s} %r' % (name, label_text, float(value))
+
+
+def render_prometheus(extra_lines=()):
+    """Return this worker's metrics in the Prometheus text exposition format.
+
+    ``extra_lines`` are appended as is (database-wide gauges, for instance).
+    """
+    with _lock:
+        totals = {method: list(values) for method, values in _totals.items()}
+        samples = list(_samples)
+    worker = str(os.getpid())
+    recent = collections.defaultdict(list)
+    for sample in samples:
+        recent[sample.method].append(sample.wall)
+
+    duration = 'bp_optical_pos_rpc_duration_seconds'
+    lines = [
+        '# HELP %s Wall time of optical POS RPC calls, quantiles over recent calls.' % duration,
+        '# TYPE %s summary' % duration,
+    ]
+    for method in sorted(totals):
+        labels = (('method', method), ('worker', worker))
+        for q in QUANTILES:
+            if recent[method]:
+                lines.append(_sample_line(duration, labels + (('quantile', q),), _quantile(recent[method], q)))
+        lines.append(_sample_line(duration + '_sum', labels, totals[method][2]))
+        lines.append(_sample_line(duration + '_count', labels, totals[method][0]))
+
+    counters = (
+        ('bp_optical_pos_rpc_errors_total', 1, 'Optical POS RPC calls that raised or returned an error.'),
+        ('bp_optical_pos_rpc_queries_total', 3, 'SQL queries issued by optical POS RPC calls.'),
+        ('bp_optical_pos_rpc_sql_seconds_total', 4, 'Time spent in SQL by optical POS RPC calls.'),
+    )
+    for name, position, help_text in counters:
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s counter' % name)
+        for method in sorted(totals):
+            lines.append(_sample_line(name, (('method', method), ('worker', worker)), totals[method][position]))
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
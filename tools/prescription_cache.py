@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Per-worker columnar cache of each patient's latest prescription.
+
+Every column is a typed ``array.array`` (4-byte floats, NaN when the value is
+missing), so a million patients take about 4 MB per column. Range queries
+view the columns as NumPy arrays without copying them and evaluate all the
+predicates in vectorized form; without NumPy they fall back to a plain loop
+over the same arrays. NumPy is optional: the pure-Python path is the
+supported baseline and returns the same results, only slower on large
+patient bases. The cache is filled and kept current by
+``optical.prescription.search``; this module knows nothing about the ORM.
+"""
+
+import array
+import math
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+NAN = float('nan')
+
+
+class PrescriptionColumns:
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.lock = threading.RLock()
+        self.building = False
+        self.reset()
+
+    def reset(self):
+        self.rows = {}
+        self.partner_ids = array.array('q')
+        self.company_ids = array.array('q')
+        self.values = {name: array.array('f') for name in self.columns}
+        self.watermark = None
+        self.built_at = None
+
+    def __len__(self):
+        return len(self.partner_ids)
+
+    def upsert(self, records):
+        """Store ``(partner_id, company_id, *values)`` tuples, values in ``columns`` order."""
+        for partner_id, company_id, *values in records:
+            row = self.rows.get(partner_id)
+            if row is None:
+                row = self.rows[partner_id] = len(self.partner_ids)
+                self.partner_ids.append(partner_id)
+                self.company_ids.append(company_id or 0)
+                for name, value in zip(self.columns, values):
+                    self.values[name].append(NAN if value is None else value)
+                continue
+            self.company_ids[row] = company_id or 0
+            for name, value in zip(self.columns, values):
+                self.values[name][row] = NAN if value is None else value
+
+    def remove(self, partner_ids):
+        """Drop the rows of ``partner_ids``, moving the last row into each freed slot."""
+        for partner_id in partner_ids:
+            row = self.rows.pop(partner_id, None)
+            if row is None:
+                continue
+            last = len(self.partner_ids) - 1
+            if row != last:
+                moved = self.partner_ids[last]
+                self.partner_ids[row] = moved
+                self.company_ids[row] = self.company_ids[last]
+                for column in self.values.values():
+                    column[row] = column[last]
+                self.rows[moved] = row
+            self.partner_ids.pop()
+            self.company_ids.pop()
+            for column in self.values.values():
+                column.pop()
+
+    def query(self, ranges, company_ids=None, limit=None):
+        """
+        Return the partner ids whose values fall in every ``{column: (low, high)}`` range.
+
+        Bounds are inclusive and ``None`` leaves a side open; missing values
+        never match. Partners without a company match any ``company_ids``.
+        """
+        # Compare at the stored precision, so -0.1 matches a stored -0.1
+        ranges = {name: (_as_float32(low), _as_float32(high)) for name, (low, high) in ranges.items()}
+        if numpy is not None:
+            partner_ids = self._query_numpy(ranges, company_ids)
+        else:
+            partner_ids = self._query_python(ranges, company_ids)
+        return partner_ids[:limit] if limit else partner_ids
+
+    def _query_numpy(self, ranges, company_ids):
+        mask = numpy.ones(len(self.partner_ids), dtype=bool)
+        for name, (low, high) in ranges.items():
+            column = numpy.frombuffer(self.values[name], dtype=numpy.float32)
+            if low is not None:
+                mask &= column >= low
+            if high is not None:
+                mask &= column <= high
+            # NaN compares false, but an open range must still drop missing values
+            if low is None and high is None:
+                mask &= ~numpy.isnan(column)
+        if company_ids:
+            companies = numpy.frombuffer(self.company_ids, dtype=numpy.int64)
+            mask &= numpy.isin(companies, list(company_ids) + [0])
+        return numpy.frombuffer(self.partner_ids, dtype=numpy.int64)[mask].tolist()
+
+    def _query_python(self, ranges, company_ids):
+        allowed = set(company_ids or ()) | {0}
+        checks = [(self.values[name], low, high) for name, (low, high) in ranges.items()]
+        result = []
+        for row, partner_id in enumerate(self.partner_ids):
+            if company_ids and self.company_ids[row] not in allowed:
+                continue
+            for column, low, high in checks:
+                value = column[row]
+                if math.isnan(value) or (low is not None and value < low) or (high is not None and value > high):
+                    break
+            else:
+                result.append(partner_id)
+        return result
+
+
+def _as_float32(value):
+    return None if value is None else array.array('f', [value])[0]
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(dbname, columns):
+    """Return the cache of ``dbname`` for this worker, created empty on first use."""
+    with _caches_lock:
+        cache = _caches.get(dbname)
+        if cache is None or cache.columns != tuple(columns):
+            cache = _caches[dbname] = PrescriptionColumns(columns)
+        return cache
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Opt-in cProfile sampling of the optical order sync and invoicing overrides.
+
+Decorate a model method with ``@profiled()``. A call is profiled when the
+context carries ``optical_profile=True`` or, otherwise, with the probability
+set in the ``bp_optical_pos.profile_sample_rate`` system parameter (0 = off,
+the default). Each profiled call is written as a ``.pstats`` file named after
+the method and the order reference; the oldest files are removed once the
+directory exceeds ``bp_optical_pos.profile_max_mb``. Calls nested in a
+profiled call are part of the outer profile and are not profiled again.
+"""
+
+import cProfile
+import datetime
+import functools
+import logging
+import os
+import random
+import re
+import threading
+
+from odoo.tools import config
+
+_logger = logging.getLogger(__name__)
+
+SAMPLE_RATE_PARAM = 'bp_optical_pos.profile_sample_rate'
+DIRECTORY_PARAM = 'bp_optical_pos.profile_dir'
+MAX_MB_PARAM = 'bp_optical_pos.profile_max_mb'
+DEFAULT_MAX_MB = 200
+
+_state = threading.local()
+
+
+def _sample_rate(env):
+    try:
+        return float(env['ir.config_parameter'].sudo().get_param(SAMPLE_RATE_PARAM, 0.0))
+    except ValueError:
+        return 0.0
+
+
+def should_profile(env):
+    """Return whether the current call is sampled for profiling."""
+    if env.context.get('optical_profile'):
+        return True
+    rate = _sample_rate(env)
+    return rate > 0 and random.random() < rate
+
+
+def profile_directory(env):
+    """Return the directory receiving the ``.pstats`` files of this database."""
+    directory = env['ir.config_parameter'].sudo().get_param(DIRECTORY_PARAM)
+    return directory or os.path.join(config['data_dir'], 'bp_optical_pos_profiles', env.cr.dbname)
+
+
+def _rotate(directory, max_bytes):
+    """Delete the oldest profiles until the directory fits in ``max_bytes``."""
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.pstats'):
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort(reverse=True)
+    total = 0
+    for _mtime, size, path in entries:
+        total += size
+        if total > max_bytes:
+            os.remove(path)
+
+
+def _dump(env, profiler, method_name, reference):
+    directory = profile_directory(env)
+    os.makedirs(directory, exist_ok=True)
+    safe_reference = re.sub(r'[^A-Za-z0-9_-]+', '-', reference or 'no-ref').strip('-')[:60]
+    filename = '%s_%s_%s.pstats' % (
+        datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'), method_name, safe_reference)
+    path = os.path.join(directory, filename)
+    profiler.dump_stats(path)
+    try:
+        max_mb = float(env['ir.config_parameter'].sudo().get_param(MAX_MB_PARAM, DEFAULT_MAX_MB))
+    except ValueError:
+        max_mb = DEFAULT_MAX_MB
+    _rotate(directory, int(max_mb * 1024 * 1024))
+    _logger.info('[BP Optical POS] Profile of %s written to %s', method_name, path)
+
+
+def _default_reference(orders, *args, **kwargs):
+    return ','.join(filter(None, orders.mapped('pos_reference')))
+
+
+def profiled(reference=None):
+    """Decorator profiling a sampled fraction of the calls of a model method.
+
+    ``reference(self, *args, **kwargs)`` returns the order reference used in
+    the file name; by default the ``pos_reference`` of the records.
+    """
+    get_reference = reference or _default_reference
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if getattr(_state, 'active', False) or not should_profile(self.env):
+                return method(self, *args, **kwargs)
+            profiler = cProfile.Profile()
+            _state.active = True
+            try:
+                return profiler.runcall(method, self, *args, **kwargs)
+            finally:
+                _state.active = False
+                try:
+                    _dump(self.env, profiler, method.__name__, get_reference(self, *args, **kwargs))
+                except Exception:
+                    _logger.warning('[BP Optical POS] Could not write profile of %s', method.__name__, exc_info=True)
+        return wrapper
+    return decorator
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+"""
+Sampled structured tracing for the optical POS hot paths.
+
+``trace(env, event, level, **fields)`` replaces INFO logging on the order
+sync path. An event is dropped unless its level reaches the
+``bp_optical_pos.trace_level`` system parameter (default ``warning``); events
+below ``warning`` are further sampled with the per-event rates of
+``bp_optical_pos.trace_sampling``, e.g. ``payment.add=0.01,order.*=0.1,*=0``.
+
+Kept events go into a bounded in-memory buffer without any formatting. A
+daemon thread of each worker drains it every few seconds and writes one JSON
+line per event to the ``odoo.addons.bp_optical_pos.trace`` logger, so string
+formatting and log I/O happen off the request path. When the buffer is full
+the oldest events are dropped and counted.
+
+Never pass raw UI payloads: they carry policy and member numbers. Use
+``redact()`` for identifiers that must appear in a trace.
+"""
+
+import collections
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+_trace_logger = logging.getLogger('odoo.addons.bp_optical_pos.trace')
+
+LEVEL_PARAM = 'bp_optical_pos.trace_level'
+SAMPLING_PARAM = 'bp_optical_pos.trace_sampling'
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+DEFAULT_LEVEL = 'warning'
+BUFFER_SIZE = 10000
+FLUSH_INTERVAL = 2.0
+
+_lock = threading.Lock()
+_buffer = collections.deque(maxlen=BUFFER_SIZE)
+_dropped = 0
+_flusher_pid = None
+
+
+@functools.lru_cache(maxsize=16)
+def parse_sampling(value):
+    """Parse ``event=rate`` pairs; keys may end with ``*`` as a prefix match."""
+    exact = {}
+    prefixes = []
+    for item in (value or '').split(','):
+        event, _sep, rate = item.partition('=')
+        event = event.strip()
+        if not event:
+            continue
+        try:
+            rate = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+        if event.endswith('*'):
+            prefixes.append((event[:-1], rate))
+        else:
+            exact[event] = rate
+    # Longest prefix first, so 'order.*' wins over '*'
+    prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+    return exact, tuple(prefixes)
+
+
+def sample_rate(sampling, event):
+    """Return the sampling rate of ``event`` (1.0 when nothing matches)."""
+    exact, prefixes = sampling
+    if event in exact:
+        return exact[event]
+    for prefix, rate in prefixes:
+        if event.startswith(prefix):
+            return rate
+    return 1.0
+
+
+def redact(value, keep=3):
+    """Mask an identifier, keeping its last ``keep`` characters."""
+    if not value:
+        return value
+    value = str(value)
+    return '*' * max(len(value) - keep, 0) + value[-keep:]
+
+
+def trace(env, event, level='info', **fields):
+    """Record ``event`` with ``fields`` if its level and sampling allow it."""
+    levelno = LEVELS[level]
+    params = env['ir.config_parameter'].sudo()
+    if levelno < LEVELS.get(params.get_param(LEVEL_PARAM) or DEFAULT_LEVEL, logging.WARNING):
+        return
+    if levelno < logging.WARNING:
+        rate = sample_rate(parse_sampling(params.get_param(SAMPLING_PARAM) or ''), event)
+        if rate < 1.0 and random.random() >= rate:
+            return
+    emit(event, levelno, fields, dbname=env.cr.dbname, uid=env.uid)
+
+
+def emit(event, levelno, fields, **meta):
+    """Append an already gated event to the buffer."""
+    global _dropped
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+    with _lock:
+        if len(_buffer) == BUFFER_SIZE:
+            _dropped += 1
+        _buffer.append((time.time(), levelno, event, fields, meta))
+
+
+def flush():
+    """Write every buffered event to the trace logger; return how many."""
+    global _dropped
+    with _lock:
+        events = list(_buffer)
+        _buffer.clear()
+        dropped, _dropped = _dropped, 0
+    for timestamp, levelno, event, fields, meta in events:
+        record = dict(fields, event=event, ts=round(timestamp, 6), **meta)
+        _trace_logger.log(levelno, json.dumps(record, default=str, sort_keys=True))
+    if dropped:
+        _trace_logger.warning(json.dumps({'event': 'trace.dropped', 'count': dropped}))
+    return len(events)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            _logger.exception('[BP Optical POS] Trace flush failed')
+
+
+def _start_flusher():
+    """Start the flushing thread of this process (again after a fork)."""
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_loop, name='bp_optical_pos.trace', daemon=True).start()
@@ -1 +1,3 @@
 from . import optical_branch_pl_wizard
+from . import optical_patient_import_wizard
+from . import optical_test_import_wizard
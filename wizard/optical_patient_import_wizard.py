@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import csv
+import logging
+import time
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+
+from ..models.res_partner_pos_ext import normalize_email, normalize_phone
+from ..tools import csv_import
+
+_logger = logging.getLogger(__name__)
+
+IMPORT_COLUMNS = [
+    'name', 'phone', 'mobile', 'email', 'date_of_birth', 'branch',
+    'insurance_company', 'policy_number', 'expiry_date', 'patient_company',
+    'invoice_number', 'coverage_details',
+]
+
+
+class OpticalPatientImportWizard(models.TransientModel):
+    _name = "optical.patient.import.wizard"
+    _description = "Optical Patient and Policy Import"
+
+    file = fields.Binary(string="CSV File", required=True)
+    filename = fields.Char(string="File Name")
+    default_branch_id = fields.Many2one(
+        "optical.branch",
+        string="Default Branch",
+        help="Branch of the rows without a branch column value."
+    )
+    chunk_size = fields.Integer(string="Rows per Chunk", default=1000)
+    skip_existing = fields.Boolean(
+        string="Skip Existing Patients",
+        default=True,
+        help="Skip rows whose phone, mobile or email matches an existing partner or an earlier row."
+    )
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+    patient_count = fields.Integer(string="Patients Created", readonly=True)
+    insurance_count = fields.Integer(string="Policies Created", readonly=True)
+    skipped_count = fields.Integer(string="Rows Skipped", readonly=True)
+    error_count = fields.Integer(string="Rows Rejected", readonly=True)
+    duration = fields.Float(string="Duration (s)", readonly=True)
+    error_report = fields.Binary(string="Error Report", readonly=True)
+    error_report_name = fields.Char(readonly=True)
+
+    def _existing_contact_keys(self):
+        """Normalized phone and email keys of all active partners."""
+        self.env['res.partner'].flush_model(['optical_phone_key', 'optical_mobile_key', 'optical_email_key'])
+        self.env.cr.execute("""
+            SELECT optical_phone_key, optical_mobile_key, optical_email_key
+            FROM res_partner
+            WHERE active
+              AND (optical_phone_key IS NOT NULL OR optical_mobile_key IS NOT NULL OR optical_email_key IS NOT NULL)
+        """)
+        keys = set()
+        for row in self.env.cr.fetchall():
+            keys.update(key for key in row if key)
+        return keys
+
+    def _prepare_row(self, row, branches, insurers):
+        """Return ``(patient_vals, insurance_vals)`` for a CSV row; raise ``ValueError`` if invalid."""
+        if not row.get('name'):
+            raise ValueError(_("Name is required."))
+        branch_id = self.default_branch_id.id
+        if row.get('branch'):
+            branch_id = branches.get(row['branch'].lower())
+            if not branch_id:
+                raise ValueError(_("Unknown branch %s.", row['branch']))
+        if not branch_id:
+            raise ValueError(_("No branch given and no default branch set."))
+
+        insurance_vals = None
+        if row.get('policy_number') or row.get('insurance_company'):
+            insurer_id = insurers.get((row.get('insurance_company') or '').lower())
+            if not insurer_id:
+                raise ValueError(_("Unknown insurance company %s.", row.get('insurance_company') or '-'))
+            if not row.get('policy_number'):
+                raise ValueError(_("Policy number is required with an insurance company."))
+            insurance_vals = {
+                'insurance_company_id': insurer_id,
+                'name': row['policy_number'],
+                'date': fields.Date.today(),
+                'active': True,
+                'expiry_date': csv_import.parse_date(row.get('expiry_date')) or False,
+                'patient_company_id': row.get('patient_company') or False,
+                'invoice_number': row.get('invoice_number') or False,
+                'coverage_details': row.get('coverage_details') or False,
+            }
+
+        patient_vals = {
+            'name': row['name'],
+            'phone': row.get('phone') or row.get('mobile') or 'N/A',
+            'mobile': row.get('mobile') or '',
+            # Same placeholder as the POS for the required email
+            'email': row.get('email') or "%s@pos.local" % row['name'].replace(' ', '_').lower(),
+            'date_of_birth': csv_import.parse_date(row.get('date_of_birth')) or fields.Date.today(),
+            'branch_id': branch_id,
+            'has_insurance': bool(insurance_vals),
+        }
+        return patient_vals, insurance_vals
+
+    def _create_rows(self, prepared):
+        """Create the patients of ``prepared`` and their policies; return the counts."""
+        Patient = self.env['optical.patient'].with_context(**csv_import.IMPORT_CONTEXT)
+        patients = Patient.create([patient_vals for _row, patient_vals, _insurance_vals in prepared])
+        insurance_vals_list = [
+            dict(insurance_vals, patient_id=patient.partner_id.id)
+            for (_row, _patient_vals, insurance_vals), patient in zip(prepared, patients)
+            if insurance_vals
+        ]
+        self.env['optical.patient.insurance'].with_context(**csv_import.IMPORT_CONTEXT).create(insurance_vals_list)
+        self.env.flush_all()
+        return len(patients), len(insurance_vals_list)
+
+    def _import_chunk(self, rows, branches, insurers, known_keys, report):
+        """Validate and create one chunk; returns ``(patients, insurances, skipped)``."""
+        prepared = []
+        skipped = 0
+        for row in rows:
+            try:
+                patient_vals, insurance_vals = self._prepare_row(row, branches, insurers)
+            except ValueError as e:
+                report.add(row, str(e))
+                continue
+            keys = {normalize_phone(row.get('phone')), normalize_phone(row.get('mobile')), normalize_email(row.get('email'))}
+            keys.discard(False)
+            if self.skip_existing and keys & known_keys:
+                skipped += 1
+                continue
+            known_keys.update(keys)
+            prepared.append((row, patient_vals, insurance_vals))
+        if not prepared:
+            return 0, 0, skipped
+
+        try:
+            with self.env.cr.savepoint():
+                return self._create_rows(prepared) + (skipped,)
+        except Exception as e:
+            _logger.info('[BP Optical POS] Import chunk failed (%s), retrying row by row', e)
+            self.env.invalidate_all()
+
+        # Isolate the failing rows so the rest of the chunk still goes in
+        patients = insurances = 0
+        for item in prepared:
+            try:
+                with self.env.cr.savepoint():
+                    created = self._create_rows([item])
+            except Exception as e:
+                self.env.invalidate_all()
+                report.add(item[0], str(e))
+                continue
+            patients += created[0]
+            insurances += created[1]
+        return patients, insurances, skipped
+
+    def action_import(self):
+        self.ensure_one()
+        if self.chunk_size <= 0:
+            raise UserError(_("Rows per chunk must be positive."))
+        start = time.monotonic()
+        branches = csv_import.name_map(self.env['optical.branch'])
+        insurers = csv_import.name_map(self.env['optical.insurance.company'])
+        known_keys = self._existing_contact_keys() if self.skip_existing else set()
+        report = csv_import.ErrorReport(IMPORT_COLUMNS)
+        totals = [0, 0, 0]
+        try:
+            chunks = csv_import.iter_chunks(self.file, self.chunk_size)
+            for first_line, rows in chunks:
+                counts = self._import_chunk(rows, branches, insurers, known_keys, report)
+                totals = [total + count for total, count in zip(totals, counts)]
+                # Keep the cache, and memory, from growing with the file
+                self.env.invalidate_all()
+                _logger.info('[BP Optical POS] Imported rows from line %s: %s patients so far', first_line, totals[0])
+        except (ValueError, csv.Error) as e:
+            # Decoding errors surface here, not when the wizard is opened
+            raise UserError(_("The file could not be read as a UTF-8 CSV file: %s", e))
+
+        self.write({
+            'state': 'done',
+            'patient_count': totals[0],
+            'insurance_count': totals[1],
+            'skipped_count': totals[2],
+            'error_count': len(report),
+            'duration': round(time.monotonic() - start, 1),
+            'error_report': report.to_base64() if len(report) else False,
+            'error_report_name': 'patient_import_errors.csv' if len(report) else False,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# Part of BP Optical POS. See LICENSE file for full copyright and licensing details.
+
+import csv
+import datetime
+import logging
+import time
+
+from odoo import models, fields, _
+from odoo.exceptions import UserError
+
+from ..models.pos_order_ext import PRESCRIPTION_NUMERIC_FIELDS
+from ..models.res_partner_pos_ext import normalize_email, normalize_phone
+from ..tools import csv_import
+
+_logger = logging.getLogger(__name__)
+
+# Plausible values per prescription field; rows outside are rejected
+PRESCRIPTION_RANGES = {
+    'sphere': (-30.0, 30.0),
+    'cylinder': (-15.0, 15.0),
+    'axis': (0.0, 180.0),
+    'prism': (0.0, 20.0),
+    'add': (0.0, 5.0),
+    'pd': (10.0, 90.0),
+}
+
+IMPORT_COLUMNS = ['patient_key', 'test_date', 'branch', 'optometrist', 'notes'] + [
+    '%s_%s' % (name, eye) for eye in ('od', 'os') for name in PRESCRIPTION_NUMERIC_FIELDS + ('va',)
+]
+
+
+class OpticalTestImportWizard(models.TransientModel):
+    _name = "optical.test.import.wizard"
+    _description = "Optical Test History Import"
+
+    file = fields.Binary(string="CSV File", required=True)
+    filename = fields.Char(string="File Name")
+    patient_key = fields.Selection(
+        [('ref', 'Internal Reference'), ('phone', 'Phone'), ('email', 'Email')],
+        string="Match Patients By",
+        default='ref',
+        required=True,
+        help="How the patient_key column is matched to existing patients."
+    )
+    default_branch_id = fields.Many2one(
+        "optical.branch",
+        string="Default Branch",
+        help="Branch of the rows without a branch column value."
+    )
+    chunk_size = fields.Integer(string="Rows per Chunk", default=1000)
+    state = fields.Selection([('draft', 'Draft'), ('done', 'Done')], default='draft')
+    test_count = fields.Integer(string="Tests Created", readonly=True)
+    error_count = fields.Integer(string="Rows Rejected", readonly=True)
+    duration = fields.Float(string="Duration (s)", readonly=True)
+    error_report = fields.Binary(string="Error Report", readonly=True)
+    error_report_name = fields.Char(readonly=True)
+
+    def _patient_map(self):
+        """Normalized patient key to partner id, loaded once for the whole file."""
+        column = {'ref': 'ref', 'phone': 'optical_phone_key', 'email': 'optical_email_key'}[self.patient_key]
+        self.env['res.partner'].flush_model([column])
+        self.env.cr.execute("""
+            SELECT %s, id FROM res_partner WHERE active AND %s IS NOT NULL ORDER BY id
+        """ % (column, column))
+        mapping = {}
+        for key, partner_id in self.env.cr.fetchall():
+            mapping.setdefault(key.strip().lower() if column == 'ref' else key, partner_id)
+        # Phone numbers are also matched against the mobile key
+        if self.patient_key == 'phone':
+            self.env.cr.execute("""
+                SELECT optical_mobile_key, id FROM res_partner
+                WHERE active AND optical_mobile_key IS NOT NULL ORDER BY id
+            """)
+            for key, partner_id in self.env.cr.fetchall():
+                mapping.setdefault(key, partner_id)
+        return mapping
+
+    def _normalize_key(self, value):
+        if self.patient_key == 'phone':
+            return normalize_phone(value)
+        if self.patient_key == 'email':
+            return normalize_email(value)
+        return (value or '').strip().lower() or False
+
+    def _lookup_maps(self):
+        """Branches by name or code and optometrists by login or name."""
+        branches = csv_import.name_map(self.env['optical.branch'])
+        users = csv_import.name_map(self.env['res.users'], ('login', 'name'))
+        return branches, users
+
+    def _prepare_row(self, row, patients, branches, users):
+        """Return the optical.test values of a CSV row; raise ``ValueError`` if invalid."""
+        key = self._normalize_key(row.get('patient_key'))
+        partner_id = patients.get(key) if key else None
+        if not partner_id:
+            raise ValueError(_("No patient matches %s.", row.get('patient_key') or '-'))
+        test_date = csv_import.parse_date(row.get('test_date'))
+        if not test_date:
+            raise ValueError(_("Test date is required."))
+
+        branch_id = self.default_branch_id.id
+        if row.get('branch'):
+            branch_id = branches.get(row['branch'].lower())
+            if not branch_id:
+                raise ValueError(_("Unknown branch %s.", row['branch']))
+        optometrist_id = self.env.uid
+        if row.get('optometrist'):
+            optometrist_id = users.get(row['optometrist'].lower())
+            if not optometrist_id:
+                raise ValueError(_("Unknown optometrist %s.", row['optometrist']))
+
+        test_vals = {'notes': row.get('notes')}
+        for eye in ('od', 'os'):
+            test_vals['va_%s' % eye] = row.get('va_%s' % eye)
+            for name in PRESCRIPTION_NUMERIC_FIELDS:
+                field = '%s_%s' % (name, eye)
+                value = csv_import.parse_float(row.get(field))
+                if value is None:
+                    continue
+                low, high = PRESCRIPTION_RANGES[name]
+                if not low <= value <= high:
+                    raise ValueError(_("%(field)s %(value)s is outside %(low)s to %(high)s.",
+                                       field=field, value=value, low=low, high=high))
+                test_vals[field] = value
+
+        vals = self.env['pos.order']._optical_prepare_test_vals(test_vals)
+        vals.update({
+            'patient_id': partner_id,
+            'test_date': datetime.datetime.combine(test_date, datetime.time(12, 0)),
+            'optometrist_id': optometrist_id,
+            'company_id': self.env.company.id,
+        })
+        if branch_id:
+            vals['branch_id'] = branch_id
+        return vals
+
+    def _create_tests(self, vals_list):
+        # Historical tests: no chatter, tracking or stage history
+        Test = self.env['optical.test'].sudo().with_context(optical_skip_stage_log=True, **csv_import.IMPORT_CONTEXT)
+        tests = Test.create(vals_list)
+        self.env.flush_all()
+        return len(tests)
+
+    def _import_chunk(self, rows, patients, branches, users, report):
+        """Validate the whole chunk, then create its valid rows at once; returns the tests created."""
+        prepared = []
+        for row in rows:
+            try:
+                prepared.append((row, self._prepare_row(row, patients, branches, users)))
+            except ValueError as e:
+                report.add(row, str(e))
+        if not prepared:
+            return 0
+
+        try:
+            with self.env.cr.savepoint():
+                return self._create_tests([vals for _row, vals in prepared])
+        except Exception as e:
+            _logger.info('[BP Optical POS] Test import chunk failed (%s), retrying row by row', e)
+            self.env.invalidate_all()
+
+        # Isolate the failing rows so the rest of the chunk still goes in
+        created = 0
+        for row, vals in prepared:
+            try:
+                with self.env.cr.savepoint():
+                    created += self._create_tests([vals])
+            except Exception as e:
+                self.env.invalidate_all()
+                report.add(row, str(e))
+        return created
+
+    def action_import(self):
+        self.ensure_one()
+        if self.chunk_size <= 0:
+            raise UserError(_("Rows per chunk must be positive."))
+        start = time.monotonic()
+        patients = self._patient_map()
+        branches, users = self._lookup_maps()
+        report = csv_import.ErrorReport(IMPORT_COLUMNS)
+        created = 0
+        try:
+            for first_line, rows in csv_import.iter_chunks(self.file, self.chunk_size):
+                created += self._import_chunk(rows, patients, branches, users, report)
+                # Keep the cache, and memory, from growing with the file
+                self.env.invalidate_all()
+                _logger.info('[BP Optical POS] Imported test rows from line %s: %s tests so far', first_line, created)
+        except (ValueError, csv.Error) as e:
+            # Decoding errors surface here, not when the wizard is opened
+            raise UserError(_("The file could not be read as a UTF-8 CSV file: %s", e))
+
+        self.write({
+            'state': 'done',
+            'test_count': created,
+            'error_count': len(report),
+            'duration': round(time.monotonic() - start, 1),
+            'error_report': report.to_base64() if len(report) else False,
+            'error_report_name': 'test_import_errors.csv' if len(report) else False,
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }